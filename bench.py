@@ -0,0 +1,228 @@
+# bench.py
+# 성능 측정 - 시드를 고정한 가상 여행(사람 10 ~ 10⁴명, 지출 10² ~ 10⁶건, 5개 통화)을 만들어서
+# 정산 / 통화별 합계 / 화면 그리기(Flask 테스트 클라이언트) / 지출 추가·삭제 왕복 / 저장·로드 시간을 잼
+# 결과는 JSON 으로 출력 - 변경 전후 결과를 비교해서 느려졌는지 확인
+#
+#   python bench.py                          # 기본 크기들, 모든 저장 방식과 정산 엔진
+#   python bench.py --size 1000x100000 --storage sqlite --out bench.json
+#   python bench.py --preset full            # 사람 10⁴명 x 지출 10⁶건까지 (오래 걸림)
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from bitset import mask_of
+import expense
+from storage import BinaryStorage, JsonStorage, SqliteStorage
+from trip import CURRENCIES, SETTLEMENT_ENGINES, TripCache, use_engine
+
+# (사람 수, 지출 수)
+PRESETS = {
+    'small': [(10, 100), (100, 1000)],
+    'medium': [(10, 100), (100, 1000), (1000, 10000), (1000, 100000)],
+    'full': [(10, 100), (100, 1000), (1000, 10000), (1000, 100000), (10000, 1000000)],
+}
+STORAGE_MODES = ['json', 'journal', 'binary', 'sqlite']
+
+# 가상 여행: 이 기간 안의 날짜, 참가자는 1 ~ 이 수만큼 (사람이 적으면 가끔 전체)
+TRIP_DAYS = 14
+MAX_PARTICIPANTS = 8
+BASE_RATES = {'JPY': 9.2, 'USD': 1350, 'EUR': 1450, 'CNY': 190}
+
+
+def generate_trip(n_people, n_expenses, seed=0):
+    """저장 형식(스냅샷) 가상 여행 - 같은 seed 면 항상 같은 데이터"""
+    rng = random.Random(seed)
+    start = datetime.date(2025, 1, 1)
+    dates = [(start + datetime.timedelta(days=day)).isoformat() for day in range(TRIP_DAYS)]
+
+    people = [{'id': person_id, 'name': f'p{person_id}'} for person_id in range(n_people)]
+    everyone = mask_of(range(n_people))
+    expenses = []
+    for expense_id in range(1, n_expenses + 1):
+        if n_people <= 20 and rng.random() < 0.3:
+            participants = everyone
+        else:
+            participants = mask_of(rng.sample(range(n_people), rng.randint(1, min(n_people, MAX_PARTICIPANTS))))
+        expenses.append({
+            'id': expense_id,
+            'description': f'지출 {expense_id}',
+            'amount': round(rng.uniform(1, 100000), 2),
+            'currency': rng.choice(CURRENCIES),
+            'date': rng.choice(dates),
+            'payer': rng.randrange(n_people),
+            'participants': participants,
+        })
+    # 통화마다 기간 중 몇 번 바뀌는 날짜별 환율
+    rate_history = {}
+    for currency, rate in BASE_RATES.items():
+        changes = sorted(rng.sample(dates, 3))
+        rate_history[currency] = [[date, round(rate * rng.uniform(0.95, 1.05), 4)] for date in changes]
+    return {
+        'people': people,
+        'expenses': expenses,
+        'exchange_rates': dict(BASE_RATES),
+        'rate_history': rate_history,
+        'next_expense_id': n_expenses + 1,
+        'next_person_id': n_people,
+        'seq': 0,
+    }
+
+
+def measure(func, repeat):
+    """func() 를 repeat 번 실행한 시간(초) 요약"""
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - started)
+    return {'min': min(runs), 'median': statistics.median(runs), 'mean': statistics.fmean(runs),
+            'runs': len(runs)}
+
+
+def write_snapshot(mode, directory, snapshot):
+    """여행 폴더에 저장 방식에 맞는 파일로 스냅샷 기록 (expense.make_trip 이 읽는 위치)"""
+    os.makedirs(directory, exist_ok=True)
+    if mode == 'sqlite':
+        storage = SqliteStorage(os.path.join(directory, expense.SQLITE_FILE))
+        storage.save(snapshot)
+        storage.close()
+    elif mode == 'binary':
+        BinaryStorage(os.path.join(directory, expense.BINARY_FILE),
+                      os.path.join(directory, expense.BINARY_JOURNAL_FILE)).save(snapshot)
+    else:
+        JsonStorage(os.path.join(directory, expense.DATA_FILE)).save(snapshot)
+
+
+def data_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def bench_scenario(n_people, n_expenses, mode, engines, repeat, seed, workdir):
+    """크기 하나 x 저장 방식 하나의 측정 결과"""
+    trip_id = f'bench-{n_people}x{n_expenses}-{mode}'
+    directory = os.path.join(workdir, trip_id)
+    write_snapshot(mode, directory, generate_trip(n_people, n_expenses, seed))
+
+    expense.STORAGE_MODE = mode
+    expense.TRIPS_DIR = workdir
+    use_engine('ledger')
+    timings = {}
+    result = {'people': n_people, 'expenses': n_expenses, 'storage': mode, 'timings': timings}
+
+    trip = expense.trips.acquire(trip_id)
+    try:
+        timings['load'] = measure(trip.load, repeat)
+        timings['rebuild_ledger'] = measure(trip.rebuild_ledger, repeat)
+        timings['save'] = measure(trip.save, repeat)
+        result['data_bytes'] = data_bytes(directory)
+
+        timings['calculate_settlement'] = measure(trip.calculate_settlement, repeat)
+        for engine in engines:
+            use_engine(engine)
+            trip.sync_columnar()
+            timings[f'balances_{engine}'] = measure(trip.get_balances, repeat)
+            timings[f'totals_{engine}'] = measure(trip.get_totals, repeat)
+        use_engine('ledger')
+        trip.sync_columnar()
+        # 메모 없이 처음 환산할 때 (환율이 바뀐 직후와 같음)
+        timings['balances_ledger_cold_rates'] = measure(
+            lambda: (trip.rebuild_rate_index(), trip.get_balances()), repeat)
+    finally:
+        expense.trips.release(trip)
+
+    client = expense.app.test_client()
+    page = f'/trip/{trip_id}/'
+    def render_cold():
+        trip.reset_views()
+        trip.view_cache = {}
+        response = client.get(page)
+        assert response.status_code == 200, response.status
+    timings['render'] = measure(render_cold, repeat)
+    timings['render_cached'] = measure(lambda: client.get(page), repeat)
+    # 브라우저처럼 압축을 받을 때 (압축 시간 포함) - 보낸 바이트 수도 같이
+    timings['render_gzip'] = measure(lambda: client.get(page, headers={'Accept-Encoding': 'gzip'}), repeat)
+    result['page_bytes'] = len(client.get(page).get_data())
+    result['page_bytes_gzip'] = len(client.get(page, headers={'Accept-Encoding': 'gzip'}).get_data())
+
+    def round_trip():
+        expense_id = trip.data['next_expense_id']
+        response = client.post(page + 'add_expense', data={
+            'description': '측정', 'amount': '1000', 'currency': 'JPY', 'payer': 'p0', 'date': '2025-01-05'})
+        assert response.status_code == 302 and expense_id in trip.data['expenses']
+        response = client.get(f'{page}remove_expense/{expense_id}')
+        assert response.status_code == 302 and expense_id not in trip.data['expenses']
+    timings['add_remove_round_trip'] = measure(round_trip, repeat)
+    return result
+
+
+def parse_size(text):
+    n_people, n_expenses = text.lower().split('x')
+    return int(n_people), int(n_expenses)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='여행 경비 정산 성능 측정 (결과는 JSON)')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='medium')
+    parser.add_argument('--size', action='append', type=parse_size, metavar='사람x지출',
+                        help='측정할 크기 (예: 100x1000, 여러 번 지정 가능 - 지정하면 preset 무시)')
+    parser.add_argument('--storage', default=','.join(STORAGE_MODES), help='저장 방식 (쉼표로 구분)')
+    parser.add_argument('--engine', default=','.join(SETTLEMENT_ENGINES), help='정산 엔진 (쉼표로 구분)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='결과 JSON 파일 (없으면 표준 출력)')
+    args = parser.parse_args(argv)
+
+    modes = args.storage.split(',')
+    engines = args.engine.split(',')
+    for mode in modes:
+        if mode not in STORAGE_MODES:
+            parser.error(f'알 수 없는 저장 방식: {mode}')
+    for engine in engines:
+        if engine not in SETTLEMENT_ENGINES:
+            parser.error(f'알 수 없는 정산 엔진: {engine}')
+
+    workdir = tempfile.mkdtemp(prefix='expense-bench-')
+    # 측정하는 여행 하나만 메모리에 둠 (다음 크기의 여행을 열면 이전 여행은 내려감)
+    expense.trips = TripCache(expense.make_trip, max_trips=1)
+    results = []
+    try:
+        for n_people, n_expenses in args.size or PRESETS[args.preset]:
+            for mode in modes:
+                print(f'{n_people}명 x {n_expenses}건 ({mode})', file=sys.stderr)
+                results.append(bench_scenario(n_people, n_expenses, mode, engines,
+                                              args.repeat, args.seed, workdir))
+    finally:
+        with expense.trips.lock:
+            expense.trips.max_trips = 0
+            expense.trips.evict()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'started': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'unit': 'seconds',
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+# binsnap.py
+# 작은 바이너리 스냅샷 형식 - 지출을 고정 폭 열(column)로, 설명/이름/날짜는 문자열 표로 저장
+# mmap 으로 열어서 파싱 없이 바로 쓰고, 지출 dict 는 실제로 꺼낼 때만 만듦 (LazyExpenses)
+# -> 큰 여행도 시작할 때 JSON 전체를 파싱하거나 지출마다 dict 를 만들지 않음
+#
+# 파일 구조 (리틀 엔디언, 각 구역은 8바이트 경계에서 시작):
+#   헤더        MAGIC, 개수들, 다음 id, seq, 구역 시작 위치들
+#   문자열 표    시작 위치(Q) n+1 개 + UTF-8 바이트
+#   사람        id(q), 이름 번호(I)
+#   지출        id(q), 금액(d), 통화 번호(B), 지불자 id(i), 설명 번호(I), 날짜 번호(I, 없으면 NO_STRING),
+#               참가자 목록 시작 위치(Q) n+1 개
+#   참가자 목록  사람 id(i) - 지출마다 이어 붙임
+#   메타        JSON (통화 목록, 기본 환율, 날짜별 환율)
+#
+# 참가자는 비트마스크 대신 id 목록으로 저장 - 사람이 많으면(10⁴명) 비트마스크가 지출마다 1KB 를 넘음
+import array
+from collections.abc import MutableMapping
+import json
+import mmap
+import os
+import struct
+import sys
+
+from bitset import iter_bits, mask_of
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'EXPSNAP1'
+NO_STRING = 0xFFFFFFFF
+SECTIONS = ['string_offsets', 'strings', 'person_ids', 'person_names',
+            'expense_ids', 'amounts', 'currencies', 'payers', 'descriptions', 'dates',
+            'pool_offsets', 'pool', 'meta']
+HEADER = struct.Struct('<8s7Q%dQ' % len(SECTIONS))
+
+
+def is_binary(path):
+    """파일이 이 형식인지 (앞 8바이트로 확인)"""
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_binary(f, snapshot):
+    """저장 형식 스냅샷(사람/지출 목록) -> 바이너리 파일 f"""
+    strings = []
+    string_ids = {}
+
+    def intern(text):
+        if text is None:
+            return NO_STRING
+        index = string_ids.get(text)
+        if index is None:
+            index = string_ids[text] = len(strings)
+            strings.append(text)
+        return index
+
+    people = snapshot['people']
+    person_ids = array.array('q', (person['id'] for person in people))
+    person_names = array.array('I', (intern(person['name']) for person in people))
+
+    currencies = []
+    currency_codes = {}
+    expenses = snapshot['expenses']
+    columns = {name: array.array(code) for name, code in
+               (('expense_ids', 'q'), ('amounts', 'd'), ('currencies', 'B'), ('payers', 'i'),
+                ('descriptions', 'I'), ('dates', 'I'), ('pool', 'i'))}
+    pool_offsets = array.array('Q', [0])
+    for expense in expenses:
+        currency = expense.get('currency', 'JPY')
+        if currency not in currency_codes:
+            currency_codes[currency] = len(currencies)
+            currencies.append(currency)
+        columns['expense_ids'].append(expense['id'])
+        columns['amounts'].append(expense['amount'])
+        columns['currencies'].append(currency_codes[currency])
+        columns['payers'].append(expense['payer'])
+        columns['descriptions'].append(intern(expense['description']))
+        columns['dates'].append(intern(expense.get('date')))
+        columns['pool'].extend(iter_bits(expense['participants']))
+        pool_offsets.append(len(columns['pool']))
+
+    encoded = [text.encode('utf-8') for text in strings]
+    string_offsets = array.array('Q', [0])
+    for blob in encoded:
+        string_offsets.append(string_offsets[-1] + len(blob))
+    meta = json.dumps({'currencies': currencies,
+                       'exchange_rates': snapshot['exchange_rates'],
+                       'rate_history': snapshot.get('rate_history', {})}, ensure_ascii=False)
+
+    sections = dict(columns, string_offsets=string_offsets, strings=b''.join(encoded),
+                    person_ids=person_ids, person_names=person_names,
+                    pool_offsets=pool_offsets, meta=meta.encode('utf-8'))
+    position = HEADER.size
+    offsets = []
+    payloads = []
+    for name in SECTIONS:
+        payload = sections[name]
+        if isinstance(payload, array.array):
+            if sys.byteorder == 'big':
+                payload.byteswap()
+            payload = payload.tobytes()
+        padding = -position % 8
+        position += padding
+        offsets.append(position)
+        payloads.append(b'\0' * padding + payload)
+        position += len(payload)
+
+    f.write(HEADER.pack(MAGIC, len(people), len(expenses), len(strings), len(columns['pool']),
+                        snapshot.get('next_expense_id', 1), snapshot.get('next_person_id', 0),
+                        snapshot.get('seq', 0), *offsets))
+    for payload in payloads:
+        f.write(payload)
+
+
+class BinarySnapshot:
+    """mmap 으로 연 바이너리 스냅샷 - 열은 복사 없이 memoryview 로 읽음"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if os.name == 'nt':
+                # Windows 는 mmap 한 파일을 os.replace 로 바꿀 수 없으므로 메모리로 읽음
+                self.buffer = f.read()
+            else:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_people, self.n_expenses, n_strings, n_pool,
+         self.next_expense_id, self.next_person_id, self.seq, *offsets) = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError(f'{path} 는 바이너리 스냅샷이 아닙니다')
+        offsets = dict(zip(SECTIONS, offsets))
+        view = memoryview(self.buffer)
+
+        def column(name, code, count):
+            start = offsets[name]
+            raw = view[start:start + count * struct.calcsize(code)]
+            if sys.byteorder == 'little':
+                return raw.cast(code)
+            values = array.array(code, raw)
+            values.byteswap()
+            return values
+
+        self.string_offsets = column('string_offsets', 'Q', n_strings + 1)
+        self.strings = view[offsets['strings']:offsets['strings'] + self.string_offsets[-1]]
+        self.person_ids = column('person_ids', 'q', self.n_people)
+        self.person_names = column('person_names', 'I', self.n_people)
+        self.expense_ids = column('expense_ids', 'q', self.n_expenses)
+        self.amounts = column('amounts', 'd', self.n_expenses)
+        self.currency_codes = column('currencies', 'B', self.n_expenses)
+        self.payers = column('payers', 'i', self.n_expenses)
+        self.descriptions = column('descriptions', 'I', self.n_expenses)
+        self.dates = column('dates', 'I', self.n_expenses)
+        self.pool_offsets = column('pool_offsets', 'Q', self.n_expenses + 1)
+        self.pool = column('pool', 'i', n_pool)
+        meta = json.loads(bytes(view[offsets['meta']:]).decode('utf-8'))
+        self.currencies = meta['currencies']
+        self.exchange_rates = meta['exchange_rates']
+        self.rate_history = meta['rate_history']
+
+    def string(self, index):
+        if index == NO_STRING:
+            return None
+        return str(self.strings[self.string_offsets[index]:self.string_offsets[index + 1]], 'utf-8')
+
+    def participants(self, row):
+        return self.pool[self.pool_offsets[row]:self.pool_offsets[row + 1]]
+
+    def expense(self, row):
+        """row 번째 지출 dict 만들기"""
+        expense = {
+            'id': self.expense_ids[row],
+            'description': self.string(self.descriptions[row]),
+            'amount': self.amounts[row],
+            'currency': self.currencies[self.currency_codes[row]],
+            'payer': self.payers[row],
+            'participants': mask_of(self.participants(row)),
+        }
+        date = self.string(self.dates[row])
+        if date:
+            expense['date'] = date
+        return expense
+
+    def to_snapshot(self, expenses):
+        """저장 형식 스냅샷 (지출은 expenses 그대로)"""
+        return {
+            'people': [{'id': self.person_ids[i], 'name': self.string(self.person_names[i])}
+                       for i in range(self.n_people)],
+            'expenses': expenses,
+            'exchange_rates': dict(self.exchange_rates),
+            'rate_history': dict(self.rate_history),
+            'next_expense_id': self.next_expense_id,
+            'next_person_id': self.next_person_id,
+            'seq': self.seq,
+        }
+
+    def aggregate_ledger(self):
+        """사람별·(통화, 날짜)별 잔액과 (통화, 날짜)별 합계 - 지출 dict 를 만들지 않고 열에서 바로"""
+        if self.n_expenses == 0:
+            return {}, {}
+        if np is not None:
+            return self.aggregate_ledger_numpy()
+        balances = {}
+        totals = {}
+        keys = {}
+        for row in range(self.n_expenses):
+            code = (self.currency_codes[row], self.dates[row])
+            key = keys.get(code)
+            if key is None:
+                key = keys[code] = (self.currencies[code[0]], self.string(code[1]))
+            amount = self.amounts[row]
+            participants = self.participants(row)
+            share = amount / len(participants)
+            ledger_row = balances.setdefault(self.payers[row], {})
+            ledger_row[key] = ledger_row.get(key, 0) + amount
+            for participant in participants:
+                ledger_row = balances.setdefault(participant, {})
+                ledger_row[key] = ledger_row.get(key, 0) - share
+            totals[key] = totals.get(key, 0) + amount
+        return balances, totals
+
+    def aggregate_ledger_numpy(self):
+        currency_codes = np.asarray(self.currency_codes, dtype=np.int64)
+        dates = np.asarray(self.dates, dtype=np.int64)
+        amounts = np.asarray(self.amounts)
+        payers = np.asarray(self.payers, dtype=np.int64)
+        pool = np.asarray(self.pool, dtype=np.int64)
+        counts = np.diff(np.asarray(self.pool_offsets, dtype=np.int64))
+
+        # (통화, 날짜) 조합마다 번호
+        combined = currency_codes * (int(dates.max()) + 1) + dates
+        key_codes, first_rows, key_index = np.unique(combined, return_index=True, return_inverse=True)
+        n_keys = len(key_codes)
+        keys = [(self.currencies[int(currency_codes[row])], self.string(int(dates[row]))) for row in first_rows]
+
+        n_people = int(max(payers.max(), pool.max() if len(pool) else 0)) + 1
+        paid = np.bincount(payers * n_keys + key_index, weights=amounts, minlength=n_people * n_keys)
+        shares = np.repeat(amounts / np.maximum(counts, 1), counts)
+        owed = np.bincount(pool * n_keys + np.repeat(key_index, counts), weights=shares,
+                           minlength=n_people * n_keys)
+        net = (paid - owed).reshape(n_people, n_keys)
+        touched = (np.bincount(payers * n_keys + key_index, minlength=n_people * n_keys) +
+                   np.bincount(pool * n_keys + np.repeat(key_index, counts), minlength=n_people * n_keys)
+                   ).reshape(n_people, n_keys)
+
+        balances = {}
+        for person, key in zip(*np.nonzero(touched)):
+            balances.setdefault(int(person), {})[keys[key]] = float(net[person, key])
+        totals = np.bincount(key_index, weights=amounts, minlength=n_keys)
+        return balances, dict(zip(keys, totals.tolist()))
+
+
+class LazyExpenses(MutableMapping):
+    """지출 id -> 지출 (dict 처럼 씀) - 바이너리 스냅샷의 지출은 꺼낼 때 만들어서 캐시
+
+    순서는 dict 와 같이 넣은 순서. 바뀌거나 지워지지 않은 동안은 aggregate_ledger() 로
+    열에서 바로 장부를 만들 수 있음.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        # 지출 id -> 행 번호(아직 안 만든 지출) 또는 지출 dict
+        self.items_by_id = dict(zip(snapshot.expense_ids.tolist(), range(snapshot.n_expenses)))
+        self.modified = False
+
+    def __getitem__(self, expense_id):
+        value = self.items_by_id[expense_id]
+        if isinstance(value, int):
+            value = self.items_by_id[expense_id] = self.snapshot.expense(value)
+        return value
+
+    def __setitem__(self, expense_id, expense):
+        self.items_by_id[expense_id] = expense
+        self.modified = True
+
+    def __delitem__(self, expense_id):
+        del self.items_by_id[expense_id]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.items_by_id)
+
+    def __len__(self):
+        return len(self.items_by_id)
+
+    def __contains__(self, expense_id):
+        return expense_id in self.items_by_id
+
+    def peek(self, expense_id):
+        """지출 하나 (없으면 None) - 꺼낸 dict 를 캐시하지 않음 (내보내기처럼 한 번 읽고 버릴 때)"""
+        value = self.items_by_id.get(expense_id)
+        if isinstance(value, int):
+            return self.snapshot.expense(value)
+        return value
+
+    def values(self):
+        # 전체를 훑을 때는 만든 dict 를 캐시하지 않음 (메모리에는 꺼내 본 지출만 남음)
+        expense = self.snapshot.expense
+        return (value if not isinstance(value, int) else expense(value)
+                for value in self.items_by_id.values())
+
+    def items(self):
+        expense = self.snapshot.expense
+        return ((expense_id, value if not isinstance(value, int) else expense(value))
+                for expense_id, value in self.items_by_id.items())
+
+    def aggregate_ledger(self):
+        """스냅샷 그대로일 때만 열에서 계산한 장부 (바뀌었으면 None)"""
+        if self.modified:
+            return None
+        return self.snapshot.aggregate_ledger()
+
+
+def read_binary(path):
+    """바이너리 스냅샷 -> 저장 형식 스냅샷 (지출은 LazyExpenses)"""
+    snapshot = BinarySnapshot(path)
+    return snapshot.to_snapshot(LazyExpenses(snapshot))
+
@@ -0,0 +1,25 @@
+# bitset.py
+# 참가자 집합을 사람 id 비트마스크(int)로 다루는 도우미 - 비트 i 가 켜져 있으면 id i 가 참가
+
+
+def mask_of(person_ids):
+    mask = 0
+    for person_id in person_ids:
+        mask |= 1 << person_id
+    return mask
+
+
+def has_bit(mask, person_id):
+    return (mask >> person_id) & 1 == 1
+
+
+def iter_bits(mask):
+    """켜진 비트의 id 를 작은 것부터"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def bit_count(mask):
+    return bin(mask).count('1')
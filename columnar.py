@@ -0,0 +1,128 @@
+# columnar.py
+# NumPy 정산 엔진 - 지출을 열(column) 배열로 저장하고 잔액/(통화, 날짜)별 합계를 벡터 연산으로 계산
+# NumPy 가 없으면 HAVE_NUMPY = False (expense.py 에서 순수 파이썬 계산으로 대체)
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    np = None
+    HAVE_NUMPY = False
+
+from bitset import bit_count, iter_bits
+
+
+class GrowableArray:
+    """append 가 분할 상환 O(1) 인 1차원 배열 (용량을 두 배씩 늘림)"""
+
+    def __init__(self, dtype, capacity=64):
+        self.buffer = np.zeros(capacity, dtype=dtype)
+        self.size = 0
+
+    def append(self, value):
+        if self.size == len(self.buffer):
+            grown = np.zeros(len(self.buffer) * 2, dtype=self.buffer.dtype)
+            grown[:self.size] = self.buffer
+            self.buffer = grown
+        self.buffer[self.size] = value
+        self.size += 1
+
+    @property
+    def values(self):
+        return self.buffer[:self.size]
+
+
+class ColumnarExpenses:
+    """지출 열 저장소
+
+    amounts / key_codes / payers / live 는 지출 한 건당 한 칸,
+    key_codes 는 (통화, 날짜) 환율 키 번호 - 환율은 키마다 한 번만 찾아서 벡터로 펼침.
+    참가자는 (지출 행, 사람 열) 쌍의 희소 행렬(COO)로 저장.
+    삭제된 지출은 live=False 로만 표시하고, 절반 이상이 삭제되면 다시 압축.
+    """
+
+    def __init__(self, currencies):
+        self.currencies = list(currencies)
+        self.rate_keys = []      # 키 번호 -> (통화, 날짜)
+        self.rate_key_index = {}
+        self.person_index = {}
+        self.people = []
+        self.reset_rows()
+
+    def reset_rows(self):
+        self.amounts = GrowableArray(np.float64)
+        self.key_codes = GrowableArray(np.int32)
+        self.payers = GrowableArray(np.int32)
+        self.counts = GrowableArray(np.int32)
+        self.live = GrowableArray(np.bool_)
+        self.incidence_rows = GrowableArray(np.int32)
+        self.incidence_cols = GrowableArray(np.int32)
+        self.rows = {}  # 지출 id -> (행 번호, 지출)
+        self.dead = 0
+
+    @classmethod
+    def from_data(cls, data, currencies):
+        store = cls(currencies)
+        for person_id in data['people']:
+            store.add_person(person_id)
+        for expense in data['expenses'].values():
+            store.add(expense)
+        return store
+
+    def add_person(self, person_id):
+        if person_id not in self.person_index:
+            self.person_index[person_id] = len(self.people)
+            self.people.append(person_id)
+
+    def add(self, expense):
+        row = self.amounts.size
+        self.amounts.append(expense['amount'])
+        key = (expense.get('currency', 'JPY'), expense.get('date'))
+        code = self.rate_key_index.get(key)
+        if code is None:
+            code = self.rate_key_index[key] = len(self.rate_keys)
+            self.rate_keys.append(key)
+        self.key_codes.append(code)
+        self.payers.append(self.person_index[expense['payer']])
+        self.counts.append(bit_count(expense['participants']))
+        self.live.append(True)
+        for participant in iter_bits(expense['participants']):
+            self.incidence_rows.append(row)
+            self.incidence_cols.append(self.person_index[participant])
+        self.rows[expense['id']] = (row, expense)
+
+    def remove(self, expense):
+        row, _ = self.rows.pop(expense['id'])
+        self.live.buffer[row] = False
+        self.dead += 1
+        if self.dead * 2 > self.amounts.size:
+            self.compact()
+
+    def compact(self):
+        """삭제 표시된 행을 빼고 다시 만듦"""
+        expenses = [expense for _, expense in sorted(self.rows.values(), key=lambda item: item[0])]
+        self.reset_rows()
+        for expense in expenses:
+            self.add(expense)
+
+    def krw_amounts(self, factor):
+        """지출별 원화 금액 (삭제된 지출은 0) - factor(통화, 날짜) 는 원화 환산 배율"""
+        rate_vector = np.array([factor(*key) for key in self.rate_keys], dtype=np.float64)
+        return self.amounts.values * rate_vector[self.key_codes.values] * self.live.values
+
+    def balances(self, factor):
+        """사람 id 별 원화 잔액 = 낸 금액 합 - 참가 몫 합"""
+        n_people = len(self.people)
+        krw = self.krw_amounts(factor)
+        paid = np.bincount(self.payers.values, weights=krw, minlength=n_people)
+        share = krw / np.maximum(self.counts.values, 1)
+        owed = np.bincount(self.incidence_cols.values,
+                           weights=share[self.incidence_rows.values],
+                           minlength=n_people)
+        return dict(zip(self.people, (paid - owed).tolist()))
+
+    def totals_by_key(self):
+        """(통화, 날짜) -> 지출 합계"""
+        totals = np.bincount(self.key_codes.values,
+                             weights=self.amounts.values * self.live.values,
+                             minlength=len(self.rate_keys))
+        return dict(zip(self.rate_keys, totals.tolist()))
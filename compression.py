@@ -0,0 +1,73 @@
+# compression.py
+# 응답 압축 - 브라우저가 받아 주면 brotli (brotli 패키지가 있을 때만), 아니면 gzip
+# 조각조각 보내는 응답(내보내기, 변경 알림)은 그대로 두고, 정적 파일은 (ETag, 방식)마다 한 번만 압축
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 이보다 작은 응답은 압축해도 별 차이가 없음
+COMPRESS_MIN_BYTES = 500
+COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'text/plain', 'text/csv', 'application/json',
+                      'application/javascript', 'application/x-ndjson'}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# (ETag, 방식) -> 압축한 바이트 (정적 파일만 - 파일 수만큼만 쌓임)
+static_cache = {}
+static_cache_lock = threading.Lock()
+
+
+def choose_encoding(accept_encodings):
+    """Accept-Encoding 에서 쓸 방식 ('br' / 'gzip' / None)"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response, accept_encodings, static=False):
+    """after_request 에서 호출 - 압축할 만한 응답이면 그 자리에서 압축"""
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    # 압축 여부가 Accept-Encoding 에 따라 다르므로 중간 캐시가 섞지 않도록
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers or
+            (response.is_streamed and not static)):
+        return response
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    etag, weak = response.get_etag()
+    key = (etag, encoding)
+    body = static_cache.get(key) if static and etag else None
+    # send_file 의 응답은 파일을 그대로 넘기는 방식이라 읽으려면 먼저 꺼야 함
+    response.direct_passthrough = False
+    if body is None:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        body = compress(data, encoding)
+        if static and etag:
+            with static_cache_lock:
+                static_cache[key] = body
+    else:
+        response.close()
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    if etag and not weak:
+        # 압축한 표현은 바이트가 다르므로 약한 ETag 로 (If-None-Match 는 약한 비교라 304 는 그대로)
+        response.set_etag(etag, weak=True)
+    return response
@@ -1,688 +1,718 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import (Blueprint, Flask, Response, abort, g, get_template_attribute, make_response,
+                   render_template, request, jsonify, redirect, stream_with_context, url_for)
+import atexit
+import click
+import hashlib
 import json
+import logging
+import math
 import os
+import re
+import signal
+import sys
+import time
+
+import metrics
+
+from binsnap import is_binary, read_binary, write_binary
+from bitset import has_bit
+from compression import compress_response
+from exporter import BALANCE_FIELDS, EXPENSE_FIELDS, EXPORT_FORMATS, balance_rows, encode_rows, expense_rows
+from importer import IMPORT_FORMATS, guess_format, import_rows, iter_rows
+from preview import preview
+from storage import (AsyncCommitter, BinaryStorage, GroupCommitter, JsonStorage, JournalStorage, ProcessLock,
+                     SqliteStorage, atomic_write)
+from trip import CURRENCIES, Trip, TripCache, from_snapshot, parse_date, to_snapshot, use_engine
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
+
+# 여행마다 data 를 따로 두고, 자주 쓰는 여행만 메모리(TripCache)에 올려 둠
+# / 아래 경로는 기본 여행, /trip/<id>/ 아래 경로는 해당 여행
+DEFAULT_TRIP = 'default'
+TRIP_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
 
-# 데이터 저장용 전역 변수 (실제 운영에서는 데이터베이스 사용 권장)
-data = {
-    'people': [],
-    'expenses': [],
-    'exchange_rates': {
-        'JPY': None,
-        'USD': None,
-        'EUR': None,
-        'CNY': None
-    }
-}
-
-# 데이터 파일 저장/로드
+# 데이터 파일 저장/로드 - 기본 여행은 현재 폴더, 나머지 여행은 TRIPS_DIR/<id>/ 에 같은 이름으로
 DATA_FILE = 'expense_data.json'
+TRIPS_DIR = os.environ.get('TRIPS_DIR', 'trips')
 
-def load_data():
-    global data
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        except:
-            pass
-
-def save_data():
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-def calculate_settlement():
-    """정산 계산 (모든 금액을 원화로 환산)"""
-    if not data['people'] or not data['expenses']:
-        return {}
-    
-    balances = {person: 0 for person in data['people']}
-    
-    for expense in data['expenses']:
-        amount = expense['amount']
-        currency = expense.get('currency', 'JPY')
-        payer = expense['payer']
-        participants = expense['participants']
-        
-        # 원화로 환산
-        if currency == 'KRW':
-            krw_amount = amount
-        else:
-            exchange_rate = data['exchange_rates'].get(currency)
-            if exchange_rate:
-                krw_amount = amount * exchange_rate
-            else:
-                krw_amount = amount  # 환율이 없으면 그대로 사용
-        
-        share_per_person = krw_amount / len(participants)
-        
-        balances[payer] += krw_amount
-        
-        for participant in participants:
-            balances[participant] -= share_per_person
-    
-    return balances
+# 저장 방식: 'json' (변경마다 전체 파일 저장) / 'journal' (변경분만 한 줄씩 추가 기록)
+#           'binary' (journal 과 같지만 스냅샷이 바이너리 - mmap 으로 바로 열고 지출은 꺼낼 때만 만듦)
+#           'sqlite' (정규화된 테이블, WAL)
+STORAGE_MODE = os.environ.get('STORAGE_MODE', 'json')
+JOURNAL_FILE = 'expense_data.journal'
+# 저널이 이만큼 쌓이면 스냅샷(DATA_FILE)으로 합침
+JOURNAL_COMPACT_EVERY = int(os.environ.get('JOURNAL_COMPACT_EVERY', 1000))
+BINARY_FILE = 'expense_data.bin'
+BINARY_JOURNAL_FILE = 'expense_data.bin.journal'
+SQLITE_FILE = 'expense_data.db'
+
+# 기록 시점 (durability): 'sync' (응답 전에 디스크에 기록 - 기본)
+#   'async' (메모리만 바꾸고 바로 응답, 배경 스레드가 PERSIST_INTERVAL_MS 마다 또는 변경이
+#            PERSIST_MAX_PENDING 개 쌓이면 기록 - 그 사이에 프로세스가 죽으면 최근 변경을 잃을 수 있음)
+# 어느 쪽이든 정상 종료할 때는 남은 변경을 모두 기록함
+DURABILITY = os.environ.get('DURABILITY', 'sync')
+PERSIST_INTERVAL_MS = int(os.environ.get('PERSIST_INTERVAL_MS', 50))
+PERSIST_MAX_PENDING = int(os.environ.get('PERSIST_MAX_PENDING', 100))
+
+# 여러 프로세스(gunicorn 워커 등)가 같은 데이터를 쓸 때 MULTIPROCESS=1
+# 변경은 여행마다 잠금 파일(LOCK_FILE)을 잡고 다시 읽기 -> 변경 -> 기록 순서로 처리하고,
+# 다른 워커의 변경은 잠금 파일의 변경 번호로 알아채서 그때만 다시 읽음 (항상 sync 로 기록)
+MULTIPROCESS = os.environ.get('MULTIPROCESS') == '1'
+LOCK_FILE = 'expense_data.lock'
+if MULTIPROCESS and DURABILITY == 'async':
+    logger.warning('MULTIPROCESS 모드에서는 DURABILITY=async 를 쓸 수 없어 sync 로 기록합니다')
+
+# 지출 내역 한 페이지 크기 (첫 페이지만 HTML 로 그리고 나머지는 스크롤할 때 API 로)
+EXPENSE_PAGE_SIZE = 50
+EXPENSE_PAGE_MAX = 200
+
+# 가정 변경 미리 보기(/api/preview) 한 요청의 시나리오 수 / 시나리오 하나의 변경 수 한도
+PREVIEW_MAX_SCENARIOS = 50
+PREVIEW_MAX_OPS = 200
+
+# 실시간 변경 알림(/api/events): 변경이 없어도 이 간격(초)마다 연결 유지 주석을 보내고 저장소를 다시 확인
+# (여러 프로세스 모드에서 다른 워커가 바꾼 내용도 이 간격 안에 알려짐), 끊기면 브라우저가 이 시간 뒤 재접속
+EVENTS_KEEPALIVE_S = 15
+EVENTS_RETRY_MS = 3000
+# 지출 줄과 정산 결과만 바꾸면 되는 변경 - 그 밖의 변경(사람, 환율, 초기화)은 화면을 다시 읽으라고 알림
+LIVE_OPS = ['add_expense', 'edit_expense', 'remove_expense']
+
+# ETag = 여행 id + 데이터 버전 + 서버 시작 시각 (다시 시작하면 템플릿이 바뀌었을 수 있으므로)
+ETAG_SALT = format(int(time.time()), 'x')
+
+# POST 지만 여행을 바꾸지 않는 라우트 - 없는 여행이면 만들지 않음
+READ_ONLY_POSTS = {'preview_changes'}
+
+# 메모리에 올려 둘 여행 수와 추정 메모리 한도
+TRIP_CACHE_SIZE = int(os.environ.get('TRIP_CACHE_SIZE', 128))
+TRIP_CACHE_MB = int(os.environ.get('TRIP_CACHE_MB', 256))
+
+def make_committer(write_batch):
+    if DURABILITY == 'async' and not MULTIPROCESS:
+        return AsyncCommitter(write_batch, PERSIST_INTERVAL_MS / 1000, PERSIST_MAX_PENDING)
+    return GroupCommitter(write_batch)
+
+def make_trip(trip_id, create=True):
+    """여행 id -> Trip - 폴더가 없는 여행은 create 일 때만 폴더를 만들고, 아니면 None"""
+    directory = '' if trip_id == DEFAULT_TRIP else os.path.join(TRIPS_DIR, trip_id)
+    if directory and not os.path.isdir(directory):
+        if not create:
+            return None
+        os.makedirs(directory, exist_ok=True)
+    data_file = os.path.join(directory, DATA_FILE)
+    options = {'make_committer': make_committer}
+    if MULTIPROCESS:
+        options['process_lock'] = ProcessLock(os.path.join(directory, LOCK_FILE))
+    if STORAGE_MODE == 'journal':
+        return Trip(trip_id, JournalStorage(data_file, os.path.join(directory, JOURNAL_FILE),
+                                            JOURNAL_COMPACT_EVERY), **options)
+    if STORAGE_MODE == 'binary':
+        # 바이너리 스냅샷이 없으면 기존 JSON 파일을 옮겨옴
+        return Trip(trip_id, BinaryStorage(os.path.join(directory, BINARY_FILE),
+                                           os.path.join(directory, BINARY_JOURNAL_FILE),
+                                           JOURNAL_COMPACT_EVERY),
+                    migrate_from=JsonStorage(data_file), **options)
+    if STORAGE_MODE == 'sqlite':
+        # 빈 DB 로 처음 시작할 때는 기존 JSON 파일을 옮겨옴
+        return Trip(trip_id, SqliteStorage(os.path.join(directory, SQLITE_FILE)),
+                    migrate_from=JsonStorage(data_file), **options)
+    return Trip(trip_id, JsonStorage(data_file), **options)
+
+trips = TripCache(make_trip, max_trips=TRIP_CACHE_SIZE, max_bytes=TRIP_CACHE_MB * 1024 * 1024)
+
+@atexit.register
+def flush_on_shutdown():
+    """종료할 때 아직 기록되지 않은 변경을 모두 기록 (async 모드)"""
+    trips.close()
+
+use_engine(os.environ.get('SETTLEMENT_ENGINE', 'ledger'))
+
+# 같은 라우트를 기본 여행(/)과 여행별 경로(/trip/<id>/)에 두 번 등록
+bp = Blueprint('trip', __name__)
+
+@bp.url_value_preprocessor
+def pull_trip_id(endpoint, values):
+    g.trip_id = (values or {}).pop('trip_id', DEFAULT_TRIP)
+    if not TRIP_ID_PATTERN.fullmatch(g.trip_id):
+        abort(404)
+
+@bp.url_defaults
+def add_trip_id(endpoint, values):
+    if endpoint.startswith('trips.') and 'trip_id' not in values:
+        values['trip_id'] = g.trip_id
+
+@bp.before_request
+def open_trip():
+    # 읽기 요청은 없는 여행의 폴더나 저장소 파일(.db, .lock)을 만들지 않음 - 처음 변경할 때 만듦
+    # 아직 기록된 적 없는 여행은 캐시에 넣지 않는 빈 여행으로 보여 줌
+    reading = request.method in ('GET', 'HEAD') or request.endpoint.split('.')[-1] in READ_ONLY_POSTS
+    trip = trips.acquire(g.trip_id, create=not reading)
+    g.new_trip = trip is None
+    if trip is None:
+        directory = os.path.join(TRIPS_DIR, g.trip_id)
+        trip = Trip(g.trip_id, JsonStorage(os.path.join(directory, DATA_FILE)))
+    g.trip = trip
+
+@bp.teardown_request
+def close_trip(exc):
+    trip = g.pop('trip', None)
+    if trip is not None and not g.pop('new_trip', False):
+        trips.release(trip)
+
+def trip_etag(trip, *variant):
+    """trip.reading() 안에서 호출 - 같은 버전이면 같은 응답"""
+    return '-'.join([trip.trip_id, str(trip.version), ETAG_SALT] + [str(part) for part in variant])
+
+def not_modified(etag):
+    """If-None-Match 가 etag 와 같으면 304 응답, 아니면 None"""
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(Response(status=304), etag)
+    return None
+
+def with_etag(response, etag):
+    # no-cache: 저장은 하되 쓸 때마다 ETag 로 확인
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+    return response
 
-@app.route('/')
+def trip_url(trip, endpoint, **values):
+    """여행의 기본 주소로 url_for - 캐시된 조각은 / 와 /trip/default/ 어느 쪽으로 들어와도 같아야 함"""
+    if trip.trip_id == DEFAULT_TRIP:
+        return url_for('trip.' + endpoint, **values)
+    return url_for('trips.' + endpoint, trip_id=trip.trip_id, **values)
+
+def expense_row_html(trip, expense):
+    """지출 내역 한 줄 (fragments.html 의 expense_row)"""
+    def render(view):
+        with metrics.phase('render'):
+            macro = get_template_attribute('fragments.html', 'expense_row')
+            return macro(view, trip_url(trip, 'remove_expense', expense_id=view['id']))
+    return trip.row_fragment(expense, render)
+
+def settlement_html(trip, exact):
+    """정산 결과 (총 지출 요약, 사람별 카드, 송금 안내) - 버전마다 한 번만 그림"""
+    def render():
+        view = trip.summary()
+        transfers = trip.transfers(exact)
+        with metrics.phase('render'):
+            macro = get_template_attribute('fragments.html', 'settlement')
+            return macro(view['balances'], view['total_by_currency'], view['total_expense_krw'],
+                         transfers, view['krw_by_currency'])
+    return trip.fragment(('settlement', exact), render)
+
+@bp.route('/')
 def index():
-    load_data()
-    balances = calculate_settlement()
-    
-    # 총 지출 계산 (원화 기준)
-    total_expense_krw = 0
-    total_by_currency = {'KRW': 0, 'JPY': 0, 'USD': 0, 'EUR': 0, 'CNY': 0}
-    
-    for exp in data['expenses']:
-        currency = exp.get('currency', 'JPY')
-        amount = exp['amount']
-        total_by_currency[currency] += amount
-        
-        # 원화로 환산
-        if currency == 'KRW':
-            total_expense_krw += amount
-        else:
-            exchange_rate = data['exchange_rates'].get(currency)
-            if exchange_rate:
-                total_expense_krw += amount * exchange_rate
-            else:
-                total_expense_krw += amount
+    trip = g.trip
+    exact = request.args.get('exact') == '1'
+    with trip.reading():
+        etag = trip_etag(trip, 'html', int(exact))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        # 지출 내역은 첫 페이지만, 정산 결과는 (?exact=1 이면 송금 횟수 최소화) 캐시된 조각으로
+        expenses, next_cursor = trip.expense_page(limit=EXPENSE_PAGE_SIZE)
+        expense_rows = [expense_row_html(trip, exp) for exp in expenses]
+        settlement = settlement_html(trip, exact)
+        
+        with metrics.phase('render'):
+            html = render_template('index.html', 
+                                   data=trip.data, 
+                                   expense_rows=expense_rows,
+                                   next_cursor=next_cursor,
+                                   settlement=settlement,
+                                   version=trip.version,
+                                   exact=exact)
+        return with_etag(make_response(html), etag)
+
+@bp.route('/api/summary')
+def summary():
+    """정산 요약 (잔액, 통화별 합계, 원화 총계, 송금 안내) - ETag 로 바뀌었을 때만 다시 받음"""
+    trip = g.trip
+    exact = request.args.get('exact') == '1'
+    with trip.reading():
+        etag = trip_etag(trip, 'summary', int(exact))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        view = trip.summary()
+        return with_etag(jsonify({
+            'version': trip.version,
+            'balances': view['balances'],
+            'total_by_currency': view['total_by_currency'],
+            'krw_by_currency': view['krw_by_currency'],
+            'total_expense_krw': view['total_expense_krw'],
+            'transfers': trip.transfers(exact),
+        }), etag)
+
+@bp.route('/api/settlement/transfers')
+def settlement_transfers():
+    """누가 누구에게 얼마를 보내면 되는지 (원 단위)"""
+    trip = g.trip
+    exact = request.args.get('exact') == '1'
+    with trip.reading():
+        etag = trip_etag(trip, 'transfers', int(exact))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        return with_etag(jsonify({
+            'balances': trip.summary()['balances'],
+            'transfers': trip.transfers(exact)
+        }), etag)
+
+@bp.route('/api/preview', methods=['POST'])
+def preview_changes():
+    """가정 변경을 반영하지 않고 잔액이 어떻게 바뀌는지 (형식은 preview.py 참고)
+
+    {"ops": [변경, ...]} 또는 {"scenarios": [[변경, ...], ...]} - 시나리오마다 잔액과 차이.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'JSON 객체가 필요합니다'}), 400
+    scenarios = body['scenarios'] if 'scenarios' in body else [body.get('ops')]
+    if (not isinstance(scenarios, list) or len(scenarios) > PREVIEW_MAX_SCENARIOS or
+            not all(isinstance(ops, list) and len(ops) <= PREVIEW_MAX_OPS and
+                    all(isinstance(op, dict) for op in ops) for ops in scenarios)):
+        return jsonify({'error': f'시나리오는 {PREVIEW_MAX_SCENARIOS}개, 시나리오마다 변경은 '
+                                 f'{PREVIEW_MAX_OPS}개까지인 변경 객체 목록이어야 합니다'}), 400
+    trip = g.trip
+    with trip.reading():
+        try:
+            results = preview(trip, scenarios)
+        except ValueError as e:
+            message, scenario_index, op_index = e.args
+            return jsonify({'error': message, 'scenario': scenario_index, 'op': op_index}), 400
+        return jsonify({
+            'version': trip.version,
+            'balances': trip.summary()['balances'],
+            'scenarios': results,
+        })
+
+def live_delta(trip, since, exact):
+    """since 버전 이후 변경을 화면에 반영할 값 - trip.reading() 안에서 호출
+
+    바뀐(추가·수정) 지출 줄 HTML, 지워진 지출 id, 잔액·합계와 정산 결과 HTML.
+    지출 말고 다른 것이 바뀌었거나 그 사이 변경을 다 알 수 없으면 {"reload": true}.
+    """
+    delta = {'version': trip.version}
+    ops = trip.ops_since(since)
+    if ops is None or any(op['op'] not in LIVE_OPS for op in ops):
+        delta['reload'] = True
+        return delta
+    changed = {}
+    for op in ops:
+        changed[op['id'] if op['op'] == 'remove_expense' else op['expense']['id']] = True
+    expenses = trip.data['expenses']
+    view = trip.summary()
+    delta.update({
+        'expenses': [{'id': expense_id, 'html': expense_row_html(trip, expenses[expense_id])}
+                     for expense_id in changed if expense_id in expenses],
+        'removed': [expense_id for expense_id in changed if expense_id not in expenses],
+        'balances': view['balances'],
+        'total_by_currency': view['total_by_currency'],
+        'total_expense_krw': view['total_expense_krw'],
+        'settlement': settlement_html(trip, exact),
+    })
+    return delta
+
+@bp.route('/api/events')
+def events():
+    """변경 알림 (Server-Sent Events) - 버전이 바뀔 때마다 live_delta() 를 JSON 으로 보냄
+
+    ?since=버전 (재접속할 때는 브라우저가 보내는 Last-Event-ID) 이후의 변경부터, 없으면 지금부터.
+    """
+    trip = g.trip
+    exact = request.args.get('exact') == '1'
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return jsonify({'error': 'since 는 정수여야 합니다'}), 400
+
+    new_trip = g.new_trip
+
+    def stream():
+        version = since
+        yield f'retry: {EVENTS_RETRY_MS}\n\n'
+        if new_trip:
+            # 빈 여행은 변경을 알려 줄 수 없으므로 잠시 뒤 끊음 - 재접속하면 그 사이에 만들어진 여행의 변경부터 받음
+            yield 'id: 0\n\n'
+            time.sleep(EVENTS_KEEPALIVE_S)
+            return
+        while True:
+            # 변경이 반영되면 commit() 이 깨움 - 기다리는 동안은 lock 을 놓음
+            with trip.reading():
+                if version is None:
+                    version = trip.version
+                trip.changed.wait_for(lambda: trip.version != version, EVENTS_KEEPALIVE_S)
+                delta = live_delta(trip, version, exact) if trip.version != version else None
+            if delta is None:
+                yield ': keepalive\n\n'
+                continue
+            version = delta['version']
+            yield f'id: {version}\nevent: change\ndata: {json.dumps(delta, ensure_ascii=False)}\n\n'
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/api/stats')
+def stats():
+    trip = g.trip
+    with trip.reading():
+        return jsonify({
+            'trip': trip.trip_id,
+            'load_cache': trip.load_stats,
+            'people': len(trip.data['people']),
+            'expenses': len(trip.data['expenses']),
+            'storage': trip.storage.stats(),
+            'group_commit': trip.committer.stats(),
+            'trip_cache': trips.stats(),
+        })
+
+@bp.route('/api/person/<name>/expenses')
+def person_expenses(name):
+    """name 이 지불했거나 참가한 지출 목록"""
+    trip = g.trip
+    with trip.reading():
+        if name not in trip.person_ids:
+            return jsonify({'error': 'not found'}), 404
+        expenses = trip.person_expenses(trip.person_ids[name])
+        return jsonify([trip.expense_json(exp) for exp in expenses])
+
+def expense_filter(trip, args):
+    """?payer=이름&participant=이름&currency=통화 -> 지출 검사 함수 (조건이 없으면 None)"""
+    tests = []
+    for key in ('payer', 'participant'):
+        name = args.get(key)
+        if name:
+            # 없는 이름이면 -1 이라서 아무 지출에도 맞지 않음
+            tests.append((key, trip.person_ids.get(name, -1)))
+    currency = args.get('currency')
+    if not tests and not currency:
+        return None
     
-    return render_template('index.html', 
-                         data=data, 
-                         balances=balances, 
-                         total_expense_krw=total_expense_krw,
-                         total_by_currency=total_by_currency)
+    def match(expense):
+        if currency and expense.get('currency', 'JPY') != currency:
+            return False
+        for key, person_id in tests:
+            if key == 'payer' and expense['payer'] != person_id:
+                return False
+            if key == 'participant' and (person_id < 0 or not has_bit(expense['participants'], person_id)):
+                return False
+        return True
+    return match
+
+@bp.route('/api/expenses')
+def list_expenses():
+    """지출 목록 (id 순) - ?after=커서&limit=개수 와 payer / participant / currency 조건"""
+    trip = g.trip
+    try:
+        after = int(request.args.get('after', 0))
+        limit = min(int(request.args.get('limit', EXPENSE_PAGE_SIZE)), EXPENSE_PAGE_MAX)
+    except ValueError:
+        return jsonify({'error': 'after / limit 은 정수여야 합니다'}), 400
+    with trip.reading():
+        expenses, next_cursor = trip.expense_page(after, max(limit, 1), expense_filter(trip, request.args))
+        return jsonify({
+            'expenses': [dict(trip.expense_view(exp),
+                              remove_url=trip_url(trip, 'remove_expense', expense_id=exp['id']),
+                              html=expense_row_html(trip, exp))
+                         for exp in expenses],
+            'next': next_cursor,
+        })
+
+@bp.route('/api/expenses/<int:expense_id>')
+def get_expense(expense_id):
+    trip = g.trip
+    with trip.reading():
+        expense = trip.data['expenses'].get(expense_id)
+        if expense is None:
+            return jsonify({'error': 'not found'}), 404
+        return jsonify(trip.expense_json(expense))
+
+def wants_json():
+    """fetch 로 보낸 요청 (Accept: application/json) 이면 redirect 대신 JSON 으로 응답"""
+    return request.accept_mimetypes.best == 'application/json'
 
-@app.route('/add_person', methods=['POST'])
+def mutation_response(ok=True, **result):
+    """변경 라우트의 응답 - 폼이면 첫 화면으로 redirect, fetch 면 {version, ...} (잘못된 입력이면 400)
+
+    화면은 응답이 아니라 /api/events 로 받은 변경 알림으로 고침 (다른 사람의 변경과 같은 경로).
+    """
+    if not wants_json():
+        return redirect(url_for('.index'))
+    if not ok:
+        return jsonify({'error': '잘못된 입력입니다', 'version': g.trip.version}), 400
+    return jsonify(dict(result, version=g.trip.version))
+
+@bp.route('/add_person', methods=['POST'])
 def add_person():
+    trip = g.trip
     name = request.form.get('name', '').strip()
-    if name and name not in data['people']:
-        data['people'].append(name)
-        save_data()
-    return redirect(url_for('index'))
+    with trip.mutation():
+        if name and name not in trip.person_ids:
+            trip.commit({'op': 'add_person', 'id': trip.data['next_person_id'], 'name': name})
+    return mutation_response()
 
-@app.route('/remove_person/<name>')
+@bp.route('/remove_person/<name>')
 def remove_person(name):
-    if name in data['people'] and len(data['people']) > 1:
-        data['people'].remove(name)
-        # 해당 사람 관련 지출도 제거
-        data['expenses'] = [exp for exp in data['expenses'] 
-                          if exp['payer'] != name and name not in exp['participants']]
-        save_data()
-    return redirect(url_for('index'))
-
-@app.route('/add_expense', methods=['POST'])
+    trip = g.trip
+    with trip.mutation():
+        if name in trip.person_ids and len(trip.data['people']) > 1:
+            trip.commit({'op': 'remove_person', 'id': trip.person_ids[name]})
+    return mutation_response()
+
+def expense_from_form(trip, form, expense_id, default_date=None):
+    """지출 입력 폼 -> 지출 dict (잘못된 입력이면 None) - 날짜를 비우면 default_date, 그것도 없으면 오늘"""
+    try:
+        return trip.build_expense(expense_id,
+                                  form.get('description', ''),
+                                  form.get('amount', ''),
+                                  form.get('currency', 'JPY'),
+                                  form.get('payer', ''),
+                                  form.getlist('participants'),
+                                  form.get('date') or default_date)
+    except ValueError:
+        return None
+
+@bp.route('/add_expense', methods=['POST'])
 def add_expense():
-    description = request.form.get('description', '').strip()
-    amount = request.form.get('amount', '')
-    currency = request.form.get('currency', 'JPY')
-    payer = request.form.get('payer', '')
-    participants = request.form.getlist('participants')
-    
-    if description and amount and payer:
-        try:
-            amount = float(amount)
-            if not participants:
-                participants = data['people'].copy()
-            
-            # 유효한 참가자만 필터링
-            participants = [p for p in participants if p in data['people']]
-            
-            if participants:
-                expense = {
-                    'id': len(data['expenses']) + 1,
-                    'description': description,
-                    'amount': amount,
-                    'currency': currency,
-                    'payer': payer,
-                    'participants': participants
-                }
-                data['expenses'].append(expense)
-                save_data()
-        except ValueError:
-            pass
-    
-    return redirect(url_for('index'))
+    trip = g.trip
+    with trip.mutation():
+        expense = expense_from_form(trip, request.form, trip.data['next_expense_id'])
+        if expense:
+            trip.commit({'op': 'add_expense', 'expense': expense})
+    return mutation_response(expense is not None, id=expense and expense['id'])
+
+@bp.route('/edit_expense/<int:expense_id>', methods=['POST'])
+def edit_expense(expense_id):
+    trip = g.trip
+    expense = None
+    with trip.mutation():
+        if expense_id in trip.data['expenses']:
+            expense = expense_from_form(trip, request.form, expense_id,
+                                        trip.data['expenses'][expense_id].get('date'))
+            if expense:
+                trip.commit({'op': 'edit_expense', 'expense': expense})
+    return mutation_response(expense is not None, id=expense_id)
 
-@app.route('/remove_expense/<int:expense_id>')
+@bp.route('/remove_expense/<int:expense_id>')
 def remove_expense(expense_id):
-    data['expenses'] = [exp for exp in data['expenses'] if exp['id'] != expense_id]
-    save_data()
-    return redirect(url_for('index'))
+    trip = g.trip
+    with trip.mutation():
+        found = expense_id in trip.data['expenses']
+        if found:
+            trip.commit({'op': 'remove_expense', 'id': expense_id})
+    return mutation_response(found, id=expense_id)
 
-@app.route('/set_exchange_rate', methods=['POST'])
+@bp.route('/set_exchange_rate', methods=['POST'])
 def set_exchange_rate():
+    rates = {}
     for currency in ['JPY', 'USD', 'EUR', 'CNY']:
         rate = request.form.get(f'rate_{currency}', '')
         if rate:
             try:
-                data['exchange_rates'][currency] = float(rate)
+                rates[currency] = float(rate)
+                if not math.isfinite(rates[currency]):
+                    raise ValueError(rate)
             except ValueError:
-                data['exchange_rates'][currency] = None
+                rates[currency] = None
         else:
-            data['exchange_rates'][currency] = None
+            rates[currency] = None
     
-    save_data()
-    return redirect(url_for('index'))
+    g.trip.commit({'op': 'set_exchange_rates', 'rates': rates})
+    return mutation_response()
 
-@app.route('/clear_all', methods=['POST'])
+@bp.route('/set_rate', methods=['POST'])
+def set_rate():
+    """날짜별 환율 추가/변경 (환율을 비우면 그 날짜의 환율 삭제) - 그 날짜 이후 지출에 적용"""
+    currency = request.form.get('currency', '')
+    try:
+        date = parse_date(request.form.get('date', ''))
+        rate = request.form.get('rate', '')
+        rate = float(rate) if rate else None
+        if rate is not None and not math.isfinite(rate):
+            raise ValueError(f'잘못된 환율: {rate}')
+    except ValueError:
+        return mutation_response(False)
+    if currency in CURRENCIES and currency != 'KRW' and date:
+        g.trip.commit({'op': 'set_rate', 'currency': currency, 'date': date, 'rate': rate})
+    return mutation_response()
+
+@bp.route('/remove_rate/<currency>/<date>')
+def remove_rate(currency, date):
+    trip = g.trip
+    with trip.mutation():
+        if date in trip.rate_dates.get(currency, []):
+            trip.commit({'op': 'set_rate', 'currency': currency, 'date': date, 'rate': None})
+    return mutation_response()
+
+@bp.route('/clear_all', methods=['POST'])
 def clear_all():
-    data['people'] = []
-    data['expenses'] = []
-    data['exchange_rates'] = {
-        'JPY': None,
-        'USD': None,
-        'EUR': None,
-        'CNY': None
-    }
-    save_data()
-    return redirect(url_for('index'))
+    g.trip.commit({'op': 'clear_all'})
+    return mutation_response()
+
+@bp.route('/api/import', methods=['POST'])
+def import_expenses():
+    """CSV / JSONL 로 지출 일괄 추가 (multipart 의 file 또는 요청 본문 그대로) - 행별 오류 보고"""
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, fmt = upload.stream, guess_format(upload.filename, upload.content_type)
+    else:
+        stream, fmt = request.stream, guess_format('', request.content_type)
+    fmt = request.args.get('format', fmt)
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'error': f'지원하지 않는 형식: {fmt}'}), 400
+    return jsonify(import_rows(g.trip, iter_rows(stream, fmt)))
+
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+def export_response(rows, fields, name):
+    """행 제너레이터를 조각조각 보내는 응답 (?format=csv|jsonl, 기본 csv)"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'지원하지 않는 형식: {fmt}'}), 400
+    filename = f'{g.trip.trip_id}-{name}.{fmt}'
+    # 다 보낼 때까지 요청 컨텍스트를 유지 - 그동안 여행이 쓰는 중으로 남아서 캐시에서 내려가지 않음
+    return Response(stream_with_context(encode_rows(rows, fields, fmt)),
+                    mimetype=EXPORT_MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@bp.route('/api/export/expenses')
+def export_expenses():
+    """지출 내역 + 원화 금액 + 1인당 몫"""
+    return export_response(expense_rows(g.trip), EXPENSE_FIELDS, 'expenses')
+
+@bp.route('/api/export/balances')
+def export_balances():
+    """사람별 최종 정산 잔액 (원)"""
+    return export_response(balance_rows(g.trip), BALANCE_FIELDS, 'balances')
+
+app.register_blueprint(bp)
+app.register_blueprint(bp, url_prefix='/trip/<trip_id>', name='trips')
+
+# 화면은 templates/ (index.html, fragments.html), 스타일은 static/style.css - expense.py 와 같이 배포
+# 템플릿은 import 할 때 한 번 컴파일해 두고 (Jinja 캐시), 정적 파일 주소에는 내용 해시(지문)를 붙임
+# -> 지문이 붙은 주소는 내용이 바뀌면 주소도 바뀌므로 브라우저가 오래(STATIC_MAX_AGE) 캐시해도 됨
+STATIC_MAX_AGE = 365 * 24 * 3600
+TEMPLATES = ['index.html', 'fragments.html']
+
+def file_fingerprint(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+static_fingerprints = {name: file_fingerprint(os.path.join(app.static_folder, name))
+                       for name in os.listdir(app.static_folder)}
+
+@app.template_global()
+def static_url(filename):
+    """지문을 붙인 정적 파일 주소 (/static/style.css?v=지문)"""
+    return url_for('static', filename=filename, v=static_fingerprints.get(filename))
+
+for template_name in TEMPLATES:
+    app.jinja_env.get_template(template_name)
+
+# 계측 (METRICS=1) / 느린 요청 프로파일 (PROFILE_SLOW_MS) - metrics.py 참고
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profiler = metrics.start_profile()
+
+def finish_request(status):
+    started = g.pop('request_started', None)
+    if started is None:
+        return  # before_request 전에 끝난 요청 (잘못된 여행 id 등)
+    seconds = time.perf_counter() - started
+    # 라벨은 URL 규칙(/trip/<trip_id>/ 등)으로 - 여행 id 마다 시계열이 생기지 않도록
+    route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+    metrics.observe_request(route, request.method, status, seconds)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        metrics.finish_profile(profiler, seconds, f'{request.method} {request.path}')
+
+@app.after_request
+def record_request(response):
+    finish_request(response.status_code)
+    return response
+
+@app.after_request
+def cache_static(response):
+    # 지문이 맞는 정적 파일만 오래 캐시 (지문 없이 부르면 기본대로 매번 확인)
+    if (request.endpoint == 'static' and response.status_code in (200, 304) and
+            request.args.get('v') == static_fingerprints.get(request.view_args.get('filename'))):
+        response.cache_control.no_cache = False
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+@app.after_request
+def compress(response):
+    """gzip / brotli 압축 - compression.py 참고"""
+    return compress_response(response, request.accept_encodings, static=request.endpoint == 'static')
+
+@app.teardown_request
+def record_failed_request(exc):
+    # 처리되지 않은 예외로 after_request 를 건너뛴 요청
+    if exc is not None:
+        finish_request(500)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 텍스트 형식 - METRICS=1 일 때만"""
+    if not metrics.ENABLED:
+        abort(404)
+    loaded = [(trip.trip_id, trip.data) for trip in trips.loaded()]
+    cache = trips.stats()
+    gauges = [
+        ('expense_trip_people', '메모리에 있는 여행의 사람 수',
+         [({'trip': trip_id}, len(data['people'])) for trip_id, data in loaded]),
+        ('expense_trip_expenses', '메모리에 있는 여행의 지출 수',
+         [({'trip': trip_id}, len(data['expenses'])) for trip_id, data in loaded]),
+        ('expense_trip_cache_bytes', '여행 캐시의 추정 메모리', [({}, cache['bytes'])]),
+        ('expense_trip_cache_trips', '여행 캐시의 여행 수', [({}, cache['trips'])]),
+    ]
+    return Response(metrics.registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.cli.command('import-expenses')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--trip', 'trip_id', default=DEFAULT_TRIP, help='여행 id')
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), help='파일 형식 (기본: 확장자로 추측)')
+def import_expenses_command(path, trip_id, fmt):
+    """CSV / JSONL 파일의 지출을 여행에 일괄 추가 (flask --app expense import-expenses 파일)"""
+    if not TRIP_ID_PATTERN.fullmatch(trip_id):
+        raise click.BadParameter(trip_id, param_hint='--trip')
+    trip = trips.acquire(trip_id)
+    try:
+        with open(path, 'rb') as f:
+            report = import_rows(trip, iter_rows(f, fmt or guess_format(path)))
+    finally:
+        trips.release(trip)
+    click.echo(json.dumps(report, ensure_ascii=False, indent=2))
+
+@app.cli.command('convert-snapshot')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.argument('target', type=click.Path(dir_okay=False))
+def convert_snapshot_command(source, target):
+    """JSON 스냅샷 <-> 바이너리 스냅샷 변환 (원본 형식은 내용으로 판단)
+
+    저널은 옮기지 않으므로 서버를 멈추고 저널이 비어 있을 때 변환.
+    예전 형식(이름으로 된 사람/지출)도 불러올 때처럼 지금 형식으로 바꿔서 쓰고, 대상 파일은 다 쓴 뒤에 바꿈.
+    """
+    if is_binary(source):
+        JsonStorage(target).save(to_snapshot(from_snapshot(read_binary(source))))
+    else:
+        snapshot = to_snapshot(from_snapshot(JsonStorage(source).read_snapshot()))
+        atomic_write(target, lambda f: write_binary(f, snapshot), binary=True)
+    click.echo(f'{source} -> {target}')
 
 if __name__ == '__main__':
-    # templates 폴더 생성
-    os.makedirs('templates', exist_ok=True)
-    
-    # HTML 템플릿 생성
-    html_template = '''<!DOCTYPE html>
-<html lang="ko">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>여행 경비 정산</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }
-        
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 15px;
-            box-shadow: 0 10px 30px rgba(0,0,0,0.2);
-            overflow: hidden;
-        }
-        
-        .header {
-            background: linear-gradient(45deg, #4CAF50, #45a049);
-            color: white;
-            padding: 30px;
-            text-align: center;
-        }
-        
-        .header h1 {
-            font-size: 2.5em;
-            margin-bottom: 10px;
-        }
-        
-        .main-content {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 20px;
-            padding: 30px;
-        }
-        
-        .section {
-            background: #f8f9fa;
-            border-radius: 10px;
-            padding: 20px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-        }
-        
-        .section h2 {
-            color: #333;
-            margin-bottom: 15px;
-            padding-bottom: 10px;
-            border-bottom: 2px solid #4CAF50;
-        }
-        
-        .form-group {
-            margin-bottom: 15px;
-        }
-        
-        .form-group label {
-            display: block;
-            margin-bottom: 5px;
-            font-weight: bold;
-            color: #555;
-        }
-        
-        .form-group input, .form-group select {
-            width: 100%;
-            padding: 10px;
-            border: 1px solid #ddd;
-            border-radius: 5px;
-            font-size: 14px;
-        }
-        
-        .form-group input:focus, .form-group select:focus {
-            outline: none;
-            border-color: #4CAF50;
-            box-shadow: 0 0 5px rgba(76, 175, 80, 0.3);
-        }
-        
-        .btn {
-            background: #4CAF50;
-            color: white;
-            padding: 10px 20px;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            font-size: 14px;
-            transition: background 0.3s;
-        }
-        
-        .btn:hover {
-            background: #45a049;
-        }
-        
-        .btn-danger {
-            background: #f44336;
-        }
-        
-        .btn-danger:hover {
-            background: #da190b;
-        }
-        
-        .btn-warning {
-            background: #ff9800;
-        }
-        
-        .btn-warning:hover {
-            background: #e68900;
-        }
-        
-        .btn-small {
-            padding: 5px 10px;
-            font-size: 12px;
-            margin-left: 5px;
-        }
-        
-        .scroll-list {
-            max-height: 300px;
-            overflow-y: auto;
-            border: 1px solid #ddd;
-            border-radius: 5px;
-            padding: 10px;
-            background: white;
-        }
-        
-        .list-item {
-            padding: 10px;
-            border-bottom: 1px solid #eee;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        
-        .list-item:last-child {
-            border-bottom: none;
-        }
-        
-        .list-item:hover {
-            background: #f5f5f5;
-        }
-        
-        .person-tag {
-            display: inline-block;
-            background: #e3f2fd;
-            color: #1976d2;
-            padding: 3px 8px;
-            border-radius: 15px;
-            font-size: 12px;
-            margin: 2px;
-        }
-        
-        .expense-details {
-            font-size: 12px;
-            color: #666;
-            margin-top: 5px;
-        }
-        
-        .settlement-section {
-            grid-column: 1 / -1;
-            margin-top: 20px;
-        }
-        
-        .settlement-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-            gap: 15px;
-            margin-top: 15px;
-        }
-        
-        .settlement-card {
-            padding: 15px;
-            border-radius: 8px;
-            text-align: center;
-            font-weight: bold;
-        }
-        
-        .settlement-positive {
-            background: #e8f5e8;
-            border: 2px solid #4CAF50;
-            color: #2e7d32;
-        }
-        
-        .settlement-negative {
-            background: #ffebee;
-            border: 2px solid #f44336;
-            color: #c62828;
-        }
-        
-        .settlement-zero {
-            background: #f5f5f5;
-            border: 2px solid #9e9e9e;
-            color: #666;
-        }
-        
-        .checkbox-group {
-            display: flex;
-            flex-wrap: wrap;
-            gap: 10px;
-            margin-top: 10px;
-        }
-        
-        .checkbox-item {
-            display: flex;
-            align-items: center;
-            background: #f0f0f0;
-            padding: 5px 10px;
-            border-radius: 15px;
-            cursor: pointer;
-            transition: background 0.3s;
-        }
-        
-        .checkbox-item:hover {
-            background: #e0e0e0;
-        }
-        
-        .checkbox-item input {
-            margin-right: 5px;
-            width: auto;
-        }
-        
-        .total-info {
-            background: #e3f2fd;
-            padding: 15px;
-            border-radius: 8px;
-            margin-bottom: 15px;
-            text-align: center;
-        }
-        
-        .clear-section {
-            text-align: center;
-            margin-top: 20px;
-            padding-top: 20px;
-            border-top: 1px solid #ddd;
-        }
-        
-        @media (max-width: 768px) {
-            .main-content {
-                grid-template-columns: 1fr;
-            }
-            
-            .settlement-grid {
-                grid-template-columns: 1fr;
-            }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🎒 여행 경비 정산</h1>
-            <p>여행 비용을 쉽게 관리하고 공평하게 정산하세요</p>
-        </div>
-        
-        <div class="main-content">
-            <!-- 참가자 관리 -->
-            <div class="section">
-                <h2>👥 참가자 관리</h2>
-                <form method="POST" action="/add_person">
-                    <div class="form-group">
-                        <label>새 참가자</label>
-                        <div style="display: flex; gap: 10px;">
-                            <input type="text" name="name" placeholder="이름을 입력하세요" required>
-                            <button type="submit" class="btn">추가</button>
-                        </div>
-                    </div>
-                </form>
-                
-                <div class="scroll-list">
-                    {% if data.people %}
-                        {% for person in data.people %}
-                        <div class="list-item">
-                            <span>{{ person }}</span>
-                            {% if data.people|length > 1 %}
-                            <a href="/remove_person/{{ person }}" class="btn btn-danger btn-small" 
-                               onclick="return confirm('{{ person }}님을 삭제하시겠습니까?')">삭제</a>
-                            {% endif %}
-                        </div>
-                        {% endfor %}
-                    {% else %}
-                        <div class="list-item">참가자가 없습니다.</div>
-                    {% endif %}
-                </div>
-            </div>
-            
-            <!-- 지출 입력 -->
-            <div class="section">
-                <h2>💰 지출 입력</h2>
-                {% if data.people %}
-                <form method="POST" action="/add_expense">
-                    <div class="form-group">
-                        <label>지출 항목</label>
-                        <input type="text" name="description" placeholder="예: 점심식사" required>
-                    </div>
-                    
-                    <div style="display: grid; grid-template-columns: 2fr 1fr; gap: 10px;">
-                        <div class="form-group">
-                            <label>금액</label>
-                            <input type="number" name="amount" placeholder="0" min="0" step="0.01" required>
-                        </div>
-                        
-                        <div class="form-group">
-                            <label>통화</label>
-                            <select name="currency">
-                                <option value="JPY" selected>JPY (엔)</option>
-                                <option value="KRW">KRW (원)</option>
-                                <option value="USD">USD (달러)</option>
-                                <option value="EUR">EUR (유로)</option>
-                                <option value="CNY">CNY (위안)</option>
-                            </select>
-                        </div>
-                    </div>
-                    
-                    <div class="form-group">
-                        <label>지불자</label>
-                        <select name="payer" required>
-                            <option value="">선택하세요</option>
-                            {% for person in data.people %}
-                            <option value="{{ person }}">{{ person }}</option>
-                            {% endfor %}
-                        </select>
-                    </div>
-                    
-                    <div class="form-group">
-                        <label>참가자 (선택안하면 전체 적용)</label>
-                        <div class="checkbox-group">
-                            {% for person in data.people %}
-                            <label class="checkbox-item">
-                                <input type="checkbox" name="participants" value="{{ person }}">
-                                {{ person }}
-                            </label>
-                            {% endfor %}
-                        </div>
-                    </div>
-                    
-                    <button type="submit" class="btn">지출 추가</button>
-                </form>
-                {% else %}
-                <p>먼저 참가자를 추가하세요.</p>
-                {% endif %}
-            </div>
-            
-            <!-- 지출 내역 -->
-            <div class="section">
-                <h2>📋 지출 내역</h2>
-                <div class="scroll-list">
-                    {% if data.expenses %}
-                        {% for expense in data.expenses %}
-                        <div class="list-item">
-                            <div>
-                                <strong>{{ expense.description }}</strong>
-                                <div class="expense-details">
-                                    💰 {{ "{:,}".format(expense.amount|int) }} {{ expense.get('currency', 'JPY') }} ({{ expense.payer }}가 지불)
-                                    {% if expense.get('currency', 'JPY') != 'KRW' and data.exchange_rates.get(expense.get('currency', 'JPY')) %}
-                                        <br>💱 원화 환산: {{ "{:,}".format((expense.amount * data.exchange_rates.get(expense.get('currency', 'JPY'), 1))|int) }}원
-                                    {% endif %}
-                                    <br>
-                                    👥 참가자: 
-                                    {% for participant in expense.participants %}
-                                        <span class="person-tag">{{ participant }}</span>
-                                    {% endfor %}
-                                    <br>
-                                    📊 1인당: 
-                                    {% if expense.get('currency', 'JPY') == 'KRW' %}
-                                        {{ "{:,}".format((expense.amount / expense.participants|length)|int) }}원
-                                    {% else %}
-                                        {% if data.exchange_rates.get(expense.get('currency', 'JPY')) %}
-                                            {{ "{:,}".format((expense.amount * data.exchange_rates.get(expense.get('currency', 'JPY'), 1) / expense.participants|length)|int) }}원
-                                        {% else %}
-                                            {{ "{:,}".format((expense.amount / expense.participants|length)|int) }} {{ expense.get('currency', 'JPY') }}
-                                        {% endif %}
-                                    {% endif %}
-                                </div>
-                            </div>
-                            <a href="/remove_expense/{{ expense.id }}" class="btn btn-danger btn-small"
-                               onclick="return confirm('이 지출을 삭제하시겠습니까?')">삭제</a>
-                        </div>
-                        {% endfor %}
-                    {% else %}
-                        <div class="list-item">지출 내역이 없습니다.</div>
-                    {% endif %}
-                </div>
-            </div>
-            
-            <!-- 환율 설정 -->
-            <div class="section">
-                <h2>💱 환율 설정</h2>
-                <form method="POST" action="/set_exchange_rate">
-                    <p class="form-group" style="margin-bottom: 20px; color: #666; font-size: 14px;">
-                        외화를 원화로 환산하기 위한 환율을 설정하세요 (1 외화 = ? 원)
-                    </p>
-                    
-                    <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 15px;">
-                        <div class="form-group">
-                            <label>JPY (엔)</label>
-                            <input type="number" name="rate_JPY" step="0.01" 
-                                   value="{{ data.exchange_rates.JPY if data.exchange_rates.JPY else '' }}"
-                                   placeholder="예: 9.2">
-                        </div>
-                        
-                        <div class="form-group">
-                            <label>USD (달러)</label>
-                            <input type="number" name="rate_USD" step="0.01" 
-                                   value="{{ data.exchange_rates.USD if data.exchange_rates.USD else '' }}"
-                                   placeholder="예: 1350">
-                        </div>
-                        
-                        <div class="form-group">
-                            <label>EUR (유로)</label>
-                            <input type="number" name="rate_EUR" step="0.01" 
-                                   value="{{ data.exchange_rates.EUR if data.exchange_rates.EUR else '' }}"
-                                   placeholder="예: 1450">
-                        </div>
-                        
-                        <div class="form-group">
-                            <label>CNY (위안)</label>
-                            <input type="number" name="rate_CNY" step="0.01" 
-                                   value="{{ data.exchange_rates.CNY if data.exchange_rates.CNY else '' }}"
-                                   placeholder="예: 190">
-                        </div>
-                    </div>
-                    
-                    <button type="submit" class="btn">환율 저장</button>
-                </form>
-            </div>
-            
-            <!-- 정산 결과 -->
-            {% if data.expenses and balances %}
-            <div class="section settlement-section">
-                <h2>💰 정산 결과 (원화 기준)</h2>
-                
-                <div class="total-info">
-                    <h3>📊 총 지출 요약</h3>
-                    <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(150px, 1fr)); gap: 10px; margin: 15px 0;">
-                        {% for currency, amount in total_by_currency.items() %}
-                            {% if amount > 0 %}
-                            <div style="background: white; padding: 10px; border-radius: 5px; text-align: center;">
-                                <strong>{{ currency }}</strong><br>
-                                {{ "{:,}".format(amount|int) }}
-                                {% if currency != 'KRW' and data.exchange_rates.get(currency) %}
-                                    <br><small>({{ "{:,}".format((amount * data.exchange_rates.get(currency))|int) }}원)</small>
-                                {% endif %}
-                            </div>
-                            {% endif %}
-                        {% endfor %}
-                    </div>
-                    <h3 style="color: #4CAF50;">🧮 총계: {{ "{:,}".format(total_expense_krw|int) }}원</h3>
-                </div>
-                
-                <div class="settlement-grid">
-                    {% for person, balance in balances.items() %}
-                    <div class="settlement-card 
-                        {% if balance > 0 %}settlement-positive
-                        {% elif balance < 0 %}settlement-negative
-                        {% else %}settlement-zero{% endif %}">
-                        <h3>{{ person }}</h3>
-                        {% if balance > 0 %}
-                            <p>💚 받을 금액</p>
-                            <p style="font-size: 1.2em;">{{ "{:,}".format(balance|int) }}원</p>
-                        {% elif balance < 0 %}
-                            <p>💸 낼 금액</p>
-                            <p style="font-size: 1.2em;">{{ "{:,}".format((-balance)|int) }}원</p>
-                        {% else %}
-                            <p>⚖️ 정산 완료</p>
-                            <p style="font-size: 1.2em;">0원</p>
-                        {% endif %}
-                    </div>
-                    {% endfor %}
-                </div>
-            </div>
-            {% endif %}
-        </div>
-        
-        <!-- 전체 초기화 -->
-        {% if data.people or data.expenses %}
-        <div class="clear-section">
-            <form method="POST" action="/clear_all" 
-                  onsubmit="return confirm('모든 데이터를 삭제하시겠습니까? 이 작업은 되돌릴 수 없습니다.')">
-                <button type="submit" class="btn btn-warning">🗑️ 전체 초기화</button>
-            </form>
-        </div>
-        {% endif %}
-    </div>
-</body>
-</html>'''
-    
-    with open('templates/index.html', 'w', encoding='utf-8') as f:
-        f.write(html_template)
-    
     print("🎒 여행 경비 정산 웹앱을 시작합니다!")
     print("📱 브라우저에서 http://localhost:5000 으로 접속하세요")
     print("🛑 종료하려면 Ctrl+C를 누르세요")
     
+    # SIGTERM 으로 끝날 때도 atexit(flush_on_shutdown) 이 실행되도록
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
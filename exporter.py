@@ -0,0 +1,98 @@
+# exporter.py
+# 지출 / 정산 결과 내보내기 - CSV / JSONL 을 몇백 행씩 끊어서 생성 (chunked 응답용 제너레이터)
+# 시작할 때는 지출 id 목록과 (통화, 날짜)별 환율만 복사하고, 지출은 EXPORT_CHUNK_ROWS 개씩 잠금을 잡고 꺼냄
+# -> 메모리는 여행 크기와 관계없이 한 묶음 분량, 잠금도 묶음마다 잠깐만 잡아서 다른 요청을 막지 않음
+# (묶음 사이에 지워진 지출은 빠지고, 고친 지출은 고친 내용으로 나감)
+#
+# 지출 CSV 는 importer.py 의 형식과 같은 열 이름을 써서 그대로 다시 가져올 수 있음
+import csv
+import io
+import json
+
+from bitset import bit_count, iter_bits
+from trip import rate_key
+
+EXPORT_FORMATS = ['csv', 'jsonl']
+EXPORT_CHUNK_ROWS = 500
+
+EXPENSE_FIELDS = ['id', 'description', 'amount', 'currency', 'date', 'krw_amount',
+                  'payer', 'participants', 'share_krw']
+BALANCE_FIELDS = ['name', 'balance_krw']
+
+
+def expense_rows(trip):
+    """지출마다 원화 금액과 1인당 몫(calculate_settlement 와 같은 계산)을 붙인 행 (id 순)"""
+    with trip.reading():
+        order = list(trip.expense_order)
+        # (통화, 날짜)마다 환율을 한 번만 찾아 둠 - 잠금을 푼 뒤 환율이 바뀌어도 시작 시점 기준
+        # 날짜별 장부의 키 = 지출에 나오는 (통화, 날짜) 전부라서 지출을 훑지 않아도 됨
+        factors = {key: trip.rate_factor(*key) for key in trip.date_totals}
+
+    def rows():
+        for start in range(0, len(order), EXPORT_CHUNK_ROWS):
+            # 다시 읽기(reading)는 하지 않음 - 시작할 때와 같은 여행 상태에서 이어서 꺼냄
+            with trip.lock:
+                chunk = expense_chunk(trip, order[start:start + EXPORT_CHUNK_ROWS], factors)
+            yield from chunk
+    return rows()
+
+
+def expense_chunk(trip, expense_ids, factors):
+    """expense_ids 의 지출 행 (지워진 지출은 건너뜀) - trip.lock 안에서 호출"""
+    expenses = trip.data['expenses']
+    people = trip.data['people']
+    # 바이너리 스냅샷의 지출은 꺼낸 dict 를 캐시하지 않고 읽음 (내보내기로 여행 전체가 메모리에 남지 않도록)
+    get = getattr(expenses, 'peek', expenses.get)
+    rows = []
+    for expense_id in expense_ids:
+        expense = get(expense_id)
+        if expense is None:
+            continue
+        currency, date = key = rate_key(expense)
+        if key not in factors:
+            # 내보내는 도중 고친 지출의 새 (통화, 날짜)
+            factors[key] = trip.rate_factor(*key)
+        krw_amount = expense['amount'] * factors[key]
+        rows.append({
+            'id': expense['id'],
+            'description': expense['description'],
+            'amount': expense['amount'],
+            'currency': currency,
+            'date': date or '',
+            'krw_amount': krw_amount,
+            'payer': people[expense['payer']],
+            'participants': [people[person_id] for person_id in iter_bits(expense['participants'])],
+            'share_krw': krw_amount / bit_count(expense['participants']),
+        })
+    return rows
+
+
+def balance_rows(trip):
+    with trip.reading():
+        balances = trip.summary()['balances']
+    return ({'name': name, 'balance_krw': balance} for name, balance in balances.items())
+
+
+def encode_rows(rows, fields, fmt):
+    """행 dict 들 -> EXPORT_CHUNK_ROWS 행씩 묶은 문자열 조각"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'지원하지 않는 형식: {fmt}')
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fields)
+        writer.writeheader()
+    count = 0
+    for row in rows:
+        if fmt == 'csv':
+            if isinstance(row.get('participants'), list):
+                row['participants'] = ';'.join(row['participants'])
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
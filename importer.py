@@ -0,0 +1,102 @@
+# importer.py
+# 지출 일괄 가져오기 - CSV / JSONL 파일을 한 줄씩 읽어서 묶음(batch) 단위로 반영
+# 파일 전체를 메모리에 올리지 않으므로 행 수와 관계없이 메모리 사용량이 일정함
+#
+# CSV:   description,amount,currency,payer,participants,date  (참가자는 ; 로 구분, 비우면 전체)
+# JSONL: {"description": ..., "amount": ..., "currency": ..., "payer": ..., "participants": [...], "date": ...}
+# date (YYYY-MM-DD) 는 없어도 됨 - 없으면 입력 폼과 같이 오늘 날짜
+import csv
+import io
+import json
+
+IMPORT_FORMATS = ['csv', 'jsonl']
+
+# 이만큼 모아서 한 번에 저장 (잠금도 묶음마다 풀어서 다른 요청이 끼어들 수 있음)
+# 저장마다 전체 파일을 쓰는 저장소(json 모드)만 여행이 크면 묶음을 지출 수의 절반까지 키움
+# -> 그래도 전체 기록량이 가져온 행 수에 비례 (다른 저장소는 묶음 크기 고정 - 올린 파일을 다 쌓아 두지 않도록)
+IMPORT_BATCH_SIZE = 2000
+# 오류 보고에 담을 최대 행 수 (나머지는 개수만 셈)
+IMPORT_MAX_ERRORS = 1000
+
+
+def guess_format(filename, content_type=''):
+    """파일 이름이나 Content-Type 으로 형식 추측 (모르면 csv)"""
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')) or 'json' in (content_type or ''):
+        return 'jsonl'
+    return 'csv'
+
+
+def iter_rows(stream, fmt):
+    """바이너리 스트림 -> (행 번호, 필드 dict 또는 오류 메시지) 를 하나씩"""
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f'지원하지 않는 형식: {fmt}')
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            participants = row.get('participants') or ''
+            row['participants'] = [name.strip() for name in participants.split(';') if name.strip()]
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_num, '잘못된 JSON'
+            continue
+        if not isinstance(row, dict):
+            yield line_num, '행이 JSON 객체가 아닙니다'
+            continue
+        participants = row.get('participants') or []
+        if isinstance(participants, str):
+            participants = [name.strip() for name in participants.split(';') if name.strip()]
+        row['participants'] = participants
+        yield line_num, row
+
+
+def import_rows(trip, rows, batch_size=IMPORT_BATCH_SIZE):
+    """(행 번호, 필드) 들을 trip 에 지출로 추가 - 묶음마다 mutation() 한 번 (저장도 한 번)
+
+    검증은 입력 폼과 같은 Trip.build_expense 사용.
+    """
+    report = {'imported': 0, 'failed': 0, 'batches': 0, 'errors': []}
+    batch = []
+    grow = trip.storage.rewrites_all
+
+    def flush():
+        with trip.mutation():
+            for line_num, row in batch:
+                try:
+                    expense = trip.build_expense(trip.data['next_expense_id'],
+                                                 row.get('description'),
+                                                 row.get('amount'),
+                                                 row.get('currency') or 'JPY',
+                                                 row.get('payer'),
+                                                 row['participants'],
+                                                 row.get('date'))
+                except ValueError as e:
+                    fail(line_num, str(e))
+                    continue
+                trip.commit({'op': 'add_expense', 'expense': expense})
+                report['imported'] += 1
+        report['batches'] += 1
+        batch.clear()
+
+    def fail(line_num, error):
+        report['failed'] += 1
+        if len(report['errors']) < IMPORT_MAX_ERRORS:
+            report['errors'].append({'row': line_num, 'error': error})
+
+    for line_num, row in rows:
+        if isinstance(row, str):
+            fail(line_num, row)
+            continue
+        batch.append((line_num, row))
+        if len(batch) >= (max(batch_size, len(trip.data['expenses']) // 2) if grow else batch_size):
+            flush()
+    if batch:
+        flush()
+    return report
@@ -0,0 +1,176 @@
+# metrics.py
+# 요청·저장 계측 (METRICS=1 일 때만) - 라우트별 지연 시간, 단계별 시간(load / settlement / render / save),
+# 저장할 때 쓴 바이트 수, 변경 기록 수를 모아서 /metrics 에 Prometheus 텍스트 형식으로 내보냄
+# 꺼져 있으면 phase() 등은 아무것도 하지 않음
+#
+# PROFILE_SLOW_MS 를 주면 요청마다 cProfile 을 켜고, 그보다 오래 걸린 요청만 PROFILE_DIR 에
+# .pstats (와 누적 시간 상위 목록 .txt) 로 남김 - 계측(METRICS)과 따로 켜고 끔
+# 프로파일러는 프로세스에 하나만 켤 수 있으므로 (3.12 부터는 동시에 켜면 ValueError) 한 번에 한 요청만 -
+# 다른 요청을 프로파일하는 중이면 그 요청은 건너뜀
+from contextlib import contextmanager
+import bisect
+import cProfile
+import io
+import itertools
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('METRICS') == '1'
+PROFILE_SLOW_MS = float(os.environ['PROFILE_SLOW_MS']) if os.environ.get('PROFILE_SLOW_MS') else None
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# 이름 -> (종류, 설명, 버킷)
+METRICS = {
+    'expense_request_seconds': ('histogram', '라우트별 요청 처리 시간', SECONDS_BUCKETS),
+    'expense_phase_seconds': ('histogram', '단계별 시간 (load / settlement / render / save)', SECONDS_BUCKETS),
+    'expense_save_bytes': ('histogram', '저장 한 번에 쓴 바이트 수 (json / journal)', BYTES_BUCKETS),
+    'expense_ops_total': ('counter', '반영한 변경 기록 수', None),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 마지막 칸은 +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """(이름, 라벨) -> 히스토그램 / 카운터 값"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.series.get(key)
+            if histogram is None:
+                histogram = self.series[key] = Histogram(METRICS[name][2])
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self, gauges=()):
+        """Prometheus 텍스트 형식 - gauges 는 (이름, 설명, [(라벨 dict, 값), ...]) 목록"""
+        lines = []
+        with self.lock:
+            by_name = {}
+            for (name, labels), value in sorted(self.series.items()):
+                by_name.setdefault(name, []).append((dict(labels), value))
+            for name, series in by_name.items():
+                kind, help_text, buckets = METRICS[name]
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in series:
+                    if kind == 'counter':
+                        lines.append(f'{name}{format_labels(labels)} {value}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), value.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{format_labels(dict(labels, le=bound))} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {value.sum}')
+                    lines.append(f'{name}_count{format_labels(labels)} {value.count}')
+        for name, help_text, series in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in series:
+                lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{key}="{escape(value)}"' for key, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+registry = Registry()
+profile_ids = itertools.count(1)  # 같은 초에 남긴 프로파일 파일 이름이 겹치지 않도록
+profile_lock = threading.Lock()   # 프로파일 중인 요청이 있는 동안 잡혀 있음 (finish_profile 에서 풂)
+
+
+@contextmanager
+def phase(name):
+    """with phase('load'): ... - 걸린 시간을 expense_phase_seconds 에 기록"""
+    if not ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe('expense_phase_seconds', time.perf_counter() - started, phase=name)
+
+
+def observe_request(route, method, status, seconds):
+    if ENABLED:
+        registry.observe('expense_request_seconds', seconds, route=route, method=method, status=status)
+
+
+def observe_save(nbytes):
+    """저장소가 알려 준 기록 바이트 수 (모르면 None - sqlite)"""
+    if ENABLED and nbytes is not None:
+        registry.observe('expense_save_bytes', nbytes)
+
+
+def count_op(kind):
+    if ENABLED:
+        registry.inc('expense_ops_total', op=kind)
+
+
+def start_profile():
+    """PROFILE_SLOW_MS 가 있으면 이 스레드에서 프로파일 시작 (없거나 다른 요청을 프로파일하는 중이면 None)"""
+    if PROFILE_SLOW_MS is None or not profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 이 모듈 밖에서 켠 프로파일러(디버거 등)가 있음
+        profile_lock.release()
+        return None
+    return profiler
+
+
+def finish_profile(profiler, seconds, label):
+    """프로파일을 멈추고 PROFILE_SLOW_MS 보다 오래 걸렸으면 파일로 남김"""
+    profiler.disable()
+    profile_lock.release()
+    if seconds * 1000 < PROFILE_SLOW_MS:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    label = re.sub(r'[^A-Za-z0-9_.-]+', '_', label)
+    name = f'{time.strftime("%Y%m%d-%H%M%S")}-{next(profile_ids)}-{int(seconds * 1000)}ms-{label}'
+    path = os.path.join(PROFILE_DIR, name)
+    profiler.dump_stats(path + '.pstats')
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(30)
+    with open(path + '.txt', 'w', encoding='utf-8') as f:
+        f.write(report.getvalue())
+    logger.warning('느린 요청 %s (%.0fms) - 프로파일: %s.pstats', label, seconds * 1000, path)
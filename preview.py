@@ -0,0 +1,267 @@
+# preview.py
+# 가정 변경(what-if) 미리 보기 - 사람 삭제, 환율 변경 등을 실제로 하기 전에 잔액이 어떻게 바뀌는지 계산
+# data 를 복사해서 정산을 다시 하지 않고, 지금 장부 위에 바뀌는 부분(장부 차이, 바뀐 환율)만 얹어서 계산
+# -> 시나리오 하나에 O(바뀌는 지출 수 + 사람 수 + 환율을 바꾼 통화의 (통화, 날짜)별 장부 크기) 라서
+#    요청 하나에 시나리오 수십 개도 가능
+#
+# 변경은 폼과 같이 이름으로 씀:
+#   {"op": "add_person", "name": "..."}
+#   {"op": "remove_person", "name": "..."}              - 지불했거나 참가한 지출도 함께 사라짐
+#   {"op": "add_expense", "description": ..., "amount": ..., "currency": ..., "payer": ...,
+#    "participants": [...], "date": ...}
+#   {"op": "edit_expense", "id": 3, ...바꿀 필드만}
+#   {"op": "remove_expense", "id": 3}
+#   {"op": "set_exchange_rates", "rates": {"JPY": 9.5}}   - null 이면 기본 환율을 지움
+#   {"op": "set_rate", "currency": "JPY", "date": "2025-03-01", "rate": 9.4}   - null 이면 그 날짜 환율을 지움
+import bisect
+import math
+
+from bitset import bit_count, has_bit, iter_bits
+from trip import CURRENCIES, parse_date, rate_key, with_rate
+
+PREVIEW_OPS = ['add_person', 'remove_person', 'add_expense', 'edit_expense', 'remove_expense',
+               'set_exchange_rates', 'set_rate']
+EXPENSE_FIELDS = ['description', 'amount', 'currency', 'payer', 'participants', 'date']
+
+
+class Scenario:
+    """지금 장부 위에 얹은 가정 변경 묶음 하나 - trip 의 data 와 장부는 건드리지 않음"""
+
+    def __init__(self, trip):
+        self.trip = trip
+        data = trip.data
+        # 사람은 바뀔 때만 복사 (지출은 복사하지 않음)
+        self.people = data['people']
+        self.person_ids = trip.person_ids
+        self.expenses = {}      # 바뀐 지출 id -> 지출 (지워졌으면 None)
+        self.delta = {}         # 사람 id -> {(통화, 날짜): 장부 차이} (Trip 의 장부와 달리 날짜별)
+        self.key_delta = {}     # (통화, 날짜) -> 지출 합계 차이
+        self.exchange_rates = {}  # 바뀐 기본 환율
+        self.rate_history = {}    # 바뀐 통화 -> 날짜별 환율 목록
+        self.next_person_id = data['next_person_id']
+        self.next_expense_id = data['next_expense_id']
+
+    def expense(self, expense_id):
+        if expense_id in self.expenses:
+            return self.expenses[expense_id]
+        return self.trip.data['expenses'].get(expense_id)
+
+    def change_people(self):
+        if self.people is self.trip.data['people']:
+            self.people = dict(self.people)
+            self.person_ids = dict(self.person_ids)
+
+    def put(self, expense, sign=1):
+        """지출 하나를 장부 차이에 반영 (sign=-1 이면 빼기) - Trip.apply_expense_to_ledger 와 같은 계산"""
+        amount = expense['amount']
+        key = rate_key(expense)
+        share_per_person = amount / bit_count(expense['participants'])
+        row = self.delta.setdefault(expense['payer'], {})
+        row[key] = row.get(key, 0) + sign * amount
+        for participant in iter_bits(expense['participants']):
+            row = self.delta.setdefault(participant, {})
+            row[key] = row.get(key, 0) - sign * share_per_person
+        self.key_delta[key] = self.key_delta.get(key, 0) + sign * amount
+
+    def replace(self, expense_id, expense):
+        """expense_id 의 지출을 expense 로 바꿈 (None 이면 지움)"""
+        old = self.expense(expense_id)
+        if old is not None:
+            self.put(old, sign=-1)
+        if expense is not None:
+            self.put(expense)
+        self.expenses[expense_id] = expense
+
+    def apply(self, op):
+        """가정 변경 하나 반영 - 잘못된 변경이면 ValueError"""
+        kind = op.get('op')
+        if kind not in PREVIEW_OPS:
+            raise ValueError(f'지원하지 않는 변경: {kind}')
+        getattr(self, kind)(op)
+
+    def add_person(self, op):
+        name = op.get('name')
+        if not isinstance(name, str):
+            raise ValueError(f'잘못된 이름: {name!r}')
+        name = name.strip()
+        if not name or name in self.person_ids:
+            raise ValueError(f'추가할 수 없는 이름: {name}')
+        self.change_people()
+        self.people[self.next_person_id] = name
+        self.person_ids[name] = self.next_person_id
+        self.next_person_id += 1
+
+    def remove_person(self, op):
+        name = op.get('name')
+        if name not in self.person_ids:
+            raise ValueError(f'없는 사람: {name}')
+        person_id = self.person_ids[name]
+        # 원래 지출 중 관련된 것 + 이 시나리오에서 바꾸거나 추가한 지출 중 관련된 것
+        involved = [exp['id'] for exp in self.trip.person_expenses(person_id) if exp['id'] not in self.expenses]
+        involved += [expense_id for expense_id, exp in self.expenses.items()
+                     if exp is not None and (exp['payer'] == person_id or has_bit(exp['participants'], person_id))]
+        for expense_id in involved:
+            self.replace(expense_id, None)
+        self.change_people()
+        del self.person_ids[self.people.pop(person_id)]
+
+    def build(self, expense_id, fields):
+        participants = fields.get('participants') or []
+        if isinstance(participants, str):
+            participants = [participants]
+        return self.trip.build_expense(expense_id, fields.get('description'), fields.get('amount'),
+                                       fields.get('currency', 'JPY'), fields.get('payer'),
+                                       participants, fields.get('date'), person_ids=self.person_ids)
+
+    def add_expense(self, op):
+        expense_id = self.next_expense_id
+        self.replace(expense_id, self.build(expense_id, op))
+        self.next_expense_id += 1
+
+    def edit_expense(self, op):
+        old = self.expense(op.get('id'))
+        if old is None:
+            raise ValueError(f'없는 지출: {op.get("id")}')
+        # 주지 않은 필드는 지금 값 그대로
+        fields = {
+            'description': old['description'],
+            'amount': old['amount'],
+            'currency': old.get('currency', 'JPY'),
+            'payer': self.people[old['payer']],
+            'participants': [self.people[person_id] for person_id in iter_bits(old['participants'])],
+            'date': old.get('date'),
+        }
+        fields.update((key, op[key]) for key in EXPENSE_FIELDS if key in op)
+        self.replace(old['id'], self.build(old['id'], fields))
+
+    def remove_expense(self, op):
+        if self.expense(op.get('id')) is None:
+            raise ValueError(f'없는 지출: {op.get("id")}')
+        self.replace(op['id'], None)
+
+    def set_exchange_rates(self, op):
+        rates = op.get('rates') or {}
+        if not isinstance(rates, dict):
+            raise ValueError(f'환율은 통화 -> 환율 객체여야 합니다: {rates!r}')
+        for currency, rate in rates.items():
+            self.exchange_rates[check_currency(currency)] = parse_rate(rate)
+
+    def set_rate(self, op):
+        currency = check_currency(op.get('currency'))
+        date = parse_date(op.get('date'))
+        if not date:
+            raise ValueError('날짜가 없습니다')
+        self.rate_history[currency] = with_rate(self.history(currency), date, parse_rate(op.get('rate')))
+
+    def history(self, currency):
+        if currency in self.rate_history:
+            return self.rate_history[currency]
+        return self.trip.data['rate_history'].get(currency, [])
+
+    def rate_factor(self, currency, date=None):
+        """바뀐 환율을 반영한 원화 환산 배율 - 환율을 바꾸지 않은 통화는 Trip 의 (메모된) 배율"""
+        if currency not in self.exchange_rates and currency not in self.rate_history:
+            return self.trip.rate_factor(currency, date)
+        rate = None
+        history = self.history(currency)
+        if date and history:
+            index = bisect.bisect_right([point[0] for point in history], date) - 1
+            if index >= 0:
+                rate = history[index][1]
+        if rate is None:
+            rate = self.exchange_rates.get(currency, self.trip.data['exchange_rates'].get(currency))
+        return rate or 1
+
+    def result(self, view):
+        """view(Trip.summary()) 에 차이를 더한 잔액과 바뀐 점"""
+        trip = self.trip
+        data = trip.data
+        factor = self.rate_factor
+        trip_factor = trip.rate_factor
+        rate_changed = set(self.exchange_rates) | set(self.rate_history)
+
+        # 환율이 바뀐 통화는 원래 금액을 (새 배율 - 지금 배율) 만큼 다시 환산
+        # 날짜별 환율이 생기거나 없어지면 구간이 달라지므로 구간별 장부가 아닌 날짜별 장부로
+        adjust = {}
+        total_adjust = 0
+        for key, row in trip.date_ledger.items():
+            if key[0] in rate_changed:
+                change = factor(*key) - trip_factor(*key)
+                if change:
+                    for person_id, amount in row.items():
+                        adjust[person_id] = adjust.get(person_id, 0) + amount * change
+                    total_adjust += trip.date_totals.get(key, 0) * change
+
+        balances = {}
+        changes = {}
+        for person_id, name in self.people.items():
+            balance = 0
+            if person_id in data['people']:
+                before = view['balances'].get(name, 0)
+                balance = before + adjust.get(person_id, 0)
+            else:
+                before = 0
+            for key, amount in self.delta.get(person_id, {}).items():
+                balance += amount * factor(*key)
+            balance = round(balance, 6) + 0.0
+            balances[name] = balance
+            change = round(balance - before, 6) + 0.0
+            if change:
+                changes[name] = change
+
+        total = view['total_expense_krw'] + total_adjust
+        for key, amount in self.key_delta.items():
+            total += amount * factor(*key)
+
+        base_expenses = data['expenses']
+        return {
+            'balances': balances,
+            'changes': changes,
+            'added_people': [name for person_id, name in self.people.items() if person_id not in data['people']],
+            'removed_people': [name for person_id, name in data['people'].items() if person_id not in self.people],
+            'added_expenses': sorted(expense_id for expense_id, exp in self.expenses.items()
+                                     if exp is not None and expense_id not in base_expenses),
+            'changed_expenses': sorted(expense_id for expense_id, exp in self.expenses.items()
+                                       if exp is not None and expense_id in base_expenses),
+            'removed_expenses': sorted(expense_id for expense_id, exp in self.expenses.items()
+                                       if exp is None and expense_id in base_expenses),
+            'total_expense_krw': round(total, 6) + 0.0,
+        }
+
+
+def check_currency(currency):
+    if currency not in CURRENCIES or currency == 'KRW':
+        raise ValueError(f'환율을 바꿀 수 없는 통화: {currency}')
+    return currency
+
+
+def parse_rate(rate):
+    """환율 값 (None / 빈 값이면 None = 지움) - nan / inf 도 잘못된 환율 (응답 JSON 이 깨지지 않도록)"""
+    if rate is None or rate == '':
+        return None
+    try:
+        value = float(rate)
+    except (TypeError, ValueError):
+        raise ValueError(f'잘못된 환율: {rate}')
+    if not math.isfinite(value):
+        raise ValueError(f'잘못된 환율: {rate}')
+    return value
+
+
+def preview(trip, scenarios):
+    """시나리오(가정 변경 목록)마다 결과 - trip.reading() 안에서 호출
+
+    잘못된 변경이 있으면 ValueError (args 에 (메시지, 시나리오 번호, 변경 번호)).
+    """
+    view = trip.summary()
+    results = []
+    for scenario_index, ops in enumerate(scenarios):
+        scenario = Scenario(trip)
+        for op_index, op in enumerate(ops):
+            try:
+                scenario.apply(op)
+            except (AttributeError, TypeError, ValueError) as e:
+                # 타입이 틀린 입력에서 검사하지 못한 곳이 남아 있어도 500 대신 잘못된 변경으로
+                raise ValueError(str(e), scenario_index, op_index)
+        results.append(scenario.result(view))
+    return results
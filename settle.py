@@ -0,0 +1,107 @@
+# settle.py
+# 정산 잔액(받을 돈 +, 낼 돈 -)으로 "누가 누구에게 얼마" 송금 목록 만들기
+import heapq
+import math
+
+# 정확 모드(송금 횟수 최소화)는 부분집합 DP 라서 잔액이 남은 사람이 이 수 이하일 때만 사용
+EXACT_MAX_PEOPLE = 14
+
+
+def round_balances(balances):
+    """원 단위로 반올림하고, 반올림 오차는 금액이 가장 큰 사람에게 몰아서 합계를 0으로 맞춤
+
+    nan / inf 잔액은 (화면의 |int 와 같이) 0으로 - 잘못된 값 하나로 정산 화면 전체가 500 이 되지 않도록.
+    """
+    rounded = {person: int(round(balance)) if math.isfinite(balance) else 0
+               for person, balance in balances.items()}
+    residual = sum(rounded.values())
+    if residual and rounded:
+        largest = max(rounded, key=lambda person: abs(rounded[person]))
+        rounded[largest] -= residual
+    return rounded
+
+
+def greedy_transfers(balances):
+    """가장 많이 받을 사람과 가장 많이 낼 사람을 힙으로 계속 짝지음 - O(n log n)
+
+    송금 한 번마다 최소 한 명의 잔액이 0이 되므로 송금 횟수는 (잔액이 있는 사람 수 - 1) 이하.
+    """
+    creditors = [(-amount, person) for person, amount in balances.items() if amount > 0]
+    debtors = [(amount, person) for person, amount in balances.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, receiver = heapq.heappop(creditors)
+        debt, payer = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append({'from': payer, 'to': receiver, 'amount': amount})
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, receiver))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, payer))
+    return transfers
+
+
+def zero_sum_groups(people, amounts):
+    """합이 0인 그룹으로 최대한 많이 나눔 (그룹 수가 많을수록 송금 횟수가 줄어듦)
+
+    dp[mask] = mask 의 사람들을 한 명씩 넣는 순서 중, 합이 0이 되는 순간의 최대 횟수.
+    """
+    n = len(people)
+    full = (1 << n) - 1
+    sums = [0] * (full + 1)
+    dp = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + amounts[low.bit_length() - 1]
+        best = 0
+        rest = mask
+        while rest:
+            bit = rest & -rest
+            best = max(best, dp[mask ^ bit])
+            rest ^= bit
+        dp[mask] = best + (sums[mask] == 0)
+
+    # 넣은 순서를 거꾸로 따라가며 합이 0이 되는 지점에서 그룹을 자름
+    order = []
+    mask = full
+    while mask:
+        rest = mask
+        best_bit = rest & -rest
+        while rest:
+            bit = rest & -rest
+            if dp[mask ^ bit] > dp[mask ^ best_bit]:
+                best_bit = bit
+            rest ^= bit
+        order.append(best_bit.bit_length() - 1)
+        mask ^= best_bit
+    order.reverse()
+
+    groups, current, running = [], [], 0
+    for index in order:
+        current.append(people[index])
+        running += amounts[index]
+        if running == 0:
+            groups.append(current)
+            current = []
+    return groups
+
+
+def plan_transfers(balances, exact=False):
+    """잔액 dict -> [{'from': 낼 사람, 'to': 받을 사람, 'amount': 원}] 송금 목록
+
+    exact=True 이면 송금 횟수를 최소화 (잔액이 있는 사람이 EXACT_MAX_PEOPLE 이하일 때만,
+    넘으면 greedy 로 계산).
+    """
+    rounded = round_balances(balances)
+    nonzero = {person: amount for person, amount in rounded.items() if amount}
+    if not exact or len(nonzero) > EXACT_MAX_PEOPLE:
+        return greedy_transfers(nonzero)
+
+    people = list(nonzero)
+    transfers = []
+    for group in zero_sum_groups(people, [nonzero[person] for person in people]):
+        transfers.extend(greedy_transfers({person: nonzero[person] for person in group}))
+    return transfers
@@ -0,0 +1,686 @@
+# storage.py
+# 경비 데이터 저장소 - json (전체 파일) / journal (스냅샷 + 변경 기록) / binary (binsnap 스냅샷 + 변경 기록) / sqlite
+# 모든 저장소는 같은 모양의 스냅샷 dict 를 읽고, 변경 기록(op) 묶음 단위로 씁니다.
+# write_batch(ops, snapshot) 의 snapshot 은 전체 스냅샷을 만드는 함수 - 전체 저장이 필요할 때만 호출
+# 참가자 비트마스크는 메모리에서만 쓰고, 파일(JSON 스냅샷, 저널)에는 정렬된 사람 id 목록으로 저장
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:  # Windows
+    import msvcrt
+    fcntl = None
+
+from binsnap import is_binary, read_binary, write_binary
+from bitset import bit_count, iter_bits, mask_of
+
+logger = logging.getLogger(__name__)
+
+
+def fsync_directory(path):
+    """os.replace 로 바꾼 파일 이름까지 디스크에 남도록 (Windows 는 지원 안 함)"""
+    if os.name == 'nt':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, write, binary=False):
+    """같은 폴더의 임시 파일에 다 쓰고 fsync 한 뒤 os.replace - 중간에 죽어도 원래 파일은 그대로
+
+    쓴 바이트 수를 돌려줌. binary 면 write 가 받는 파일은 바이트 모드.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with (os.fdopen(fd, 'wb') if binary else os.fdopen(fd, 'w', encoding='utf-8')) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+            size = os.fstat(f.fileno()).st_size
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    fsync_directory(path)
+    return size
+
+
+def stored_expense(expense):
+    """메모리의 지출 -> 파일에 쓰는 지출 (참가자 비트마스크 -> 사람 id 목록)
+
+    id 가 큰 사람의 비트마스크는 10진수로 수천 자리라서 파일이 커지고, 4300 자리를 넘으면
+    json 이 아예 읽고 쓰지 못함.
+    """
+    return dict(expense, participants=list(iter_bits(expense['participants'])))
+
+
+def loaded_expense(expense):
+    """파일에서 읽은 지출의 참가자 id 목록 -> 비트마스크 (예전 파일의 비트마스크·이름 목록은 그대로)"""
+    participants = expense['participants']
+    if isinstance(participants, list) and all(isinstance(p, int) for p in participants):
+        expense['participants'] = mask_of(participants)
+    return expense
+
+
+def stored_op(op):
+    if 'expense' not in op:
+        return op
+    return dict(op, expense=stored_expense(op['expense']))
+
+
+def loaded_op(op):
+    if 'expense' in op:
+        loaded_expense(op['expense'])
+    return op
+
+
+class JsonStorage:
+    """변경마다 data 전체를 하나의 JSON 파일로 저장"""
+
+    # write_batch 가 (변경 크기와 관계없이) 매번 전체를 다시 쓰는지 - 일괄 가져오기의 묶음 크기에 씀
+    rewrites_all = True
+
+    def __init__(self, data_file):
+        self.data_file = data_file
+
+    def load(self):
+        """(스냅샷 data 또는 None, 스냅샷 이후의 변경 기록 목록)"""
+        return self.read_snapshot(), []
+
+    def read_snapshot(self):
+        if not os.path.exists(self.data_file):
+            return None
+        try:
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except ValueError:
+            # 조용히 넘어가면 다음 저장 때 빈 데이터로 덮어쓰게 되므로 멈춤
+            logger.error('%s 파일이 손상되었습니다', self.data_file)
+            raise
+        for expense in data['expenses']:
+            loaded_expense(expense)
+        return data
+
+    def save(self, data):
+        data = dict(data, expenses=[stored_expense(expense) for expense in data['expenses']])
+        return atomic_write(self.data_file, lambda f: json.dump(data, f, ensure_ascii=False, indent=2))
+
+    def write_batch(self, ops, snapshot):
+        """변경 기록 묶음을 저장 (ops 는 이미 메모리에 반영된 상태) - 전체 파일을 한 번만 씀
+
+        쓴 바이트 수를 돌려줌 (모르면 None).
+        """
+        return self.save(snapshot())
+
+    def paths(self):
+        return [self.data_file]
+
+    def signature(self):
+        """파일들의 (mtime, 크기) - 다른 프로세스가 바꿨는지 확인용"""
+        signature = []
+        for path in self.paths():
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def aggregate_ledger(self):
+        """저장소가 직접 계산한 (사람별·통화별 잔액, 통화별 합계) - 못 하면 None"""
+        return None
+
+    def person_expense_ids(self, person_id):
+        """person_id 가 지불했거나 참가한 지출 id 목록 - 못 하면 None"""
+        return None
+
+    def stats(self):
+        return {'mode': 'json'}
+
+    def close(self):
+        pass
+
+
+class JournalStorage(JsonStorage):
+    """변경마다 JSONL 한 줄만 추가하고, 주기적으로 스냅샷에 합침"""
+
+    rewrites_all = False
+
+    def __init__(self, data_file, journal_file, compact_every=1000):
+        super().__init__(data_file)
+        self.journal_file = journal_file
+        self.compact_every = compact_every
+        self.journal_length = 0
+        self.journal_bytes = 0
+
+    def load(self):
+        return self.read_snapshot(), list(self.read_journal())
+
+    def read_journal(self):
+        self.journal_length = 0
+        self.journal_bytes = 0
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, 'rb+') as f:
+            good = 0
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    # 쓰다가 끊긴 마지막 줄 - 잘라내야 뒤에 붙는 기록이 다시 읽힘
+                    logger.warning('%s 의 끊긴 기록을 잘라냅니다', self.journal_file)
+                    f.truncate(good)
+                    break
+                good += len(line)
+                self.journal_length += 1
+                self.journal_bytes = good
+                yield loaded_op(op)
+
+    def write_batch(self, ops, snapshot):
+        """변경 묶음을 저널 끝에 추가하고 fsync 한 번 (데이터 크기와 무관하게 변경 크기만큼만 기록)"""
+        lines = ''.join(json.dumps(stored_op(op), ensure_ascii=False, separators=(',', ':')) + '\n'
+                        for op in ops)
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        written = len(lines.encode('utf-8'))
+        self.journal_length += len(ops)
+        self.journal_bytes += written
+        if self.journal_length >= self.compact_every and self.journal_bytes >= self.snapshot_bytes():
+            written += self.compact(snapshot())
+        return written
+
+    def snapshot_bytes(self):
+        # 저널이 스냅샷보다 커졌을 때만 합쳐야 큰 여행에서도 합치는 비용이 기록량에 비례함
+        try:
+            return os.path.getsize(self.data_file)
+        except OSError:
+            return 0
+
+    def compact(self, data):
+        """저널을 스냅샷으로 합치고 비움"""
+        # 스냅샷에는 seq 가 들어 있어서, 비우기 전에 종료돼도 재생 때 중복 반영되지 않음
+        written = self.save(data)
+        atomic_write(self.journal_file, lambda f: None)
+        self.journal_length = 0
+        self.journal_bytes = 0
+        return written
+
+    def paths(self):
+        return [self.data_file, self.journal_file]
+
+    def stats(self):
+        return {'mode': 'journal', 'journal_length': self.journal_length,
+                'journal_bytes': self.journal_bytes}
+
+
+class BinaryStorage(JournalStorage):
+    """journal 과 같지만 스냅샷을 바이너리(binsnap)로 저장 - mmap 으로 열고 지출은 꺼낼 때 만듦"""
+
+    def read_snapshot(self):
+        if not os.path.exists(self.data_file):
+            return None
+        if not is_binary(self.data_file):
+            logger.error('%s 파일이 손상되었습니다', self.data_file)
+            raise ValueError(f'{self.data_file} 는 바이너리 스냅샷이 아닙니다')
+        return read_binary(self.data_file)
+
+    def save(self, data):
+        return atomic_write(self.data_file, lambda f: write_binary(f, data), binary=True)
+
+    def stats(self):
+        return dict(super().stats(), mode='binary')
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS people (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS expenses (
+    pk INTEGER PRIMARY KEY,
+    id INTEGER NOT NULL,
+    description TEXT NOT NULL,
+    amount REAL NOT NULL,
+    currency TEXT NOT NULL,
+    payer_id INTEGER NOT NULL REFERENCES people(id),
+    n_participants INTEGER NOT NULL,
+    date TEXT
+);
+CREATE TABLE IF NOT EXISTS expense_participants (
+    expense_pk INTEGER NOT NULL REFERENCES expenses(pk) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    person_id INTEGER NOT NULL REFERENCES people(id),
+    PRIMARY KEY (expense_pk, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS exchange_rates (
+    currency TEXT PRIMARY KEY,
+    rate REAL
+);
+CREATE TABLE IF NOT EXISTS rate_history (
+    currency TEXT NOT NULL,
+    date TEXT NOT NULL,
+    rate REAL NOT NULL,
+    PRIMARY KEY (currency, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE INDEX IF NOT EXISTS idx_expenses_id ON expenses(id);
+CREATE INDEX IF NOT EXISTS idx_expenses_payer ON expenses(payer_id, currency);
+CREATE INDEX IF NOT EXISTS idx_participants_person ON expense_participants(person_id);
+'''
+
+
+class SqliteStorage:
+    """정규화된 SQLite(WAL) 저장소 - 사람 삭제·사람별 조회가 인덱스로 처리됨"""
+
+    rewrites_all = False
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        with self.conn:
+            self.conn.executescript(SQLITE_SCHEMA)
+            # 지출 날짜가 생기기 전에 만든 DB
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(expenses)')]
+            if 'date' not in columns:
+                self.conn.execute('ALTER TABLE expenses ADD COLUMN date TEXT')
+
+    def load(self):
+        with self.lock:
+            return self.read_snapshot(), []
+
+    def read_snapshot(self):
+        cur = self.conn.cursor()
+        if cur.execute('SELECT COUNT(*) FROM meta').fetchone()[0] == 0:
+            return None  # 아직 한 번도 저장되지 않은 DB
+
+        people = [{'id': person_id, 'name': name}
+                  for person_id, name in cur.execute('SELECT id, name FROM people ORDER BY id')]
+
+        participants = {}
+        for expense_pk, person_id in cur.execute(
+                'SELECT expense_pk, person_id FROM expense_participants'):
+            participants[expense_pk] = participants.get(expense_pk, 0) | (1 << person_id)
+
+        expenses = []
+        for pk, expense_id, description, amount, currency, payer, date in cur.execute(
+                'SELECT pk, id, description, amount, currency, payer_id, date FROM expenses ORDER BY pk'):
+            expense = {
+                'id': expense_id,
+                'description': description,
+                'amount': amount,
+                'currency': currency,
+                'payer': payer,
+                'participants': participants.get(pk, 0)
+            }
+            if date:
+                expense['date'] = date
+            expenses.append(expense)
+
+        exchange_rates = {'JPY': None, 'USD': None, 'EUR': None, 'CNY': None}
+        exchange_rates.update(cur.execute('SELECT currency, rate FROM exchange_rates'))
+        rate_history = {}
+        for currency, date, rate in cur.execute(
+                'SELECT currency, date, rate FROM rate_history ORDER BY currency, date'):
+            rate_history.setdefault(currency, []).append([date, rate])
+
+        meta = dict(cur.execute('SELECT key, value FROM meta'))
+        return {
+            'people': people,
+            'expenses': expenses,
+            'exchange_rates': exchange_rates,
+            'rate_history': rate_history,
+            'next_expense_id': meta.get('next_expense_id', 1),
+            'next_person_id': meta.get('next_person_id', 0),
+            'seq': meta.get('seq', 0)
+        }
+
+    def insert_expense(self, expense):
+        cur = self.conn.execute(
+            'INSERT INTO expenses (id, description, amount, currency, payer_id, n_participants, date) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (expense['id'], expense['description'], expense['amount'],
+             expense.get('currency', 'JPY'), expense['payer'],
+             bit_count(expense['participants']), expense.get('date')))
+        self.insert_participants(cur.lastrowid, expense)
+
+    def insert_participants(self, expense_pk, expense):
+        self.conn.executemany(
+            'INSERT INTO expense_participants (expense_pk, position, person_id) VALUES (?, ?, ?)',
+            [(expense_pk, position, person_id)
+             for position, person_id in enumerate(iter_bits(expense['participants']))])
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def write_batch(self, ops, snapshot):
+        """변경 기록 묶음을 한 트랜잭션으로 반영"""
+        with self.lock, self.conn:
+            for op in ops:
+                self.write_op(op)
+
+    def write_op(self, op):
+        """변경 기록 하나를 SQL 로 (트랜잭션은 write_batch 가 잡음)"""
+        kind = op['op']
+        if kind == 'add_person':
+            self.conn.execute('INSERT INTO people (id, name) VALUES (?, ?)', (op['id'], op['name']))
+            self.set_meta('next_person_id', op['id'] + 1)
+        elif kind == 'remove_person':
+            # 지불자/참가자 인덱스로 관련 지출만 찾아서 삭제 (참가자 행은 CASCADE)
+            self.conn.execute(
+                'DELETE FROM expenses WHERE payer_id = :pid OR pk IN '
+                '(SELECT expense_pk FROM expense_participants WHERE person_id = :pid)',
+                {'pid': op['id']})
+            self.conn.execute('DELETE FROM people WHERE id = ?', (op['id'],))
+        elif kind == 'add_expense':
+            self.insert_expense(op['expense'])
+            self.set_meta('next_expense_id', op['expense']['id'] + 1)
+        elif kind == 'edit_expense':
+            expense = op['expense']
+            (expense_pk,) = self.conn.execute('SELECT pk FROM expenses WHERE id = ?',
+                                              (expense['id'],)).fetchone()
+            self.conn.execute(
+                'UPDATE expenses SET description = ?, amount = ?, currency = ?, payer_id = ?, '
+                'n_participants = ?, date = ? WHERE pk = ?',
+                (expense['description'], expense['amount'], expense.get('currency', 'JPY'),
+                 expense['payer'], bit_count(expense['participants']), expense.get('date'),
+                 expense_pk))
+            self.conn.execute('DELETE FROM expense_participants WHERE expense_pk = ?', (expense_pk,))
+            self.insert_participants(expense_pk, expense)
+        elif kind == 'remove_expense':
+            self.conn.execute('DELETE FROM expenses WHERE id = ?', (op['id'],))
+        elif kind == 'set_exchange_rates':
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO exchange_rates (currency, rate) VALUES (?, ?)',
+                op['rates'].items())
+        elif kind == 'set_rate':
+            if op['rate'] is None:
+                self.conn.execute('DELETE FROM rate_history WHERE currency = ? AND date = ?',
+                                  (op['currency'], op['date']))
+            else:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO rate_history (currency, date, rate) VALUES (?, ?, ?)',
+                    (op['currency'], op['date'], op['rate']))
+        elif kind == 'clear_all':
+            self.conn.execute('DELETE FROM expense_participants')
+            self.conn.execute('DELETE FROM expenses')
+            self.conn.execute('DELETE FROM people')
+            self.conn.execute('DELETE FROM exchange_rates')
+            self.conn.execute('DELETE FROM rate_history')
+        self.set_meta('seq', op['seq'])
+
+    def save(self, data):
+        """data 전체로 DB 를 다시 채움 (JSON 에서 옮겨올 때)"""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM expense_participants')
+            self.conn.execute('DELETE FROM expenses')
+            self.conn.execute('DELETE FROM people')
+            self.conn.executemany('INSERT INTO people (id, name) VALUES (:id, :name)', data['people'])
+            for expense in data['expenses']:
+                self.insert_expense(expense)
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO exchange_rates (currency, rate) VALUES (?, ?)',
+                data['exchange_rates'].items())
+            self.conn.execute('DELETE FROM rate_history')
+            self.conn.executemany(
+                'INSERT INTO rate_history (currency, date, rate) VALUES (?, ?, ?)',
+                [(currency, date, rate)
+                 for currency, history in data.get('rate_history', {}).items()
+                 for date, rate in history])
+            for key, default in (('next_expense_id', 1), ('next_person_id', 0), ('seq', 0)):
+                self.set_meta(key, data.get(key, default))
+
+    def signature(self):
+        """다른 연결(프로세스)이 커밋하면 바뀌는 값 - 이 연결의 쓰기로는 바뀌지 않음"""
+        with self.lock:
+            return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def aggregate_ledger(self):
+        """사람별·(통화, 날짜)별 잔액과 (통화, 날짜)별 합계를 집계 SQL 로 계산"""
+        balances = {}
+        with self.lock:
+            cur = self.conn.cursor()
+            for person_id, currency, date, paid in cur.execute(
+                    'SELECT payer_id, currency, date, SUM(amount) FROM expenses '
+                    'GROUP BY payer_id, currency, date'):
+                row = balances.setdefault(person_id, {})
+                row[currency, date] = row.get((currency, date), 0) + paid
+            for person_id, currency, date, owed in cur.execute(
+                    'SELECT ep.person_id, e.currency, e.date, SUM(e.amount / e.n_participants) '
+                    'FROM expense_participants ep '
+                    'JOIN expenses e ON e.pk = ep.expense_pk '
+                    'GROUP BY ep.person_id, e.currency, e.date'):
+                row = balances.setdefault(person_id, {})
+                row[currency, date] = row.get((currency, date), 0) - owed
+            totals = {(currency, date): total for currency, date, total in cur.execute(
+                'SELECT currency, date, SUM(amount) FROM expenses GROUP BY currency, date')}
+        return balances, totals
+
+    def person_expense_ids(self, person_id):
+        with self.lock:
+            return [expense_id for (expense_id,) in self.conn.execute(
+                'SELECT id FROM expenses WHERE payer_id = :pid '
+                'UNION '
+                'SELECT e.id FROM expense_participants ep '
+                'JOIN expenses e ON e.pk = ep.expense_pk WHERE ep.person_id = :pid '
+                'ORDER BY 1', {'pid': person_id})]
+
+    def stats(self):
+        return {'mode': 'sqlite'}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class GroupCommitter:
+    """동시에 들어온 변경들을 모아서 한 번에 기록 (fsync 한 번)
+
+    submit() 으로 기록 대기열에 넣고 번호표를 받은 뒤, wait(번호표) 로 기록될 때까지 기다림.
+    기다리는 스레드 중 하나(리더)가 그때까지 쌓인 기록을 모두 한 번에 쓰고 나머지는 깨어나기만 함.
+    """
+
+    # 변경 구간이 끝날 때 기록을 기다리는지 (Trip.mutation)
+    synchronous = True
+
+    def __init__(self, write_batch):
+        self.write_batch = write_batch
+        self.cond = threading.Condition()
+        self.pending = []
+        self.enqueued = 0   # 마지막으로 넣은 번호
+        self.durable = 0    # 기록이 끝난 마지막 번호
+        self.writing = False
+        self.batches = 0
+
+    def submit(self, op):
+        with self.cond:
+            self.pending.append(op)
+            self.enqueued += 1
+            return self.enqueued
+
+    def busy(self):
+        """아직 기록되지 않은 변경이 있는지"""
+        with self.cond:
+            return self.writing or bool(self.pending)
+
+    def wait(self, ticket):
+        with self.cond:
+            while self.durable < ticket:
+                if self.writing:
+                    self.cond.wait()
+                    continue
+                batch, self.pending = self.pending, []
+                upto = self.enqueued
+                self.writing = True
+                self.cond.release()
+                try:
+                    self.write_batch(batch)
+                except BaseException:
+                    self.cond.acquire()
+                    self.pending[:0] = batch
+                    self.writing = False
+                    self.cond.notify_all()
+                    raise
+                self.cond.acquire()
+                self.durable = upto
+                self.batches += 1
+                self.writing = False
+                self.cond.notify_all()
+
+    def flush(self):
+        """지금까지 넣은 변경이 모두 기록될 때까지"""
+        with self.cond:
+            ticket = self.enqueued
+        self.wait(ticket)
+
+    def close(self):
+        self.flush()
+
+    def stats(self):
+        with self.cond:
+            return {'mode': 'sync' if self.synchronous else 'async', 'commits': self.enqueued,
+                    'batches': self.batches, 'pending': self.enqueued - self.durable}
+
+
+class AsyncCommitter(GroupCommitter):
+    """요청은 기록을 기다리지 않고, 배경 스레드가 모아서 기록
+
+    첫 변경이 들어온 뒤 interval 초가 지나거나 max_pending 개가 쌓이면 한 번에 씀.
+    그 사이에 프로세스가 죽으면 아직 기록되지 않은 변경은 잃음 - 종료할 때는 close() 로 남은 것을 기록.
+    기록이 실패하면 변경을 대기열에 되돌려 두고 다음 주기에 다시 시도.
+    """
+
+    synchronous = False
+
+    def __init__(self, write_batch, interval=0.05, max_pending=100):
+        super().__init__(write_batch)
+        self.interval = interval
+        self.max_pending = max_pending
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='expense-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, op):
+        with self.cond:
+            ticket = super().submit(op)
+            if len(self.pending) == 1 or len(self.pending) >= self.max_pending:
+                self.cond.notify_all()
+            return ticket
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                deadline = time.monotonic() + self.interval
+                while len(self.pending) < self.max_pending and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                ticket = self.enqueued
+            try:
+                self.wait(ticket)
+            except Exception:
+                logger.exception('배경 기록 실패 - %.0fms 뒤 다시 시도', self.interval * 1000)
+                time.sleep(self.interval)
+
+    def close(self):
+        """배경 스레드를 멈추고 남은 변경을 이 스레드에서 기록"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+
+
+class ProcessLock:
+    """여러 프로세스(gunicorn 워커 등)가 같은 여행을 쓸 때의 파일 잠금 + 변경 번호
+
+    잠금 파일의 앞 8바이트가 변경 번호 - 기록할 때마다 1씩 올리고(bump), 다른 프로세스는
+    mmap 으로 그 값만 읽어서 바뀌었을 때만 저장소를 다시 읽음 (시스템 호출 없이 확인).
+    잠금은 같은 프로세스 안에서 다시 잡아도 됨 (마지막 release 에서 풀림).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = open(path, 'a+b')
+        with self:
+            if os.fstat(self.file.fileno()).st_size < 8:
+                self.file.truncate(8)
+        self.counter = mmap.mmap(self.file.fileno(), 8)
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                self.lock_file()
+            except BaseException:
+                self.thread_lock.release()
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            self.unlock_file()
+        self.thread_lock.release()
+
+    def lock_file(self):
+        fd = self.file.fileno()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            return
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)  # 약 10초 기다리다 실패하면 OSError
+                return
+            except OSError:
+                continue
+
+    def unlock_file(self):
+        fd = self.file.fileno()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def version(self):
+        return struct.unpack_from('<Q', self.counter)[0]
+
+    def bump(self):
+        """잠금을 잡은 상태에서 호출 - 다른 프로세스에 바뀌었음을 알림"""
+        struct.pack_into('<Q', self.counter, 0, self.version() + 1)
+
+    def close(self):
+        self.counter.close()
+        self.file.close()
@@ -0,0 +1,180 @@
+# test_expense.py
+# 웹 라우트 - 여행마다 임시 폴더, 캐시도 테스트마다 새로
+import json
+import math
+
+import pytest
+
+import expense
+from trip import TripCache
+
+JSON = {'Accept': 'application/json'}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(expense, 'TRIPS_DIR', str(tmp_path))
+    monkeypatch.setattr(expense, 'trips', TripCache(expense.make_trip))
+    yield expense.app.test_client()
+    expense.trips.close()
+
+
+def add_people(client, *names):
+    for name in names:
+        client.post('/trip/t/add_person', data={'name': name}, headers=JSON)
+
+
+def add_expense(client, amount, payer='a', participants=('a', 'b'), **fields):
+    data = dict({'description': 'x', 'amount': amount, 'currency': 'KRW', 'payer': payer,
+                 'participants': list(participants)}, **fields)
+    return client.post('/trip/t/add_expense', data=data, headers=JSON)
+
+
+def assert_ledger_matches(trip_id='t'):
+    trip = expense.trips.acquire(trip_id)
+    try:
+        with trip.reading():
+            balances, expected = trip.get_balances(), trip.calculate_settlement()
+    finally:
+        expense.trips.release(trip)
+    assert balances.keys() == expected.keys()
+    for name, balance in expected.items():
+        assert math.isclose(balances[name], balance, abs_tol=1e-6), name
+
+
+def test_non_finite_amount_does_not_break_the_trip(client):
+    add_people(client, 'a', 'b')
+    assert add_expense(client, '100').status_code == 200
+    for amount in ['nan', 'inf', '-inf', 'NaN']:
+        response = add_expense(client, amount)
+        # 받아들였다면 바로 지움 - 지운 뒤에도 잔액이 원래대로여야 함
+        if response.status_code == 200:
+            client.get(f'/trip/t/remove_expense/{response.get_json()["id"]}')
+        assert response.status_code == 400
+    assert client.get('/trip/t/').status_code == 200
+    summary = client.get('/trip/t/api/summary')
+    assert summary.status_code == 200
+    assert summary.get_json()['balances'] == {'a': 50.0, 'b': -50.0}
+    assert_ledger_matches()
+
+
+@pytest.mark.parametrize('rate', ['nan', 'inf', '-inf'])
+def test_non_finite_rates_are_not_stored(client, rate):
+    add_people(client, 'a', 'b')
+    add_expense(client, '1000', currency='JPY', date='2025-01-02')
+    client.post('/trip/t/set_exchange_rate', data={'rate_JPY': rate}, headers=JSON)
+    response = client.post('/trip/t/set_rate', data={'currency': 'JPY', 'date': '2025-01-01', 'rate': rate},
+                           headers=JSON)
+    assert response.status_code == 400
+    trip = expense.trips.acquire('t')
+    try:
+        assert trip.data['exchange_rates']['JPY'] is None
+        assert not trip.data['rate_history']
+    finally:
+        expense.trips.release(trip)
+    assert client.get('/trip/t/').status_code == 200
+    assert client.get('/trip/t/api/summary').get_json()['balances'] == {'a': 500.0, 'b': -500.0}
+
+
+def test_export_streams_rows(client):
+    add_people(client, 'a', 'b')
+    for amount in ['100', '30']:
+        add_expense(client, amount)
+    response = client.get('/trip/t/api/export/expenses?format=jsonl')
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [(row['id'], row['krw_amount'], row['share_krw']) for row in rows] == [(1, 100.0, 50.0), (2, 30.0, 15.0)]
+    assert client.get('/trip/t/api/export/expenses?format=xml').status_code == 400
+
+
+def page_ids(client, query):
+    body = client.get(f'/trip/t/api/expenses?{query}').get_json()
+    return [exp['id'] for exp in body['expenses']], body['next']
+
+
+def test_expense_pages_follow_the_cursor(client, monkeypatch):
+    monkeypatch.setattr(expense, 'EXPENSE_PAGE_MAX', 7)
+    add_people(client, 'a', 'b', 'c')
+    for i in range(1, 21):
+        add_expense(client, str(i), payer='abc'[i % 3], participants=['a', 'b'] if i % 2 else ['c'],
+                    currency='KRW' if i % 4 else 'JPY')
+    client.get('/trip/t/remove_expense/5')
+
+    seen, cursor = [], 0
+    while cursor is not None:
+        ids, cursor = page_ids(client, f'after={cursor}&limit=3')
+        assert len(ids) <= 3
+        seen += ids
+    assert seen == [i for i in range(1, 21) if i != 5]
+    # limit 은 1 ~ EXPENSE_PAGE_MAX 로 맞춤
+    assert len(page_ids(client, 'limit=100')[0]) == 7
+    assert page_ids(client, 'limit=0') == ([1], 1)
+    assert page_ids(client, 'limit=-5') == ([1], 1)
+    for query in ['limit=abc', 'after=x', 'limit=1.5']:
+        assert client.get(f'/trip/t/api/expenses?{query}').status_code == 400
+
+
+def test_expense_filters(client):
+    add_people(client, 'a', 'b', 'c')
+    for i in range(1, 21):
+        add_expense(client, str(i), payer='abc'[i % 3], participants=['a', 'b'] if i % 2 else ['c'],
+                    currency='KRW' if i % 4 else 'JPY')
+    assert page_ids(client, 'payer=b&limit=100')[0] == [i for i in range(1, 21) if i % 3 == 1]
+    assert page_ids(client, 'participant=c&limit=100')[0] == list(range(2, 21, 2))
+    assert page_ids(client, 'participant=c&currency=JPY&limit=100')[0] == [4, 8, 12, 16, 20]
+    assert page_ids(client, 'payer=nobody') == ([], None)
+    # 조건이 있어도 커서는 마지막으로 준 지출 id
+    assert page_ids(client, 'participant=c&limit=2') == ([2, 4], 4)
+    assert page_ids(client, 'participant=c&after=4&limit=2') == ([6, 8], 8)
+
+
+@pytest.mark.parametrize('path', ['/trip/t/', '/trip/t/api/summary', '/trip/t/api/settlement/transfers'])
+def test_views_answer_304_while_unchanged(client, path):
+    add_people(client, 'a', 'b')
+    add_expense(client, '100')
+    first = client.get(path)
+    etag = first.headers['ETag']
+    assert first.status_code == 200 and 'no-cache' in first.headers['Cache-Control']
+    assert client.get(path, headers={'If-None-Match': etag}).status_code == 304
+    # ?exact=1 은 다른 표현
+    assert client.get(path + '?exact=1', headers={'If-None-Match': etag}).status_code == 200
+    add_expense(client, '10')
+    changed = client.get(path, headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_every_mutating_route_bumps_the_version(client):
+    add_people(client, 'a', 'b', 'c')
+    add_expense(client, '100')
+    mutations = [
+        ('post', '/trip/t/add_person', {'name': 'd'}),
+        ('get', '/trip/t/remove_person/d', None),
+        ('post', '/trip/t/add_expense', {'description': 'x', 'amount': '5', 'currency': 'KRW', 'payer': 'a'}),
+        ('post', '/trip/t/edit_expense/2', {'description': 'y', 'amount': '6', 'currency': 'KRW', 'payer': 'b'}),
+        ('get', '/trip/t/remove_expense/2', None),
+        ('post', '/trip/t/set_exchange_rate', {'rate_JPY': '9.5'}),
+        ('post', '/trip/t/set_rate', {'currency': 'JPY', 'date': '2025-01-02', 'rate': '9.1'}),
+        ('get', '/trip/t/remove_rate/JPY/2025-01-02', None),
+        ('post', '/trip/t/clear_all', {}),
+    ]
+    for method, path, data in mutations:
+        before = client.get('/trip/t/api/summary')
+        page_etag = client.get('/trip/t/').headers['ETag']
+        response = getattr(client, method)(path, data=data, headers=JSON)
+        assert response.status_code == 200, path
+        assert response.get_json()['version'] == before.get_json()['version'] + 1, path
+        assert client.get('/trip/t/api/summary', headers={'If-None-Match': before.headers['ETag']}).status_code == 200
+        assert client.get('/trip/t/', headers={'If-None-Match': page_etag}).status_code == 200
+
+
+@pytest.mark.parametrize('op', ['{"op": "set_exchange_rates", "rates": {"JPY": NaN}}',
+                                '{"op": "set_rate", "currency": "JPY", "date": "2025-01-01", "rate": -Infinity}',
+                                '{"op": "add_expense", "description": "x", "amount": Infinity, "payer": "a"}'])
+def test_preview_rejects_non_finite_numbers(client, op):
+    add_people(client, 'a', 'b')
+    add_expense(client, '1000', currency='JPY')
+    response = client.post('/trip/t/api/preview', data=f'{{"ops": [{op}]}}', content_type='application/json')
+    assert response.status_code == 400
+    # 응답은 표준 JSON (NaN / Infinity 가 없음)
+    body = json.loads(response.get_data(as_text=True), parse_constant=pytest.fail)
+    assert body['op'] == 0
@@ -0,0 +1,99 @@
+# test_exporter.py
+# 지출 / 정산 내보내기 - 행과 합계가 정산과 맞는지, 묶음마다 꺼내서 여행 전체를 메모리에 올리지 않는지
+import copy
+import csv
+import io
+import json
+import math
+import os
+
+import pytest
+
+import bench
+import exporter
+from exporter import BALANCE_FIELDS, EXPENSE_FIELDS, balance_rows, encode_rows, expense_rows
+from importer import import_rows, iter_rows
+from storage import BinaryStorage, JsonStorage
+from trip import Trip, from_snapshot
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    return bench.generate_trip(6, 1200, seed=7)
+
+
+def load_trip(snapshot, directory, kind='json'):
+    if kind == 'binary':
+        storage = BinaryStorage(os.path.join(directory, 'data.bin'), os.path.join(directory, 'data.bin.journal'))
+    else:
+        storage = JsonStorage(os.path.join(directory, 'data.json'))
+    storage.save(copy.deepcopy(snapshot))
+    trip = Trip('t', storage)
+    trip.load()
+    return trip
+
+
+@pytest.mark.parametrize('kind', ['json', 'binary'])
+def test_expense_rows_match_the_settlement(tmp_path, snapshot, kind):
+    trip = load_trip(snapshot, str(tmp_path), kind)
+    rows = list(expense_rows(trip))
+    with trip.reading():
+        view = trip.summary()
+        assert [row['id'] for row in rows] == trip.expense_order
+    assert math.isclose(sum(row['krw_amount'] for row in rows), view['total_expense_krw'], rel_tol=1e-9)
+    balances = dict.fromkeys(view['balances'], 0)
+    for row in rows:
+        balances[row['payer']] += row['krw_amount']
+        for name in row['participants']:
+            balances[name] -= row['share_krw']
+    for name, balance in view['balances'].items():
+        assert math.isclose(balances[name], balance, abs_tol=1e-4), name
+
+
+def test_binary_export_does_not_keep_expenses(tmp_path, snapshot):
+    trip = load_trip(snapshot, str(tmp_path), 'binary')
+    expenses = trip.data['expenses']
+    assert hasattr(expenses, 'peek')
+    assert len(list(expense_rows(trip))) == len(snapshot['expenses'])
+    # 꺼낸 지출 dict 가 캐시에 남지 않음 (전부 아직 행 번호)
+    assert all(isinstance(value, int) for value in expenses.items_by_id.values())
+
+
+def test_export_reads_chunks_as_it_streams(tmp_path, snapshot, monkeypatch):
+    monkeypatch.setattr(exporter, 'EXPORT_CHUNK_ROWS', 100)
+    trip = load_trip(snapshot, str(tmp_path))
+    rows = expense_rows(trip)
+    first = [next(rows) for _ in range(100)]
+    # 아직 꺼내지 않은 묶음의 지출을 지우면 내보내기에서도 빠짐
+    trip.commit({'op': 'remove_expense', 'id': 500})
+    rest = list(rows)
+    ids = [row['id'] for row in first + rest]
+    assert len(ids) == len(snapshot['expenses']) - 1
+    assert 500 not in ids
+
+
+def test_csv_export_imports_back(tmp_path, snapshot):
+    trip = load_trip(snapshot, str(tmp_path))
+    text = ''.join(encode_rows(expense_rows(trip), EXPENSE_FIELDS, 'csv'))
+    assert next(csv.reader(io.StringIO(text))) == EXPENSE_FIELDS
+
+    copied = Trip('copy', JsonStorage(str(tmp_path / 'copy.json')))
+    copied.load()
+    people = from_snapshot(copy.deepcopy(snapshot))['people']
+    for person_id, name in people.items():
+        copied.commit({'op': 'add_person', 'id': person_id, 'name': name})
+    copied.commit({'op': 'set_exchange_rates', 'rates': trip.data['exchange_rates']})
+    for currency, history in trip.data['rate_history'].items():
+        for date, rate in history:
+            copied.commit({'op': 'set_rate', 'currency': currency, 'date': date, 'rate': rate})
+    report = import_rows(copied, iter_rows(io.BytesIO(text.encode('utf-8')), 'csv'))
+    assert report['failed'] == 0 and report['imported'] == len(snapshot['expenses'])
+    expected, actual = trip.get_balances(), copied.get_balances()
+    for name, balance in expected.items():
+        assert math.isclose(actual[name], balance, abs_tol=1e-4), name
+
+
+def test_balance_rows(tmp_path, snapshot):
+    trip = load_trip(snapshot, str(tmp_path))
+    lines = ''.join(encode_rows(balance_rows(trip), BALANCE_FIELDS, 'jsonl')).splitlines()
+    assert {row['name']: row['balance_krw'] for row in map(json.loads, lines)} == trip.get_balances()
@@ -0,0 +1,85 @@
+# test_importer.py
+# 지출 일괄 가져오기 - 잘못된 행은 행 번호와 함께 보고하고 나머지 행은 그대로 추가
+import io
+import json
+import math
+import os
+
+from importer import import_rows, iter_rows
+from storage import JournalStorage
+from trip import Trip
+
+
+def open_trip(directory):
+    trip = Trip('t', JournalStorage(os.path.join(directory, 'data.json'), os.path.join(directory, 'data.journal')))
+    trip.load()
+    return trip
+
+
+def new_trip(directory):
+    trip = open_trip(directory)
+    for person_id, name in enumerate(['a', 'b']):
+        trip.commit({'op': 'add_person', 'id': person_id, 'name': name})
+    return trip
+
+
+def run_import(trip, text, fmt, **options):
+    return import_rows(trip, iter_rows(io.BytesIO(text.encode('utf-8')), fmt), **options)
+
+
+def test_csv_report_lists_bad_rows(tmp_path):
+    trip = new_trip(str(tmp_path))
+    report = run_import(trip, '\n'.join([
+        'description,amount,currency,payer,participants,date',
+        '저녁,100,KRW,a,a;b,2025-01-01',
+        '택시,inf,KRW,a,,2025-01-01',
+        '커피,nan,KRW,b,,',
+        '숙소,-inf,KRW,b,,',
+        '간식,abc,KRW,a,,',
+        '기념품,10,KRW,x,,',
+        '입장료,10,XXX,a,,',
+        '버스,10,KRW,a,,2025-13-01',
+        '점심,30,KRW,b,a,2025-01-02',
+    ]) + '\n', 'csv')
+    assert report['imported'] == 2
+    assert report['failed'] == 7
+    errors = {error['row']: error['error'] for error in report['errors']}
+    assert sorted(errors) == [3, 4, 5, 6, 7, 8, 9]
+    assert all('잘못된 금액' in errors[row] for row in [3, 4, 5, 6])
+    assert '없는 지불자' in errors[7]
+    assert [exp['description'] for exp in trip.data['expenses'].values()] == ['저녁', '점심']
+    assert all(math.isfinite(balance) for balance in trip.get_balances().values())
+    assert trip.get_balances() == {'a': 20.0, 'b': -20.0}
+
+
+def test_jsonl_report_lists_wrong_field_types(tmp_path):
+    trip = new_trip(str(tmp_path))
+    rows = [
+        {'description': '저녁', 'amount': 100, 'currency': 'KRW', 'payer': 'a', 'participants': ['a', 'b']},
+        {'description': 5, 'amount': 1, 'currency': 'KRW', 'payer': 'a'},
+        {'description': 'x', 'amount': [1], 'currency': 'KRW', 'payer': 'a'},
+        {'description': 'x', 'amount': 1, 'currency': 'KRW', 'payer': ['a']},
+        {'description': 'x', 'amount': 1, 'currency': 'KRW', 'payer': 'a', 'participants': 3},
+        {'description': 'x', 'amount': 1, 'currency': 'KRW', 'payer': 'a', 'date': 20250101},
+        {'description': 'x', 'amount': 'Infinity', 'currency': 'KRW', 'payer': 'a'},
+    ]
+    lines = [json.dumps(row, ensure_ascii=False) for row in rows] + ['{"description": ', '[1, 2]',
+                                                                     'NaN']
+    report = run_import(trip, '\n'.join(lines) + '\n', 'jsonl')
+    assert report['imported'] == 1
+    errors = {error['row']: error['error'] for error in report['errors']}
+    assert sorted(errors) == list(range(2, 11))
+    assert '잘못된 금액' in errors[3]
+    assert '잘못된 금액' in errors[7]
+    assert errors[8] == '잘못된 JSON'
+    assert errors[9] == errors[10] == '행이 JSON 객체가 아닙니다'
+    assert len(trip.data['expenses']) == 1
+
+
+def test_rows_are_committed_in_batches(tmp_path):
+    trip = new_trip(str(tmp_path))
+    text = 'description,amount,currency,payer\n' + ''.join(f'e{i},{i + 1},KRW,a\n' for i in range(10))
+    report = run_import(trip, text, 'csv', batch_size=4)
+    assert report == {'imported': 10, 'failed': 0, 'batches': 3, 'errors': []}
+    trip.close()
+    assert len(open_trip(str(tmp_path)).data['expenses']) == 10
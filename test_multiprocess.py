@@ -0,0 +1,49 @@
+# test_multiprocess.py
+# 여러 프로세스 (MULTIPROCESS=1) - 같은 여행에 동시에 지출을 추가해도 하나도 사라지지 않는지
+# 자식 프로세스는 spawn 으로 새로 시작해서 부모의 환경 변수(STORAGE_MODE, MULTIPROCESS, TRIPS_DIR)로 expense 를 import
+import multiprocessing
+
+import pytest
+
+import expense
+
+N_PROCESSES = 4
+N_ADDS = 15
+
+
+def add_expenses(worker, n_adds):
+    client = expense.app.test_client()
+    for i in range(n_adds):
+        response = client.post('/trip/t/add_expense', data={'description': f'w{worker}-{i}', 'amount': '10',
+                                                             'currency': 'KRW', 'payer': 'a'})
+        assert response.status_code == 302
+
+
+@pytest.mark.parametrize('kind', ['json', 'journal', 'sqlite', 'binary'])
+def test_concurrent_adds_are_not_lost(tmp_path, monkeypatch, kind):
+    for name, value in [('STORAGE_MODE', kind), ('MULTIPROCESS', '1'), ('TRIPS_DIR', str(tmp_path))]:
+        monkeypatch.setenv(name, value)
+        monkeypatch.setattr(expense, name, value == '1' if name == 'MULTIPROCESS' else value)
+
+    trip = expense.make_trip('t')
+    trip.load()
+    trip.commit({'op': 'add_person', 'id': 0, 'name': 'a'})
+    trip.close()
+
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=add_expenses, args=(worker, N_ADDS)) for worker in range(N_PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * N_PROCESSES
+
+    trip = expense.make_trip('t')
+    trip.load()
+    with trip.reading():
+        expenses = list(trip.data['expenses'].values())
+        descriptions = {exp['description'] for exp in expenses}
+    trip.close()
+    assert len(expenses) == N_PROCESSES * N_ADDS
+    assert len({exp['id'] for exp in expenses}) == len(expenses)
+    assert descriptions == {f'w{worker}-{i}' for worker in range(N_PROCESSES) for i in range(N_ADDS)}
@@ -0,0 +1,130 @@
+# test_preview.py
+# 미리 보기 - 같은 변경을 실제로 반영했을 때와 잔액·총계가 같은지, 원래 여행은 그대로인지
+import copy
+import math
+import random
+
+import pytest
+
+import bench
+from preview import preview
+from storage import JsonStorage
+from trip import CURRENCIES, Trip
+
+N_PEOPLE = 12
+N_EXPENSES = 300
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    return bench.generate_trip(N_PEOPLE, N_EXPENSES, seed=5)
+
+
+def load_trip(snapshot, directory):
+    storage = JsonStorage(str(directory / 'data.json'))
+    storage.save(copy.deepcopy(snapshot))
+    trip = Trip('t', storage)
+    trip.load()
+    return trip
+
+
+def random_op(rng):
+    kind = rng.choice(['add_person', 'remove_person', 'add_expense', 'edit_expense', 'remove_expense',
+                       'set_exchange_rates', 'set_rate'])
+    if kind == 'add_person':
+        return {'op': kind, 'name': f'new{rng.randrange(5)}'}
+    if kind == 'remove_person':
+        return {'op': kind, 'name': f'p{rng.randrange(N_PEOPLE)}'}
+    if kind == 'add_expense':
+        return {'op': kind, 'description': 'x', 'amount': rng.randint(1, 100000), 'currency': rng.choice(CURRENCIES),
+                'payer': f'p{rng.randrange(N_PEOPLE)}', 'participants': rng.sample(['p1', 'p2', 'p3', 'new1'], 2),
+                'date': f'2025-01-{rng.randint(1, 14):02d}'}
+    if kind == 'edit_expense':
+        return {'op': kind, 'id': rng.randrange(1, N_EXPENSES), 'amount': rng.randint(1, 100),
+                'date': f'2025-01-{rng.randint(1, 14):02d}'}
+    if kind == 'remove_expense':
+        return {'op': kind, 'id': rng.randrange(1, N_EXPENSES)}
+    if kind == 'set_exchange_rates':
+        return {'op': kind, 'rates': {rng.choice(['JPY', 'USD']): rng.choice([None, 8.0, 1500])}}
+    return {'op': kind, 'currency': rng.choice(['JPY', 'USD']), 'date': f'2025-01-{rng.randint(1, 14):02d}',
+            'rate': rng.choice([None, 9.9, 1500])}
+
+
+def apply_for_real(trip, ops):
+    """preview 가 가정하는 것과 같은 변경을 trip 에 실제로 반영 (폼 라우트와 같은 방식)"""
+    for op in ops:
+        kind = op['op']
+        if kind == 'add_person':
+            trip.commit({'op': kind, 'id': trip.data['next_person_id'], 'name': op['name']})
+        elif kind == 'remove_person':
+            trip.commit({'op': kind, 'id': trip.person_ids[op['name']]})
+        elif kind == 'add_expense':
+            expense = trip.build_expense(trip.data['next_expense_id'], op['description'], op['amount'],
+                                         op['currency'], op['payer'], op['participants'], op['date'])
+            trip.commit({'op': kind, 'expense': expense})
+        elif kind == 'edit_expense':
+            old = trip.data['expenses'][op['id']]
+            trip.commit({'op': kind, 'expense': dict(old, amount=float(op['amount']), date=op['date'])})
+        elif kind == 'remove_expense':
+            trip.commit({'op': kind, 'id': op['id']})
+        elif kind == 'set_exchange_rates':
+            trip.commit({'op': kind, 'rates': op['rates']})
+        else:
+            trip.commit({'op': kind, 'currency': op['currency'], 'date': op['date'], 'rate': op['rate']})
+    return trip.summary()
+
+
+def test_preview_matches_applying_the_same_ops(snapshot, tmp_path):
+    trip = load_trip(snapshot, tmp_path)
+    rng = random.Random(1)
+    checked = 0
+    for index in range(60):
+        ops = [random_op(rng) for _ in range(rng.randint(1, 6))]
+        with trip.reading():
+            try:
+                [result] = preview(trip, [ops])
+            except ValueError:
+                continue  # 없는 사람/지출 등 - 실제로도 반영할 수 없는 변경
+        real_path = tmp_path / f'real-{index}'
+        real_path.mkdir()
+        real = apply_for_real(load_trip(snapshot, real_path), ops)
+        assert result['balances'].keys() == real['balances'].keys(), ops
+        for name, balance in real['balances'].items():
+            assert math.isclose(result['balances'][name], balance, abs_tol=1e-4), (ops, name)
+        assert math.isclose(result['total_expense_krw'], real['total_expense_krw'], rel_tol=1e-9, abs_tol=1e-3), ops
+        checked += 1
+    assert checked >= 30
+
+
+def test_preview_leaves_trip_unchanged(snapshot, tmp_path):
+    trip = load_trip(snapshot, tmp_path)
+    with trip.reading():
+        before = copy.deepcopy(trip.summary())
+        version = trip.version
+        preview(trip, [[{'op': 'remove_person', 'name': 'p3'}, {'op': 'set_rate', 'currency': 'JPY',
+                                                                  'date': '2025-01-02', 'rate': 20}],
+                       [{'op': 'add_person', 'name': 'x'}, {'op': 'remove_expense', 'id': 5}]])
+        assert trip.version == version
+        trip.view_cache = {}
+        assert trip.summary() == before
+
+
+@pytest.mark.parametrize('op', [
+    {'op': 'add_person', 'name': 5},
+    {'op': 'add_expense', 'description': 5, 'amount': 1, 'currency': 'KRW', 'payer': 'p1'},
+    {'op': 'add_expense', 'description': 'x', 'amount': 1, 'currency': 'KRW', 'payer': ['p1']},
+    {'op': 'add_expense', 'description': 'x', 'amount': 1, 'currency': 'KRW', 'payer': 'p1', 'participants': 3},
+    {'op': 'set_exchange_rates', 'rates': ['JPY']},
+    {'op': 'remove_person', 'name': ['p1']},
+    {'op': 'unknown'},
+    {'op': 'add_expense', 'description': 'x', 'amount': float('inf'), 'currency': 'KRW', 'payer': 'p1'},
+    {'op': 'add_expense', 'description': 'x', 'amount': 'nan', 'currency': 'KRW', 'payer': 'p1'},
+    {'op': 'edit_expense', 'id': 1, 'amount': float('-inf')},
+    {'op': 'set_exchange_rates', 'rates': {'JPY': float('nan')}},
+    {'op': 'set_rate', 'currency': 'USD', 'date': '2025-01-02', 'rate': 'inf'},
+])
+def test_invalid_op_reports_its_position(snapshot, tmp_path, op):
+    trip = load_trip(snapshot, tmp_path)
+    with trip.reading(), pytest.raises(ValueError) as error:
+        preview(trip, [[], [{'op': 'add_person', 'name': 'ok'}, op]])
+    assert error.value.args[1:] == (1, 1)
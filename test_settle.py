@@ -0,0 +1,71 @@
+# test_settle.py
+# 송금 목록 - 정확 모드(송금 횟수 최소화)와 greedy 가 모두 잔액을 맞추는지, 정확 모드가 더 적은지
+import random
+
+import pytest
+
+from settle import EXACT_MAX_PEOPLE, plan_transfers, round_balances
+
+
+def settled(balances, transfers):
+    """송금 후 남는 잔액 (원 단위로 반올림한 잔액 기준)"""
+    left = round_balances(balances)
+    for transfer in transfers:
+        assert transfer['amount'] > 0
+        left[transfer['from']] += transfer['amount']
+        left[transfer['to']] -= transfer['amount']
+    return left
+
+
+def random_balances(rng, n_people):
+    balances = {f'p{i}': rng.uniform(-100000, 100000) for i in range(n_people - 1)}
+    balances[f'p{n_people - 1}'] = -sum(balances.values())
+    return balances
+
+
+@pytest.mark.parametrize('exact', [False, True])
+def test_transfers_settle_every_balance(exact):
+    rng = random.Random(1)
+    for _ in range(200):
+        balances = random_balances(rng, rng.randint(1, 12))
+        transfers = plan_transfers(balances, exact=exact)
+        assert all(amount == 0 for amount in settled(balances, transfers).values())
+
+
+def test_exact_never_uses_more_transfers_than_greedy():
+    rng = random.Random(2)
+    for _ in range(200):
+        # 작은 정수 잔액이어야 합이 0인 부분 그룹이 자주 생김
+        amounts = [rng.choice([-9, -6, -4, -3, 2, 3, 5, 7]) for _ in range(rng.randint(2, 9))]
+        balances = {f'p{i}': amount for i, amount in enumerate(amounts)}
+        balances['last'] = -sum(amounts)
+        exact = plan_transfers(balances, exact=True)
+        assert len(exact) <= len(plan_transfers(balances))
+        assert all(amount == 0 for amount in settled(balances, exact).values())
+
+
+def test_exact_splits_zero_sum_groups():
+    # greedy 는 4번, 정확 모드는 합이 0인 {a, d} 와 {b, c, e} 로 나눠서 3번
+    balances = {'a': -9, 'b': -4, 'c': -6, 'd': 9, 'e': 10}
+    assert len(plan_transfers(balances)) == 4
+    exact = plan_transfers(balances, exact=True)
+    assert len(exact) == 3
+    assert {'from': 'a', 'to': 'd', 'amount': 9} in exact
+
+
+def test_exact_falls_back_to_greedy_for_many_people():
+    balances = random_balances(random.Random(3), EXACT_MAX_PEOPLE + 5)
+    assert plan_transfers(balances, exact=True) == plan_transfers(balances)
+
+
+def test_rounding_keeps_total_zero():
+    balances = {'a': 0.4, 'b': 0.4, 'c': -0.8}
+    assert sum(round_balances(balances).values()) == 0
+    assert plan_transfers({'a': 0.2, 'b': -0.2}) == []
+
+
+def test_non_finite_balance_counts_as_zero():
+    balances = {'a': float('nan'), 'b': float('inf'), 'c': 100.0, 'd': -100.0}
+    assert round_balances(balances) == {'a': 0, 'b': 0, 'c': 100, 'd': -100}
+    for exact in [False, True]:
+        assert plan_transfers(balances, exact=exact) == [{'from': 'd', 'to': 'c', 'amount': 100}]
@@ -0,0 +1,281 @@
+# test_storage.py
+# 저장소 재생 - 변경을 기록한 뒤 같은 파일로 새 Trip 을 열면 (저널 재생 / 바이너리 스냅샷 + 저널) 같은 상태인지
+import json
+import math
+import os
+
+import pytest
+
+from binsnap import is_binary
+import expense
+from storage import AsyncCommitter, BinaryStorage, JournalStorage, JsonStorage, SqliteStorage
+from trip import Trip, TripCache
+
+# 비트마스크였다면 10진수로 4300 자리를 넘는 사람 id
+BIG_PERSON_ID = 20000
+
+
+def make_storage(kind, directory, compact_every):
+    if kind == 'journal':
+        return JournalStorage(os.path.join(directory, 'data.json'), os.path.join(directory, 'data.journal'),
+                              compact_every)
+    if kind == 'binary':
+        return BinaryStorage(os.path.join(directory, 'data.bin'), os.path.join(directory, 'data.bin.journal'),
+                             compact_every)
+    if kind == 'sqlite':
+        return SqliteStorage(os.path.join(directory, 'data.db'))
+    return JsonStorage(os.path.join(directory, 'data.json'))
+
+
+def open_trip(kind, directory, compact_every=1000, **options):
+    trip = Trip('t', make_storage(kind, directory, compact_every), **options)
+    trip.load()
+    return trip
+
+
+def apply_ops(trip):
+    """여러 종류의 변경 - 저널에는 이 순서대로 남음"""
+    for person_id, name in [(0, 'a'), (1, 'b'), (2, 'c'), (BIG_PERSON_ID, 'z')]:
+        trip.commit({'op': 'add_person', 'id': person_id, 'name': name})
+    dates = [None, '2025-01-01', '2025-01-03', '2025-01-05']
+    for i in range(12):
+        names = [['a'], ['a', 'b'], ['a', 'z'], ['b', 'c', 'z']][i % 4]
+        exp = trip.build_expense(trip.data['next_expense_id'], f'지출 {i}', 1000 + i, ['KRW', 'JPY', 'USD'][i % 3],
+                                 names[-1], names, dates[i % 4])
+        trip.commit({'op': 'add_expense', 'expense': exp})
+    edited = dict(trip.data['expenses'][2], amount=5.5, date='2025-01-04')
+    trip.commit({'op': 'edit_expense', 'expense': edited})
+    trip.commit({'op': 'remove_expense', 'id': 3})
+    trip.commit({'op': 'set_exchange_rates', 'rates': {'JPY': 9.5, 'USD': 1350}})
+    trip.commit({'op': 'set_rate', 'currency': 'JPY', 'date': '2025-01-03', 'rate': 9.1})
+    trip.commit({'op': 'set_rate', 'currency': 'USD', 'date': '2025-01-02', 'rate': 1400})
+    trip.commit({'op': 'set_rate', 'currency': 'USD', 'date': '2025-01-02', 'rate': None})
+    trip.commit({'op': 'remove_person', 'id': 2})
+    trip.committer.flush()
+
+
+def state(trip):
+    with trip.reading():
+        snapshot = trip.to_snapshot()
+        snapshot['expenses'] = sorted(snapshot['expenses'], key=lambda exp: exp['id'])
+        return snapshot, trip.get_balances(), trip.get_totals()
+
+
+def assert_same_state(expected, actual):
+    (snapshot, balances, totals), (snapshot2, balances2, totals2) = expected, actual
+    assert snapshot == snapshot2
+    assert balances.keys() == balances2.keys()
+    for name in balances:
+        assert math.isclose(balances[name], balances2[name], abs_tol=1e-6)
+    assert totals == totals2
+
+
+# compact_every=3 이면 기록 중간중간 스냅샷으로 합쳐져서 스냅샷 + 남은 저널을 재생
+@pytest.mark.parametrize('kind, compact_every', [('json', 1000), ('sqlite', 1000), ('journal', 1000),
+                                                 ('journal', 3), ('binary', 1000), ('binary', 3)])
+def test_reopen_replays_to_same_state(tmp_path, kind, compact_every):
+    trip = open_trip(kind, str(tmp_path), compact_every)
+    apply_ops(trip)
+    expected = state(trip)
+    assert expected[0]['people'][-1] == {'id': BIG_PERSON_ID, 'name': 'z'}
+    trip.close()
+
+    reopened = open_trip(kind, str(tmp_path), compact_every)
+    assert_same_state(expected, state(reopened))
+    # 다시 연 뒤의 변경도 이어서 기록됨
+    reopened.commit({'op': 'remove_expense', 'id': 1})
+    reopened.committer.flush()
+    expected = state(reopened)
+    reopened.close()
+    assert_same_state(expected, state(open_trip(kind, str(tmp_path), compact_every)))
+
+
+def test_journal_appends_one_line_per_change(tmp_path):
+    trip = open_trip('journal', str(tmp_path))
+    apply_ops(trip)
+    trip.close()
+    assert not (tmp_path / 'data.json').exists()
+    with open(tmp_path / 'data.journal', encoding='utf-8') as f:
+        assert len(f.readlines()) == trip.version
+
+
+def test_journal_drops_a_torn_last_line(tmp_path):
+    trip = open_trip('journal', str(tmp_path))
+    apply_ops(trip)
+    expected = state(trip)
+    trip.close()
+    # 기록 도중 종료 - 마지막 줄이 반쯤만 남음
+    with open(tmp_path / 'data.journal', 'a', encoding='utf-8') as f:
+        f.write('{"op":"remove_exp')
+
+    reopened = open_trip('journal', str(tmp_path))
+    assert_same_state(expected, state(reopened))
+    reopened.commit({'op': 'remove_expense', 'id': 1})
+    reopened.close()
+    assert 1 not in open_trip('journal', str(tmp_path)).data['expenses']
+
+
+def test_remove_person_uses_the_sqlite_index(tmp_path, monkeypatch):
+    trip = open_trip('sqlite', str(tmp_path))
+    apply_ops(trip)
+    lookups = []
+    lookup = trip.storage.person_expense_ids
+    monkeypatch.setattr(trip.storage, 'person_expense_ids',
+                        lambda person_id: lookups.append(person_id) or lookup(person_id))
+    involved = {exp['id'] for exp in trip.data['expenses'].values()
+                if exp['payer'] == BIG_PERSON_ID or exp['participants'] >> BIG_PERSON_ID & 1}
+    assert involved
+
+    trip.commit({'op': 'remove_person', 'id': BIG_PERSON_ID})
+    assert lookups == [BIG_PERSON_ID]
+    assert not involved & set(trip.data['expenses'])
+    assert trip.expense_order == sorted(trip.data['expenses'])
+    expected = state(trip)
+    trip.close()
+    assert_same_state(expected, state(open_trip('sqlite', str(tmp_path))))
+
+
+@pytest.mark.parametrize('kind', ['json', 'journal'])
+def test_participants_are_stored_as_id_lists(tmp_path, kind):
+    trip = open_trip(kind, str(tmp_path))
+    apply_ops(trip)
+    trip.save()
+    trip.close()
+    with open(tmp_path / 'data.json', encoding='utf-8') as f:
+        stored = json.load(f)
+    for exp in stored['expenses']:
+        assert exp['participants'] == sorted(exp['participants'])
+        assert all(isinstance(person_id, int) for person_id in exp['participants'])
+    assert any(BIG_PERSON_ID in exp['participants'] for exp in stored['expenses'])
+
+
+def test_journal_lines_store_id_lists(tmp_path):
+    trip = open_trip('journal', str(tmp_path))
+    apply_ops(trip)
+    trip.close()
+    with open(tmp_path / 'data.journal', encoding='utf-8') as f:
+        ops = [json.loads(line) for line in f]
+    stored = [op['expense'] for op in ops if 'expense' in op]
+    assert stored and all(isinstance(exp['participants'], list) for exp in stored)
+
+
+def test_old_bitmask_snapshot_still_loads(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps({
+        'people': [{'id': 0, 'name': 'a'}, {'id': 1, 'name': 'b'}],
+        'expenses': [{'id': 1, 'description': 'x', 'amount': 10, 'currency': 'KRW', 'payer': 0,
+                      'participants': 0b11}],
+        'exchange_rates': {}, 'next_expense_id': 2, 'next_person_id': 2, 'seq': 0}), encoding='utf-8')
+    trip = open_trip('json', str(tmp_path))
+    assert trip.get_balances() == {'a': 5.0, 'b': -5.0}
+
+
+def test_old_name_snapshot_gets_person_ids(tmp_path):
+    (tmp_path / 'data.json').write_text(json.dumps({
+        'people': ['철수', '영희'],
+        'expenses': [{'id': 1, 'description': 'a', 'amount': 100, 'currency': 'KRW', 'payer': '철수',
+                      'participants': ['철수', '영희']}],
+        'exchange_rates': {}}, ensure_ascii=False), encoding='utf-8')
+    trip = open_trip('json', str(tmp_path))
+    assert trip.data['people'] == {0: '철수', 1: '영희'}
+    assert trip.data['expenses'][1]['participants'] == 0b11
+    assert trip.get_balances() == {'철수': 50.0, '영희': -50.0}
+
+
+def slow_committer(write_batch):
+    """테스트 중에는 배경 기록이 돌지 않을 만큼 긴 주기"""
+    return AsyncCommitter(write_batch, interval=60, max_pending=10000)
+
+
+@pytest.mark.parametrize('kind', ['json', 'sqlite', 'journal', 'binary'])
+def test_async_close_writes_pending_changes(tmp_path, kind):
+    trip = open_trip(kind, str(tmp_path), make_committer=slow_committer)
+    trip.commit({'op': 'add_person', 'id': 0, 'name': 'a'})
+    for i in range(20):
+        trip.commit({'op': 'add_expense', 'expense': trip.build_expense(i + 1, 'x', 10, 'KRW', 'a', [])})
+    # 응답은 기록을 기다리지 않음
+    assert trip.committer.busy()
+    assert trip.committer.stats()['pending'] == 21
+    expected = state(trip)
+    trip.close()
+    assert_same_state(expected, state(open_trip(kind, str(tmp_path))))
+
+
+def test_async_writer_flushes_after_max_pending(tmp_path):
+    trip = open_trip('journal', str(tmp_path),
+                     make_committer=lambda write_batch: AsyncCommitter(write_batch, interval=60, max_pending=5))
+    for person_id in range(5):
+        trip.commit({'op': 'add_person', 'id': person_id, 'name': f'p{person_id}'})
+    with trip.committer.cond:
+        assert trip.committer.cond.wait_for(lambda: trip.committer.durable == 5, timeout=10)
+    assert len(open_trip('journal', str(tmp_path)).data['people']) == 5
+    trip.close()
+
+
+def test_shutdown_flushes_every_cached_trip(tmp_path, monkeypatch):
+    def make_trip(trip_id, create=True):
+        directory = tmp_path / trip_id
+        directory.mkdir(exist_ok=True)
+        return Trip(trip_id, make_storage('journal', str(directory), 1000), make_committer=slow_committer)
+    monkeypatch.setattr(expense, 'trips', TripCache(make_trip))
+    for trip_id in ['x', 'y']:
+        trip = expense.trips.acquire(trip_id)
+        trip.commit({'op': 'add_person', 'id': 0, 'name': trip_id})
+        expense.trips.release(trip)
+    expense.flush_on_shutdown()
+    for trip_id in ['x', 'y']:
+        assert open_trip('journal', str(tmp_path / trip_id)).data['people'] == {0: trip_id}
+
+
+def test_remove_person_with_pending_writes_scans_memory(tmp_path):
+    # 아직 기록되지 않은 지출은 SQLite 색인에 없음 - 메모리를 훑어서 찾아야 함
+    trip = open_trip('sqlite', str(tmp_path), make_committer=slow_committer)
+    for person_id, name in enumerate(['a', 'b']):
+        trip.commit({'op': 'add_person', 'id': person_id, 'name': name})
+    trip.commit({'op': 'add_expense', 'expense': trip.build_expense(1, 'x', 10, 'KRW', 'a', ['a', 'b'])})
+    trip.commit({'op': 'remove_person', 'id': 1})
+    assert not trip.data['expenses']
+    trip.close()
+    assert not open_trip('sqlite', str(tmp_path)).data['expenses']
+
+
+def test_binary_snapshot_loads_expenses_lazily(tmp_path):
+    trip = open_trip('binary', str(tmp_path), compact_every=3)
+    apply_ops(trip)
+    expected = state(trip)
+    trip.close()
+    assert is_binary(tmp_path / 'data.bin')
+
+    reopened = open_trip('binary', str(tmp_path), compact_every=3)
+    # 장부는 열에서 바로 만들고, 지출 dict 는 꺼낼 때만 만듦
+    assert any(isinstance(value, int) for value in reopened.data['expenses'].items_by_id.values())
+    assert_same_state(expected, state(reopened))
+
+
+def test_convert_snapshot_round_trip(tmp_path):
+    # 예전 형식(이름으로 된 사람/지출) JSON -> 바이너리 -> JSON
+    old = {'people': ['철수', '영희'],
+           'expenses': [{'id': 1, 'description': 'a', 'amount': 100, 'currency': 'JPY', 'payer': '철수',
+                         'participants': ['철수', '영희']},
+                        {'id': 1, 'description': 'b', 'amount': 50, 'currency': 'KRW', 'payer': '영희',
+                         'participants': ['영희'], 'date': '2025-01-02'}],
+           'exchange_rates': {'JPY': 9.5}}
+    (tmp_path / 'old.json').write_text(json.dumps(old, ensure_ascii=False), encoding='utf-8')
+    runner = expense.app.test_cli_runner()
+    for source, target in [('old.json', 'snap.bin'), ('snap.bin', 'back.json')]:
+        result = runner.invoke(args=['convert-snapshot', str(tmp_path / source), str(tmp_path / target)])
+        assert result.exit_code == 0, result.output
+    assert is_binary(tmp_path / 'snap.bin')
+    back = json.loads((tmp_path / 'back.json').read_text(encoding='utf-8'))
+    assert back['people'] == [{'id': 0, 'name': '철수'}, {'id': 1, 'name': '영희'}]
+    assert [(exp['id'], exp['payer'], exp['participants']) for exp in back['expenses']] == [(1, 0, [0, 1]),
+                                                                                          (2, 1, [1])]
+
+
+def test_convert_snapshot_leaves_no_partial_file(tmp_path):
+    (tmp_path / 'bad.json').write_text(json.dumps({'people': [{'id': 0, 'name': 'a'}], 'expenses': [{'id': 1}]}),
+                                       encoding='utf-8')
+    result = expense.app.test_cli_runner().invoke(
+        args=['convert-snapshot', str(tmp_path / 'bad.json'), str(tmp_path / 'bad.bin')])
+    assert result.exit_code != 0
+    assert not (tmp_path / 'bad.bin').exists()
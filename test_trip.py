@@ -0,0 +1,292 @@
+# test_trip.py
+# 정산 장부 - 지출 추가/수정/삭제 뒤에도 장부로 읽은 잔액·총계가 전체 재계산과 같은지
+import datetime
+import logging
+import math
+import random
+
+import pytest
+
+from columnar import HAVE_NUMPY
+import trip as trip_module
+from storage import JsonStorage
+from trip import Trip, TripCache, rate_key
+
+NAMES = ['a', 'b', 'c', 'd']
+
+
+def new_trip(directory, names=NAMES):
+    trip = Trip('t', JsonStorage(str(directory / 'data.json')))
+    trip.load()
+    for name in names:
+        trip.commit({'op': 'add_person', 'id': trip.data['next_person_id'], 'name': name})
+    return trip
+
+
+def add(trip, amount, currency='KRW', payer='a', participants=(), date='2025-01-01'):
+    expense = trip.build_expense(trip.data['next_expense_id'], 'x', amount, currency, payer, list(participants),
+                                 date)
+    trip.commit({'op': 'add_expense', 'expense': expense})
+    return expense
+
+
+def assert_ledger_matches(trip):
+    """장부로 읽은 잔액·총계 == 지출 전체를 다시 계산한 값"""
+    with trip.reading():
+        balances = trip.get_balances()
+        expected = trip.calculate_settlement()
+        total = trip.get_totals()[2]
+        expected_total = sum(trip.to_krw(exp['amount'], *rate_key(exp)) for exp in trip.data['expenses'].values())
+    assert balances.keys() == expected.keys()
+    for name, balance in expected.items():
+        assert math.isclose(balances[name], balance, rel_tol=1e-9, abs_tol=1e-6), name
+    assert math.isclose(total, expected_total, rel_tol=1e-9, abs_tol=1e-6)
+
+
+def random_expense_ops(trip, rng, steps):
+    """지출 추가/수정/삭제를 섞어서 반영"""
+    for _ in range(steps):
+        ids = list(trip.data['expenses'])
+        kind = rng.choice(['add', 'add', 'edit', 'remove']) if ids else 'add'
+        if kind == 'add':
+            add(trip, rng.randint(1, 100000) / rng.choice([1, 3, 7]), rng.choice(['KRW', 'JPY', 'USD']),
+                rng.choice(NAMES), rng.sample(NAMES, rng.randint(0, len(NAMES))),
+                f'2025-01-{rng.randint(1, 9):02d}')
+        elif kind == 'edit':
+            old = trip.data['expenses'][rng.choice(ids)]
+            edited = trip.build_expense(old['id'], 'y', rng.randint(1, 5000), rng.choice(['KRW', 'JPY']),
+                                        rng.choice(NAMES), rng.sample(NAMES, 2))
+            trip.commit({'op': 'edit_expense', 'expense': edited})
+        else:
+            trip.commit({'op': 'remove_expense', 'id': rng.choice(ids)})
+
+
+def test_ledger_matches_recompute_after_expense_changes(tmp_path):
+    trip = new_trip(tmp_path)
+    trip.commit({'op': 'set_exchange_rates', 'rates': {'JPY': 9.5, 'USD': 1350}})
+    rng = random.Random(1)
+    for _ in range(12):
+        random_expense_ops(trip, rng, 25)
+        assert_ledger_matches(trip)
+    for expense_id in list(trip.data['expenses']):
+        trip.commit({'op': 'remove_expense', 'id': expense_id})
+    add(trip, 10)
+    assert_ledger_matches(trip)
+
+
+def test_ledger_matches_recompute_after_remove_person(tmp_path):
+    trip = new_trip(tmp_path)
+    random_expense_ops(trip, random.Random(2), 100)
+    trip.commit({'op': 'remove_person', 'id': trip.person_ids['b']})
+    assert all(exp['payer'] != 1 and not exp['participants'] & 0b10 for exp in trip.data['expenses'].values())
+    assert_ledger_matches(trip)
+
+
+def test_verify_ledger_finds_no_mismatch(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(trip_module, 'VERIFY_LEDGER', True)
+    trip = new_trip(tmp_path)
+    rng = random.Random(3)
+    with caplog.at_level(logging.ERROR, logger='trip'):
+        for _ in range(10):
+            random_expense_ops(trip, rng, 20)
+            with trip.reading():
+                trip.get_balances()
+    assert not caplog.records
+
+
+def test_verify_ledger_repairs_a_broken_ledger(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(trip_module, 'VERIFY_LEDGER', True)
+    trip = new_trip(tmp_path)
+    add(trip, 100, participants=['a', 'b'])
+    trip.ledger[0][('KRW', None)] = 1000
+    with caplog.at_level(logging.ERROR, logger='trip'):
+        assert trip.get_balances() == {'a': 50.0, 'b': -50.0, 'c': 0.0, 'd': 0.0}
+    assert '불일치' in caplog.text
+    assert trip.ledger[0] == {('KRW', None): 50.0}
+    assert_ledger_matches(trip)
+
+
+@pytest.mark.parametrize('amount', ['nan', 'inf', '-inf', float('nan'), float('inf')])
+def test_non_finite_amount_is_rejected(tmp_path, amount):
+    trip = new_trip(tmp_path)
+    with pytest.raises(ValueError, match='잘못된 금액'):
+        add(trip, amount)
+    assert not trip.data['expenses']
+
+
+def test_ledger_matches_recompute_after_exchange_rate_changes(tmp_path):
+    trip = new_trip(tmp_path)
+    rng = random.Random(4)
+    for _ in range(10):
+        random_expense_ops(trip, rng, 15)
+        # 환율을 바꿔도 장부는 그대로 - 읽을 때 새 배율로 환산
+        rates = {currency: rng.choice([None, 8.5, 9.5, 1300, 1400.25]) for currency in ['JPY', 'USD']}
+        trip.commit({'op': 'set_exchange_rates', 'rates': rates})
+        assert_ledger_matches(trip)
+
+
+def test_exchange_rate_change_keeps_the_ledger(tmp_path):
+    trip = new_trip(tmp_path)
+    add(trip, 1000, 'JPY', participants=['a', 'b'])
+    ledger = {person_id: dict(row) for person_id, row in trip.ledger.items()}
+    trip.commit({'op': 'set_exchange_rates', 'rates': {'JPY': 9.0}})
+    assert trip.ledger == ledger
+    assert trip.get_balances()['a'] == 4500.0
+    trip.commit({'op': 'set_exchange_rates', 'rates': {'JPY': 10.0}})
+    assert trip.get_balances()['a'] == 5000.0
+    assert trip.get_totals()[2] == 10000.0
+
+
+@pytest.mark.skipif(not HAVE_NUMPY, reason='NumPy 가 없음')
+def test_numpy_engine_matches_python_engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(trip_module, 'settlement_engine', 'ledger')
+    trip = new_trip(tmp_path)
+    trip.commit({'op': 'set_exchange_rates', 'rates': {'JPY': 9.5, 'USD': 1350}})
+    trip.commit({'op': 'set_rate', 'currency': 'JPY', 'date': '2025-01-05', 'rate': 9.1})
+    rng = random.Random(5)
+    random_expense_ops(trip, rng, 200)
+    trip_module.use_engine('numpy')
+    for _ in range(5):
+        # 열 저장소도 변경마다 차이만 반영 (삭제가 쌓이면 압축)
+        random_expense_ops(trip, rng, 60)
+        with trip.reading():
+            numpy_balances, numpy_totals = trip.get_balances(), trip.get_totals()
+            trip_module.use_engine('python')
+            python_balances, python_totals = trip.get_balances(), trip.get_totals()
+            trip_module.use_engine('numpy')
+        assert numpy_balances.keys() == python_balances.keys()
+        for name, balance in python_balances.items():
+            assert math.isclose(numpy_balances[name], balance, rel_tol=1e-9, abs_tol=1e-6), name
+        assert math.isclose(numpy_totals[2], python_totals[2], rel_tol=1e-9)
+        for currency, amount in python_totals[0].items():
+            assert math.isclose(numpy_totals[0][currency], amount, rel_tol=1e-9, abs_tol=1e-6), currency
+
+
+def make_cache(directory, **limits):
+    def make_trip(trip_id, create=True):
+        path = directory / trip_id
+        if not path.is_dir():
+            if not create:
+                return None
+            path.mkdir()
+        return Trip(trip_id, JsonStorage(str(path / 'data.json')))
+    return TripCache(make_trip, **limits)
+
+
+def use(cache, trip_id):
+    trip = cache.acquire(trip_id)
+    with trip.reading():
+        pass
+    cache.release(trip)
+    return trip
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = make_cache(tmp_path, max_trips=2)
+    first = use(cache, 'a')
+    use(cache, 'b')
+    assert use(cache, 'a') is first
+    use(cache, 'c')
+    assert [trip.trip_id for trip in cache.loaded()] == ['a', 'c']
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_cache_keeps_pinned_trips(tmp_path):
+    cache = make_cache(tmp_path, max_trips=1)
+    pinned = cache.acquire('a')
+    use(cache, 'b')
+    use(cache, 'c')
+    assert 'a' in [trip.trip_id for trip in cache.loaded()]
+    # 쓰는 중에 내려간 여행과 다른 객체가 생기면 변경이 사라짐
+    assert cache.acquire('a') is pinned
+    cache.release(pinned)
+    cache.release(pinned)
+    use(cache, 'd')
+    assert [trip.trip_id for trip in cache.loaded()] == ['d']
+
+
+def test_cache_evicts_by_estimated_memory(tmp_path):
+    cache = make_cache(tmp_path, max_bytes=trip_module.TRIP_BYTES * 20)
+    big = cache.acquire('big')
+    with big.mutation():
+        big.commit({'op': 'add_person', 'id': 0, 'name': 'a'})
+        for expense_id in range(1, 200):
+            big.commit({'op': 'add_expense', 'expense': big.build_expense(expense_id, 'x', 1, 'KRW', 'a', [])})
+    # 아직 쓰는 중 - 한도를 넘어도 내리지 않음
+    use(cache, 'small')
+    assert 'big' in [trip.trip_id for trip in cache.loaded()]
+    cache.release(big)
+    assert [trip.trip_id for trip in cache.loaded()] == ['small']
+    assert cache.stats()['bytes'] <= cache.max_bytes
+    # 내릴 때 닫으면서 기록한 내용을 다시 읽음
+    assert len(use(cache, 'big').data['expenses']) == 199
+
+
+def test_cache_does_not_create_missing_trips_on_read(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.acquire('missing', create=False) is None
+    assert not (tmp_path / 'missing').exists()
+    assert cache.stats()['trips'] == 0
+
+
+def period_keys(trip):
+    """장부에 금액이 남아 있는 (통화, 구간 시작 날짜)"""
+    return {key for row in trip.ledger.values() for key, amount in row.items() if abs(amount) > 1e-9}
+
+
+def test_dated_rates_split_and_merge_periods(tmp_path):
+    trip = new_trip(tmp_path)
+    trip.commit({'op': 'set_exchange_rates', 'rates': {'JPY': 10}})
+    for day in range(1, 10):
+        add(trip, 100 * day, 'JPY', participants=['a', 'b'], date=f'2025-01-{day:02d}')
+    assert period_keys(trip) == {('JPY', None)}
+
+    trip.commit({'op': 'set_rate', 'currency': 'JPY', 'date': '2025-01-05', 'rate': 9})
+    assert period_keys(trip) == {('JPY', None), ('JPY', '2025-01-05')}
+    assert_ledger_matches(trip)
+    trip.commit({'op': 'set_rate', 'currency': 'JPY', 'date': '2025-01-03', 'rate': 8})
+    assert period_keys(trip) == {('JPY', None), ('JPY', '2025-01-03'), ('JPY', '2025-01-05')}
+    assert_ledger_matches(trip)
+    # 1/3 ~ 1/4 지출: 100 * (3 + 4) 엔 x 8, 1/5 ~ 1/9: 100 * 35 엔 x 9, 그 전: 100 * 3 엔 x 10
+    assert trip.get_totals()[2] == 700 * 8 + 3500 * 9 + 300 * 10
+
+    # 환율 값만 바뀌면 구간은 그대로
+    trip.commit({'op': 'set_rate', 'currency': 'JPY', 'date': '2025-01-05', 'rate': 9.5})
+    assert period_keys(trip) == {('JPY', None), ('JPY', '2025-01-03'), ('JPY', '2025-01-05')}
+    # 지우면 앞 구간에 합쳐짐
+    trip.commit({'op': 'set_rate', 'currency': 'JPY', 'date': '2025-01-05', 'rate': None})
+    assert period_keys(trip) == {('JPY', None), ('JPY', '2025-01-03')}
+    assert trip.get_totals()[2] == 4200 * 8 + 300 * 10
+    trip.commit({'op': 'set_rate', 'currency': 'JPY', 'date': '2025-01-03', 'rate': None})
+    assert period_keys(trip) == {('JPY', None)}
+    assert not trip.data['rate_history']
+    assert_ledger_matches(trip)
+
+
+def test_ledger_matches_recompute_with_random_rate_history(tmp_path):
+    trip = new_trip(tmp_path)
+    trip.commit({'op': 'set_exchange_rates', 'rates': {'JPY': 9.5}})
+    rng = random.Random(6)
+    for _ in range(40):
+        random_expense_ops(trip, rng, 5)
+        currency = rng.choice(['JPY', 'USD'])
+        trip.commit({'op': 'set_rate', 'currency': currency, 'date': f'2025-01-{rng.randint(1, 9):02d}',
+                     'rate': rng.choice([None, None, 9.1, 1300, 1400])})
+        assert_ledger_matches(trip)
+        for key in period_keys(trip):
+            assert key[1] is None or key[1] in trip.rate_dates[key[0]]
+    expected = trip.get_balances()
+    trip.close()
+    reopened = Trip('t', JsonStorage(str(tmp_path / 'data.json')))
+    reopened.load()
+    assert reopened.get_balances() == expected
+
+
+def test_undated_expense_gets_todays_rate_period(tmp_path):
+    trip = new_trip(tmp_path)
+    today = datetime.date.today().isoformat()
+    trip.commit({'op': 'set_rate', 'currency': 'JPY', 'date': today, 'rate': 9})
+    expense = add(trip, 100, 'JPY', date=None)
+    assert expense['date'] == today
+    assert trip.get_totals()[2] == 900
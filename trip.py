@@ -0,0 +1,904 @@
+# trip.py
+# 여행 하나의 상태 (사람/지출/환율, 정산 장부, 저장소) 와 자주 쓰는 여행을 메모리에 두는 LRU 캐시
+# 서버 하나가 여러 여행을 다루므로 예전 전역 변수들은 모두 Trip 객체 안으로 옮김
+from collections import OrderedDict, deque
+import bisect
+from contextlib import contextmanager, nullcontext
+import datetime
+import logging
+import math
+import os
+import threading
+
+from bitset import bit_count, has_bit, iter_bits, mask_of
+from columnar import HAVE_NUMPY, ColumnarExpenses
+import metrics
+from settle import plan_transfers
+from storage import GroupCommitter
+
+logger = logging.getLogger(__name__)
+
+# 지원 통화 (KRW는 환율 없이 그대로 사용)
+CURRENCIES = ['KRW', 'JPY', 'USD', 'EUR', 'CNY']
+
+# 장부와 전체 재계산 결과를 비교하는 검증 모드 (VERIFY_LEDGER=1)
+VERIFY_LEDGER = os.environ.get('VERIFY_LEDGER') == '1'
+LEDGER_TOLERANCE = 1e-6
+
+# 정산 엔진: 'ledger' (증분 장부) / 'python' (매번 전체 재계산) / 'numpy' (열 배열 벡터 연산)
+# 모든 여행에 공통으로 적용
+SETTLEMENT_ENGINES = ['ledger', 'python', 'numpy']
+settlement_engine = 'ledger'
+
+# 캐시 메모리 추정용 대략값 (sys.getsizeof 로 잰 지출 dict + 값 + 장부/열 저장소 몫)
+EXPENSE_BYTES = 800
+PERSON_BYTES = 700
+TRIP_BYTES = 4096
+FRAGMENT_BYTES = 2000
+
+# 여행마다 캐시해 두는 지출 한 줄 HTML 조각 수 (오래 안 쓴 것부터 버림)
+ROW_FRAGMENT_CACHE = 1000
+
+# 실시간 변경 알림(ops_since)용으로 보관하는 최근 변경 기록 수
+RECENT_OPS = 256
+
+
+def use_engine(name):
+    """정산 엔진 변경 (실행 중에도 가능) - NumPy 가 없으면 python 으로 대체"""
+    global settlement_engine
+    if name not in SETTLEMENT_ENGINES:
+        raise ValueError(f'알 수 없는 정산 엔진: {name}')
+    if name == 'numpy' and not HAVE_NUMPY:
+        logger.warning('NumPy 가 없어서 python 정산 엔진을 사용합니다')
+        name = 'python'
+    settlement_engine = name
+
+
+def empty_data():
+    # people 은 사람 id -> 이름, expenses 는 지출 id -> 지출 (입력 순서 유지), 파일에는 목록으로 저장
+    # 지출의 payer 는 사람 id, participants 는 사람 id 비트마스크 (파일에는 id 목록, storage 참고)
+    return {
+        'people': {},
+        'expenses': {},
+        'exchange_rates': {
+            'JPY': None,
+            'USD': None,
+            'EUR': None,
+            'CNY': None
+        },
+        # 날짜별 환율: 통화 -> [[날짜, 환율], ...] (날짜 오름차순)
+        # 지출 날짜의 환율 = 그 날짜까지의 마지막 값, 없으면 exchange_rates 의 기본 환율
+        'rate_history': {},
+        'next_expense_id': 1,  # 지워진 지출의 id 는 다시 쓰지 않음
+        'next_person_id': 0,
+        'seq': 0  # 마지막으로 반영된 변경 순번
+    }
+
+
+def from_snapshot(snapshot):
+    """저장 형식(사람/지출 목록) -> 메모리 형식(id -> 사람/지출)"""
+    people = snapshot['people']
+    if people and isinstance(people[0], str):
+        # 예전 형식: 이름 목록, 지출에도 이름이 그대로 들어 있음
+        people = [{'id': person_id, 'name': name} for person_id, name in enumerate(people)]
+        ids = {person['name']: person['id'] for person in people}
+        for exp in snapshot['expenses']:
+            exp['payer'] = ids[exp['payer']]
+            exp['participants'] = mask_of(ids[name] for name in exp['participants'])
+    snapshot['people'] = {person['id']: person['name'] for person in people}
+    snapshot['next_person_id'] = max([snapshot.get('next_person_id', 0)] +
+                                     [person_id + 1 for person_id in snapshot['people']])
+
+    snapshot.setdefault('rate_history', {})
+    if not isinstance(snapshot['expenses'], list):
+        # 바이너리 스냅샷은 이미 id -> 지출 (꺼낼 때 만드는 LazyExpenses) - id 도 겹치지 않음
+        return snapshot
+
+    expenses = {}
+    next_id = max([snapshot.get('next_expense_id', 1)] +
+                  [exp['id'] + 1 for exp in snapshot['expenses']])
+    for exp in snapshot['expenses']:
+        # 예전 방식(len + 1)으로 겹친 id 는 새로 발급
+        if exp['id'] in expenses:
+            exp['id'] = next_id
+            next_id += 1
+        expenses[exp['id']] = exp
+    snapshot['expenses'] = expenses
+    snapshot['next_expense_id'] = next_id
+    return snapshot
+
+
+def to_snapshot(data):
+    """메모리 형식 -> 저장 형식 (지출 dict 는 바뀌지 않고 교체만 되므로 목록만 복사하면 됨)"""
+    snapshot = dict(data)
+    snapshot['people'] = [{'id': person_id, 'name': name} for person_id, name in data['people'].items()]
+    snapshot['expenses'] = list(data['expenses'].values())
+    snapshot['exchange_rates'] = dict(data['exchange_rates'])
+    snapshot['rate_history'] = dict(data['rate_history'])
+    return snapshot
+
+
+def parse_date(value):
+    """'YYYY-MM-DD' 확인 (비어 있으면 None) - 잘못된 날짜면 ValueError"""
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        raise ValueError(f'잘못된 날짜: {value}')
+
+
+def rate_key(expense):
+    """환산 배율의 키 (통화, 날짜) - 키가 같은 지출은 항상 같은 환율로 환산됨"""
+    return expense.get('currency', 'JPY'), expense.get('date')
+
+
+def with_rate(history, date, rate):
+    """날짜별 환율 목록에 date 부터의 환율을 넣은 새 목록 (rate 가 None 이면 그 날짜의 환율을 뺌)"""
+    history = list(history)
+    index = bisect.bisect_left([point[0] for point in history], date)
+    if index < len(history) and history[index][0] == date:
+        del history[index]
+    if rate is not None:
+        history.insert(index, [date, rate])
+    return history
+
+
+class Trip:
+    """여행 하나 - data 와 장부는 lock 을 잡고 읽고 씀 (변경은 mutation(), 읽기는 reading() 안에서)"""
+
+    def __init__(self, trip_id, storage, migrate_from=None, make_committer=GroupCommitter,
+                 process_lock=None):
+        self.trip_id = trip_id
+        self.storage = storage
+        # 빈 저장소로 처음 시작할 때 옮겨올 예전 저장소 (sqlite 모드의 JSON 파일)
+        self.migrate_from = migrate_from
+        self.data = empty_data()
+        self.person_ids = {}  # 이름 -> 사람 id
+        self.expense_order = []  # 지출 id 오름차순 - 커서(id) 기반 페이지 나누기용
+        # 정산 장부: 사람별 잔액을 지출 추가/삭제 시 차액만 반영해서 유지 (매번 전체 재계산하지 않음)
+        # (통화, 환율 구간)별 원래 금액으로 쌓아두고, 원화 환산은 읽을 때 그 구간의 환율을 곱해서 계산
+        # 환율 구간 = 적용되는 날짜별 환율의 시작 날짜 (기본 환율이면 None) -> 읽기는 O(사람 수 x 구간 수)
+        # 환율 값이 바뀌면 장부는 그대로, 날짜별 환율이 생기거나 없어지면 그 구간의 날짜만 옮김
+        self.ledger = {}      # 사람 id -> {(통화, 구간 시작 날짜): 금액}
+        self.key_totals = {}  # (통화, 구간 시작 날짜) -> 지출 합계
+        # 날짜별 장부 - 구간을 나누거나 합칠 때와 미리 보기에서 환율을 바꾼 통화를 다시 환산할 때만 씀
+        self.date_ledger = {}  # (통화, 날짜) -> {사람 id: 금액}
+        self.date_totals = {}  # (통화, 날짜) -> 지출 합계
+        # 통화 -> 날짜별 환율의 날짜 목록 (rate_history 와 같은 순서, bisect 용)
+        self.rate_dates = {}
+        # (통화, 날짜) -> 원화 환산 배율 - 환율이 바뀌면 영향받는 날짜의 것만 지움
+        self.rate_memo = {}
+        self.columnar = None  # numpy 엔진일 때만 유지하는 열 저장소
+        self.view_cache = {}  # 정산 화면 값 - 'version' 이 지금 버전과 같을 때만 유효
+        self.reset_views()
+        self.lock = threading.RLock()
+        # 변경을 반영할 때마다 notify_all - 실시간 알림이 lock 을 놓고 기다림
+        self.changed = threading.Condition(self.lock)
+        self.recent_ops = deque(maxlen=RECENT_OPS)
+        self.local = threading.local()
+        # 변경 기록기 - GroupCommitter (응답 전에 기록) 또는 AsyncCommitter (배경에서 기록)
+        self.committer = make_committer(self.persist)
+        # 여러 프로세스가 같은 여행을 쓸 때의 ProcessLock (한 프로세스만 쓰면 None)
+        # 있으면 변경은 파일 잠금 안에서 다시 읽기 -> 변경 -> 기록까지 끝내고, 바뀌었는지는 변경 번호로 확인
+        self.process_lock = process_lock
+        # 마지막으로 읽은(또는 이 프로세스가 쓴) 저장소 상태 (파일이면 mtime, 크기)
+        # 다른 프로세스가 파일을 바꾸지 않았으면 다시 파싱하지 않음
+        self.loaded_signature = None
+        self.load_stats = {'hits': 0, 'misses': 0}
+
+    def reset_views(self):
+        # 지출 id -> (환율, 원화 환산액, 1인당 몫, 몫의 통화) - 환율이 그대로인 동안 유효
+        self.expense_numbers_cache = {}
+        # 지출 id -> (표시 값, HTML) - LRU
+        self.row_fragments = OrderedDict()
+        # 그 밖의 HTML 조각: key -> (버전, HTML)
+        self.fragments = {}
+
+    def load(self):
+        with metrics.phase('load'):
+            self.load_snapshot()
+
+    def load_snapshot(self):
+        self.reset_views()
+        self.recent_ops.clear()
+        snapshot, ops = self.storage.load()
+        migrated = False
+        if snapshot is None and self.migrate_from is not None:
+            snapshot = self.migrate_from.read_snapshot()
+            migrated = snapshot is not None
+        self.data = from_snapshot(snapshot) if snapshot is not None else empty_data()
+        self.rebuild_person_ids()
+        self.rebuild_rate_index()
+        self.expense_order = sorted(self.data['expenses'])
+        if migrated:
+            self.save()
+        self.rebuild_ledger()
+        self.rebuild_columnar()
+        for op in ops:
+            # 압축 도중 종료되면 스냅샷에 이미 들어간 기록이 남아 있을 수 있음
+            if op['seq'] > self.data.get('seq', 0):
+                upgraded = self.upgrade_op(op)
+                if upgraded is not None:
+                    self.apply_op(upgraded)
+                else:
+                    self.data['seq'] = op['seq']
+
+    def load_cached(self):
+        """저장소가 바뀌었을 때만 load() (이 프로세스가 쓴 내용은 이미 메모리에 있음)"""
+        if self.committer.busy():
+            # 아직 기록 중인 변경이 있으면 파일이 바뀐 건 이 프로세스 때문 - 다시 읽으면 변경이 사라짐
+            self.load_stats['hits'] += 1
+            return
+        signature = self.signature()
+        if signature == self.loaded_signature:
+            self.load_stats['hits'] += 1
+            return
+        self.load_stats['misses'] += 1
+        if self.process_lock is None:
+            self.load()
+            self.loaded_signature = signature
+            return
+        # 다른 프로세스가 쓰는 도중의 파일(저널 끝 등)을 읽지 않도록 잠금 안에서
+        with self.process_lock:
+            self.loaded_signature = self.signature()
+            self.load()
+
+    def signature(self):
+        """저장소 상태 - 여러 프로세스 모드면 변경 번호, 아니면 저장소의 signature()"""
+        if self.process_lock is not None:
+            return self.process_lock.version()
+        return self.storage.signature()
+
+    def to_snapshot(self):
+        with self.lock:
+            return to_snapshot(self.data)
+
+    def rebuild_person_ids(self):
+        self.person_ids = {name: person_id for person_id, name in self.data['people'].items()}
+
+    def upgrade_op(self, op):
+        """이름으로 기록된 예전 저널 기록 -> 사람 id 기록 (해당 사람이 없으면 None)"""
+        kind = op['op']
+        person_ids = self.person_ids
+        if kind == 'add_person' and 'id' not in op:
+            op['id'] = self.data['next_person_id']
+        elif kind == 'remove_person' and 'id' not in op:
+            if op['name'] not in person_ids:
+                return None
+            op['id'] = person_ids[op['name']]
+        elif kind in ('add_expense', 'edit_expense') and isinstance(op['expense']['payer'], str):
+            expense = op['expense']
+            names = [expense['payer']] + expense['participants']
+            if any(name not in person_ids for name in names):
+                return None
+            expense['payer'] = person_ids[expense['payer']]
+            expense['participants'] = mask_of(person_ids[name] for name in expense['participants'])
+        return op
+
+    def save(self):
+        with metrics.phase('save'):
+            metrics.observe_save(self.storage.save(self.to_snapshot()))
+
+    def persist(self, ops):
+        """변경 묶음을 저장소에 기록 (GroupCommitter 의 리더 스레드가 호출)"""
+        # 쓰기 전에 다른 프로세스가 바꿨다면 다음 읽기 때 다시 로드하도록 표시만 해 둠
+        fresh = self.signature() == self.loaded_signature
+        with metrics.phase('save'):
+            metrics.observe_save(self.storage.write_batch(ops, self.to_snapshot))
+        if self.process_lock is not None:
+            self.process_lock.bump()
+        self.loaded_signature = self.signature() if fresh else None
+
+    def apply_op(self, op):
+        """변경 기록 하나를 메모리(data, 장부)에 반영 - 요청 처리와 저널 재생에서 공용"""
+        data = self.data
+        kind = op['op']
+        if kind == 'add_person':
+            person_id = op['id']
+            data['people'][person_id] = op['name']
+            data['next_person_id'] = max(data['next_person_id'], person_id + 1)
+            self.person_ids[op['name']] = person_id
+            self.ledger[person_id] = {}
+            if self.columnar is not None:
+                self.columnar.add_person(person_id)
+        elif kind == 'remove_person':
+            person_id = op['id']
+            del self.person_ids[data['people'].pop(person_id)]
+            # 해당 사람 관련 지출도 제거 - 저장소 색인(SQLite)으로 찾고, 색인이 없으면 지출마다 비트 검사 한 번
+            # 제자리에서 지움 - 바이너리 스냅샷에서 아직 꺼내지 않은 지출은 그대로 남음
+            expenses = data['expenses']
+            for exp in self.person_expenses(person_id):
+                del expenses[exp['id']]
+                del self.expense_order[bisect.bisect_left(self.expense_order, exp['id'])]
+                self.drop_expense(exp)
+            del self.ledger[person_id]
+            for row in self.date_ledger.values():
+                row.pop(person_id, None)
+        elif kind == 'add_expense':
+            expense = op['expense']
+            data['expenses'][expense['id']] = expense
+            data['next_expense_id'] = max(data['next_expense_id'], expense['id'] + 1)
+            # 새 id 는 항상 가장 크므로 보통은 맨 뒤에 붙음
+            bisect.insort(self.expense_order, expense['id'])
+            self.put_expense(expense)
+        elif kind == 'edit_expense':
+            # 같은 id 자리에 덮어쓰므로 목록 순서도 유지됨
+            expense = op['expense']
+            self.drop_expense(data['expenses'][expense['id']])
+            data['expenses'][expense['id']] = expense
+            self.put_expense(expense)
+        elif kind == 'remove_expense':
+            expense = data['expenses'].pop(op['id'], None)
+            if expense is not None:
+                del self.expense_order[bisect.bisect_left(self.expense_order, op['id'])]
+                self.drop_expense(expense)
+        elif kind == 'set_exchange_rates':
+            data['exchange_rates'].update(op['rates'])
+            # 기본 환율은 날짜가 없거나 첫 날짜별 환율보다 이른 지출에만 쓰임
+            first_dates = {currency: self.rate_dates.get(currency) for currency in op['rates']}
+            self.forget_rates(lambda currency, date: currency in first_dates and
+                              (date is None or not first_dates[currency] or date < first_dates[currency][0]))
+        elif kind == 'set_rate':
+            self.set_rate(op['currency'], op['date'], op['rate'])
+        elif kind == 'clear_all':
+            data['people'] = {}
+            self.person_ids.clear()
+            data['expenses'] = {}
+            self.expense_order = []
+            data['exchange_rates'] = empty_data()['exchange_rates']
+            data['rate_history'] = {}
+            self.rebuild_rate_index()
+            self.ledger.clear()
+            self.key_totals.clear()
+            self.date_ledger.clear()
+            self.date_totals.clear()
+            self.rebuild_columnar()
+            self.reset_views()
+        data['seq'] = op['seq']
+        self.recent_ops.append(op)
+
+    def put_expense(self, expense):
+        """새 지출을 장부(와 열 저장소)에 반영"""
+        self.apply_expense_to_ledger(expense)
+        if self.columnar is not None:
+            self.columnar.add(expense)
+
+    def drop_expense(self, expense):
+        """지워지는 지출을 장부(와 열 저장소)에서 취소"""
+        self.expense_numbers_cache.pop(expense['id'], None)
+        self.row_fragments.pop(expense['id'], None)
+        self.apply_expense_to_ledger(expense, sign=-1)
+        if self.columnar is not None:
+            self.columnar.remove(expense)
+
+    @contextmanager
+    def mutation(self):
+        """변경 구간 - 잠금 안에서 검사하고 commit(), 잠금을 푼 뒤 디스크 기록을 기다림
+
+        잠금 밖에서 기다리므로 동시에 들어온 변경들이 한 번의 기록(fsync)으로 묶임.
+        여러 프로세스 모드에서는 파일 잠금을 풀기 전에 기록을 끝냄 (다른 프로세스가 바로 읽을 수 있게).
+        """
+        with self.lock, self.process_lock or nullcontext():
+            # 캐시에서 내려갔다 다시 올라온 여행이면 여기서 처음 읽음
+            # (여러 프로세스 모드에서는 다른 워커가 바꾼 내용을 잠금 안에서 다시 읽음)
+            self.load_cached()
+            self.local.ticket = 0
+            try:
+                yield
+            finally:
+                ticket, self.local.ticket = self.local.ticket, None
+                if ticket and self.process_lock is not None:
+                    self.committer.wait(ticket)
+                    ticket = 0
+        if ticket and self.committer.synchronous:
+            self.committer.wait(ticket)
+
+    @contextmanager
+    def reading(self):
+        """읽기 구간 - 다른 프로세스가 바꾼 내용이 있으면 먼저 다시 읽음"""
+        with self.lock:
+            self.load_cached()
+            yield
+
+    def commit(self, op):
+        """변경 순번을 붙여 메모리에 반영하고 기록 대기열에 넣음"""
+        if getattr(self.local, 'ticket', None) is None:
+            with self.mutation():
+                self.commit(op)
+            return
+        op['seq'] = self.data.get('seq', 0) + 1
+        self.apply_op(op)
+        metrics.count_op(op['op'])
+        self.local.ticket = self.committer.submit(op)
+        self.changed.notify_all()
+
+    def ops_since(self, version):
+        """version 다음부터 지금까지 반영한 변경 기록 - 최근 기록에 다 남아 있지 않으면 None"""
+        if version == self.version:
+            return []
+        ops = [op for op in self.recent_ops if op['seq'] > version]
+        if not ops or ops[0]['seq'] != version + 1 or ops[-1]['seq'] != self.version:
+            return None
+        return ops
+
+    def build_expense(self, expense_id, description, amount, currency, payer, participants, date=None,
+                      person_ids=None):
+        """입력값 -> 지출 dict (폼, 일괄 가져오기, 미리 보기 공용) - 잘못된 입력이면 ValueError
+
+        payer / participants 는 이름, participants 가 비어 있으면 전체.
+        date 는 'YYYY-MM-DD', 없으면 오늘 (어느 경로로 추가해도 같은 날짜 -> 같은 환율).
+        person_ids 는 이름 -> 사람 id (없으면 지금 사람들 - 미리 보기는 가정한 사람들을 넘김).
+        """
+        if person_ids is None:
+            person_ids = self.person_ids
+        # JSON 으로 들어온 값은 타입이 틀릴 수 있음 - 아래에서 AttributeError / TypeError 가 나지 않도록
+        if description is not None and not isinstance(description, str):
+            raise ValueError(f'잘못된 지출 항목: {description!r}')
+        if not isinstance(participants, (list, tuple)) or not all(isinstance(p, str) for p in participants):
+            raise ValueError(f'참가자는 이름 목록이어야 합니다: {participants!r}')
+        description = (description or '').strip()
+        if not description:
+            raise ValueError('지출 항목이 비어 있습니다')
+        if currency not in CURRENCIES:
+            raise ValueError(f'지원하지 않는 통화: {currency}')
+        if not isinstance(payer, str) or payer not in person_ids:
+            raise ValueError(f'없는 지불자: {payer}')
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise ValueError(f'잘못된 금액: {amount}')
+        # nan / inf 는 장부에 한 번 들어가면 지출을 지워도 빠지지 않음 (nan - nan = nan)
+        if not math.isfinite(amount):
+            raise ValueError(f'잘못된 금액: {amount}')
+        date = parse_date(date) or datetime.date.today().isoformat()
+
+        if not participants:
+            participants = person_ids
+
+        # 유효한 참가자만 비트마스크로
+        participants = mask_of(person_ids[p] for p in participants if p in person_ids)
+        if not participants:
+            raise ValueError('유효한 참가자가 없습니다')
+
+        return {
+            'id': expense_id,
+            'description': description,
+            'amount': amount,
+            'currency': currency,
+            'payer': person_ids[payer],
+            'participants': participants,
+            'date': date
+        }
+
+    def rebuild_rate_index(self):
+        self.rate_dates = {currency: [point[0] for point in history]
+                           for currency, history in self.data['rate_history'].items()}
+        self.rate_memo = {}
+
+    def set_rate(self, currency, date, rate):
+        """currency 에 date 부터 적용할 환율 (rate 가 None 이면 그 날짜의 환율을 지움)"""
+        # 목록은 새로 만들어 교체 - to_snapshot() 이 얕은 복사만 해도 되도록
+        history = with_rate(self.data['rate_history'].get(currency, []), date, rate)
+        if history:
+            self.data['rate_history'][currency] = history
+        else:
+            self.data['rate_history'].pop(currency, None)
+        dates = [point[0] for point in history]
+        if dates != self.rate_dates.get(currency, []):
+            # 구간이 나뉘거나 합쳐짐 - date 부터 다음 날짜별 환율 전까지의 날짜만 구간을 옮김
+            index = bisect.bisect_right(dates, date)
+            end = dates[index] if index < len(dates) else None
+            moved = [key for key in self.date_ledger
+                     if key[0] == currency and key[1] is not None and key[1] >= date and
+                     (end is None or key[1] < end)]
+            self.bucket_dates(moved, sign=-1)
+            self.rate_dates[currency] = dates
+            self.bucket_dates(moved)
+        # 바뀐 날짜 이후만 다시 환산 (그 전 날짜는 적용되는 환율이 그대로)
+        self.forget_rates(lambda c, d: c == currency and d is not None and d >= date)
+
+    def forget_rates(self, affected):
+        """affected(통화, 날짜) 가 참인 환산 배율 버리기"""
+        for key in [key for key in self.rate_memo if affected(*key)]:
+            del self.rate_memo[key]
+
+    def period_start(self, currency, date=None):
+        """date 에 적용되는 날짜별 환율의 시작 날짜 (날짜가 없거나 첫 날짜별 환율보다 이르면 None = 기본 환율)"""
+        dates = self.rate_dates.get(currency)
+        if date and dates:
+            index = bisect.bisect_right(dates, date) - 1
+            if index >= 0:
+                return dates[index]
+        return None
+
+    def rate_on(self, currency, date=None):
+        """date 에 적용되는 1 외화 = ? 원 (KRW 는 1, 환율이 없으면 None)"""
+        if currency == 'KRW':
+            return 1
+        dates = self.rate_dates.get(currency)
+        if date and dates:
+            index = bisect.bisect_right(dates, date) - 1
+            if index >= 0:
+                return self.data['rate_history'][currency][index][1]
+        return self.data['exchange_rates'].get(currency)
+
+    def rate_factor(self, currency, date=None):
+        """원화 환산 배율 (환율이 없으면 1 - 그대로 사용) - (통화, 날짜)마다 한 번만 찾음"""
+        key = (currency, date)
+        factor = self.rate_memo.get(key)
+        if factor is None:
+            factor = self.rate_memo[key] = self.rate_on(currency, date) or 1
+        return factor
+
+    def to_krw(self, amount, currency, date=None):
+        """원화 환산 (환율이 없으면 그대로 사용)"""
+        return amount * self.rate_factor(currency, date)
+
+    def calculate_settlement(self):
+        """정산 계산 (모든 금액을 원화로 환산)"""
+        data = self.data
+        if not data['people'] or not data['expenses']:
+            return {}
+
+        balances = {person_id: 0 for person_id in data['people']}
+
+        for expense in data['expenses'].values():
+            amount = expense['amount']
+            currency = expense.get('currency', 'JPY')
+            payer = expense['payer']
+            participants = expense['participants']
+
+            # 원화로 환산 (지출 날짜의 환율)
+            krw_amount = self.to_krw(amount, currency, expense.get('date'))
+
+            share_per_person = krw_amount / bit_count(participants)
+
+            balances[payer] += krw_amount
+
+            for participant in iter_bits(participants):
+                balances[participant] -= share_per_person
+
+        return {data['people'][person_id]: balance for person_id, balance in balances.items()}
+
+    def apply_expense_to_ledger(self, expense, sign=1):
+        """지출 하나를 장부(구간별)와 날짜별 장부에 반영 (sign=-1 이면 취소) - 원래 금액 기준"""
+        amount = expense['amount']
+        date_key = rate_key(expense)
+        key = (date_key[0], self.period_start(*date_key))
+        share_per_person = amount / bit_count(expense['participants'])
+
+        ledger = self.ledger
+        by_date = self.date_ledger.setdefault(date_key, {})
+        payer = expense['payer']
+        row = ledger[payer]
+        row[key] = row.get(key, 0) + sign * amount
+        by_date[payer] = by_date.get(payer, 0) + sign * amount
+        for participant in iter_bits(expense['participants']):
+            row = ledger[participant]
+            row[key] = row.get(key, 0) - sign * share_per_person
+            by_date[participant] = by_date.get(participant, 0) - sign * share_per_person
+        self.key_totals[key] = self.key_totals.get(key, 0) + sign * amount
+        self.date_totals[date_key] = self.date_totals.get(date_key, 0) + sign * amount
+
+    def bucket_dates(self, date_keys, sign=1):
+        """날짜별 장부의 date_keys 를 지금 구간의 장부에 더함 (sign=-1 이면 뺌)"""
+        ledger = self.ledger
+        key_totals = self.key_totals
+        for date_key in date_keys:
+            key = (date_key[0], self.period_start(*date_key))
+            for person_id, amount in self.date_ledger[date_key].items():
+                row = ledger[person_id]
+                row[key] = row.get(key, 0) + sign * amount
+            key_totals[key] = key_totals.get(key, 0) + sign * self.date_totals.get(date_key, 0)
+
+    def rebuild_ledger(self):
+        """장부 전체 재구성 (로드 직후)"""
+        self.ledger = {person_id: {} for person_id in self.data['people']}
+        self.key_totals = {}
+        self.date_ledger = {}
+        self.date_totals = {}
+
+        # SQLite 는 집계 SQL 로, 바이너리 스냅샷은 열에서 바로 계산 (지출 dict 를 만들지 않음)
+        # 집계는 (통화, 날짜)별 - 날짜별 장부로 받고 구간별 장부는 날짜 키마다 한 번씩 더해서 만듦
+        aggregated = self.storage.aggregate_ledger()
+        if aggregated is None and hasattr(self.data['expenses'], 'aggregate_ledger'):
+            aggregated = self.data['expenses'].aggregate_ledger()
+        if aggregated is not None:
+            balances, totals = aggregated
+            for person_id, row in balances.items():
+                for date_key, amount in row.items():
+                    self.date_ledger.setdefault(date_key, {})[person_id] = amount
+            self.date_totals.update(totals)
+            self.bucket_dates(self.date_ledger)
+            return
+
+        for expense in self.data['expenses'].values():
+            self.apply_expense_to_ledger(expense)
+
+    def rebuild_columnar(self):
+        if settlement_engine == 'numpy':
+            self.columnar = ColumnarExpenses.from_data(self.data, CURRENCIES)
+        else:
+            self.columnar = None
+
+    def sync_columnar(self):
+        """엔진이 바뀌었으면 열 저장소를 만들거나 버림"""
+        if (settlement_engine == 'numpy') != (self.columnar is not None):
+            self.rebuild_columnar()
+
+    def get_balances(self):
+        """선택된 엔진으로 이름별 정산 결과 읽기 (ledger: O(사람 수 x (통화, 환율 구간) 수))"""
+        data = self.data
+        if not data['people'] or not data['expenses']:
+            return {}
+
+        self.sync_columnar()
+        if settlement_engine == 'numpy':
+            raw = self.columnar.balances(self.rate_factor)
+        elif settlement_engine == 'python':
+            by_name = self.calculate_settlement()
+            raw = {person_id: by_name[name] for person_id, name in data['people'].items()}
+        else:
+            factor = self.rate_factor
+            ledger = self.ledger
+            raw = {person_id: sum(amount * factor(*key) for key, amount in ledger[person_id].items())
+                   for person_id in data['people']}
+        # 차액 누적으로 생기는 미세한 오차(-0.0000001 등)는 0으로 정리
+        balances = {name: round(raw[person_id], 6) + 0.0 for person_id, name in data['people'].items()}
+
+        if VERIFY_LEDGER:
+            expected = self.calculate_settlement()
+            mismatched = [person for person in expected
+                          if not math.isclose(expected[person], balances[person],
+                                              rel_tol=1e-9, abs_tol=LEDGER_TOLERANCE)]
+            if mismatched:
+                logger.error('정산 장부 불일치 (%s, %s): %s', self.trip_id, settlement_engine, mismatched)
+                self.rebuild_ledger()
+                self.rebuild_columnar()
+                return expected
+
+        return balances
+
+    def get_totals(self):
+        """통화별 총 지출, 통화별 원화 환산액, 원화 환산 총계 - O((통화, 환율 구간) 수)
+
+        통화별 원화 환산액은 그 통화의 환율이 하나도 없으면 None (총계에는 금액 그대로 더함).
+        """
+        data = self.data
+        total_by_currency = {currency: 0 for currency in CURRENCIES}
+        krw_by_currency = {currency: 0 for currency in CURRENCIES}
+        # 지출이 모두 지워지면 누적 오차 없이 0으로
+        if data['expenses']:
+            self.sync_columnar()
+            if settlement_engine == 'numpy':
+                totals = self.columnar.totals_by_key()
+            else:
+                totals = self.key_totals
+            for (currency, date), amount in totals.items():
+                total_by_currency[currency] += amount
+                krw_by_currency[currency] += self.to_krw(amount, currency, date)
+        for currency in CURRENCIES:
+            total_by_currency[currency] = round(total_by_currency[currency], 6) + 0.0
+            krw_by_currency[currency] = round(krw_by_currency[currency], 6) + 0.0
+            if currency != 'KRW' and not (data['exchange_rates'].get(currency) or
+                                          data['rate_history'].get(currency)):
+                krw_by_currency[currency] = None
+        total_expense_krw = sum(total_by_currency[currency] if krw is None else krw
+                                for currency, krw in krw_by_currency.items())
+        return total_by_currency, krw_by_currency, total_expense_krw
+
+    @property
+    def version(self):
+        """데이터 버전 - 변경마다 1씩 커지는 seq (ETag, 화면 캐시 키)"""
+        return self.data.get('seq', 0)
+
+    def summary(self):
+        """정산 화면 값 (잔액, 통화별 합계와 원화 환산액, 원화 총계) - 버전마다 한 번만 계산"""
+        if self.view_cache.get('version') != self.version:
+            with metrics.phase('settlement'):
+                total_by_currency, krw_by_currency, total_expense_krw = self.get_totals()
+                self.view_cache = {
+                    'version': self.version,
+                    'balances': self.get_balances(),
+                    'total_by_currency': total_by_currency,
+                    'krw_by_currency': krw_by_currency,
+                    'total_expense_krw': total_expense_krw,
+                }
+        return self.view_cache
+
+    def transfers(self, exact=False):
+        """송금 안내 - summary() 와 같이 버전마다 한 번만 계산"""
+        view = self.summary()
+        key = 'transfers_exact' if exact else 'transfers'
+        if key not in view:
+            with metrics.phase('settlement'):
+                view[key] = plan_transfers(view['balances'], exact=exact)
+        return view[key]
+
+    def participant_names(self, mask):
+        return [self.data['people'][person_id] for person_id in iter_bits(mask)]
+
+    def expense_json(self, expense):
+        """API 응답용 - 사람 id 대신 이름으로"""
+        return dict(expense,
+                    payer=self.data['people'][expense['payer']],
+                    participants=self.participant_names(expense['participants']))
+
+    def person_expenses(self, person_id):
+        """person_id 가 지불했거나 참가한 지출 목록 (저장소가 찾아 주면 그 목록으로)"""
+        expenses = self.data['expenses']
+        # 아직 기록 중인 변경이 있으면 저장소의 색인은 메모리보다 뒤처져 있으므로 직접 훑음
+        # (변경은 lock 안에서 대기열에 들어가므로, busy() 가 거짓이면 저장소에 다 들어가 있음)
+        ids = None if self.committer.busy() else self.storage.person_expense_ids(person_id)
+        if ids is not None:
+            return [expenses[expense_id] for expense_id in ids if expense_id in expenses]
+        return [exp for exp in expenses.values()
+                if exp['payer'] == person_id or has_bit(exp['participants'], person_id)]
+
+    def expense_page(self, after=0, limit=50, match=None):
+        """id 가 after 보다 큰 지출을 id 순으로 최대 limit 개, 다음 페이지 커서(없으면 None)
+
+        match 가 있으면 match(지출) 이 참인 것만 - 조건에 맞는 지출을 찾을 때까지만 훑음.
+        """
+        order = self.expense_order
+        expenses = self.data['expenses']
+        page = []
+        for index in range(bisect.bisect_right(order, after), len(order)):
+            expense = expenses[order[index]]
+            if match is None or match(expense):
+                if len(page) == limit:
+                    return page, page[-1]['id']
+                page.append(expense)
+        return page, None
+
+    def expense_numbers(self, expense):
+        """(환율, 원화 환산액(환율이 있을 때만), 1인당 몫, 몫의 통화) - 지출·환율마다 한 번만 계산"""
+        currency = expense.get('currency', 'JPY')
+        rate = self.rate_on(currency, expense.get('date'))
+        numbers = self.expense_numbers_cache.get(expense['id'])
+        if numbers is None or numbers[0] != rate:
+            amount = expense['amount']
+            numbers = (rate,
+                       amount * rate if rate and currency != 'KRW' else None,
+                       amount * (rate or 1) / bit_count(expense['participants']),
+                       'KRW' if rate else currency)
+            self.expense_numbers_cache[expense['id']] = numbers
+        return numbers
+
+    def expense_view(self, expense):
+        """화면 표시용 지출 - 이름, 원화 환산액(환율이 있을 때만), 1인당 몫과 그 통화"""
+        _, krw_amount, share, share_currency = self.expense_numbers(expense)
+        return dict(self.expense_json(expense),
+                    currency=expense.get('currency', 'JPY'),
+                    krw_amount=krw_amount,
+                    share=share,
+                    share_currency=share_currency)
+
+    def row_fragment(self, expense, render):
+        """지출 한 줄 HTML - 표시 값이 그대로면 캐시된 조각, 아니면 render(표시용 지출)"""
+        numbers = self.expense_numbers(expense)
+        entry = self.row_fragments.get(expense['id'])
+        if entry is not None and entry[0] == numbers:
+            self.row_fragments.move_to_end(expense['id'])
+            return entry[1]
+        html = render(self.expense_view(expense))
+        self.row_fragments[expense['id']] = (numbers, html)
+        if len(self.row_fragments) > ROW_FRAGMENT_CACHE:
+            self.row_fragments.popitem(last=False)
+        return html
+
+    def fragment(self, key, render):
+        """버전이 같으면 캐시된 HTML 조각, 아니면 render()"""
+        entry = self.fragments.get(key)
+        if entry is None or entry[0] != self.version:
+            entry = (self.version, render())
+            self.fragments[key] = entry
+        return entry[1]
+
+    def estimated_bytes(self):
+        """캐시 메모리 계산용 대략적인 크기"""
+        return (TRIP_BYTES + len(self.data['expenses']) * EXPENSE_BYTES +
+                len(self.data['people']) * PERSON_BYTES +
+                (len(self.row_fragments) + len(self.fragments)) * FRAGMENT_BYTES)
+
+    def close(self):
+        """남은 변경을 기록하고 저장소를 닫음"""
+        self.committer.close()
+        self.storage.close()
+        if self.process_lock is not None:
+            self.process_lock.close()
+
+
+class TripCache:
+    """자주 쓰는 여행을 메모리에 두는 LRU 캐시
+
+    여행 수가 max_trips 를 넘거나 추정 메모리가 max_bytes 를 넘으면 가장 오래 안 쓴 여행부터 내림.
+    요청이 쓰는 중(acquire ~ release)이거나 기록이 남은 여행은 내리지 않음.
+    """
+
+    def __init__(self, make_trip, max_trips=128, max_bytes=256 * 1024 * 1024):
+        self.make_trip = make_trip
+        self.max_trips = max_trips
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.trips = OrderedDict()  # 여행 id -> Trip (뒤쪽이 최근에 쓴 것)
+        self.sizes = {}             # 여행 id -> 마지막으로 잰 추정 크기
+        self.pins = {}              # 여행 id -> 쓰는 중인 요청 수
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, trip_id, create=True):
+        """여행을 꺼내고 쓰는 중으로 표시 (없으면 저장소에서 읽음) - 끝나면 release()
+
+        create 가 거짓이면 아직 만들어지지 않은 여행은 만들지 않고 None.
+        """
+        with self.lock:
+            trip = self.trips.get(trip_id)
+            if trip is not None:
+                self.trips.move_to_end(trip_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+                trip = self.make_trip(trip_id, create)
+                if trip is None:
+                    return None
+                self.trips[trip_id] = trip
+                self.sizes[trip_id] = 0
+            self.pins[trip_id] = self.pins.get(trip_id, 0) + 1
+            return trip
+
+    def release(self, trip):
+        with self.lock:
+            trip_id = trip.trip_id
+            self.pins[trip_id] -= 1
+            if not self.pins[trip_id]:
+                del self.pins[trip_id]
+            size = trip.estimated_bytes()
+            self.total_bytes += size - self.sizes[trip_id]
+            self.sizes[trip_id] = size
+            self.evict()
+
+    def evict(self):
+        """한도를 넘는 동안 오래된 여행부터 내림 (lock 을 잡은 상태에서 호출)"""
+        for trip_id in list(self.trips):
+            if len(self.trips) <= self.max_trips and self.total_bytes <= self.max_bytes:
+                break
+            trip = self.trips[trip_id]
+            if trip_id in self.pins or trip.committer.busy():
+                continue
+            del self.trips[trip_id]
+            self.total_bytes -= self.sizes.pop(trip_id)
+            self.evictions += 1
+            trip.close()
+
+    def loaded(self):
+        """지금 메모리에 있는 여행들"""
+        with self.lock:
+            return list(self.trips.values())
+
+    def close(self):
+        """모든 여행의 남은 변경을 기록하고 닫음 (서버 종료 시)"""
+        with self.lock:
+            trips, self.trips = list(self.trips.values()), OrderedDict()
+            self.sizes.clear()
+            self.total_bytes = 0
+        for trip in trips:
+            try:
+                trip.close()
+            except Exception:
+                logger.exception('여행 %s 을 닫지 못했습니다', trip.trip_id)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'trips': len(self.trips),
+                'max_trips': self.max_trips,
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }